@@ -0,0 +1,2 @@
+from .profiling import profile
+from .unitofwork import session
@@ -0,0 +1,473 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+asyncio transport for parse_rest (Python 3 only).
+
+The blocking classes expose coroutine versions of their network calls
+(Queryset.afetch, ParseResource.asave, ParseBatcher.abatch, Function.acall
+and friends) which end up here. Requests are built by the same
+ParseBase._prepare_request used by execute() and errors are mapped with
+connection.http_error, so both transports behave the same. Connections are
+kept alive and pooled per api_root, one set of pools per event loop.
+"""
+import asyncio
+import collections
+import functools
+import io
+import ssl
+import time
+import weakref
+import zlib
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+from . import compression, metrics, profiling
+from .connection import (ParseBase, DEFAULT_THROTTLE, http_error, codec_for, error_content,
+                         retry_policy_for)
+from .pool import DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT, DEFAULT_TIMEOUT, IDEMPOTENT_METHODS, network_error
+from .query import PageCursor, concurrency_for, object_id_ranges, prefetch_plan, fill_prefetched
+
+# Upper bound on sockets one pool will have open at once. HTTP/1.1 can't
+# multiplex, so this also caps the requests in flight per api_root
+DEFAULT_MAX_CONNECTIONS = 100
+
+# event loop -> {api_root: AsyncConnectionPool}
+_POOLS = weakref.WeakKeyDictionary()
+
+
+class AsyncResponse(object):
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self):
+        return self.body
+
+
+class AsyncConnection(object):
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.time()
+
+    def dropped(self):
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool(object):
+    '''
+        Keep-alive HTTP/1.1 connections to one api_root for one event loop
+    '''
+    def __init__(self, api_root, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 timeout=DEFAULT_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS):
+        parsed = urlparse(api_root)
+        if parsed.scheme not in ('http', 'https'):
+            raise ValueError('Unsupported scheme for connection pool: %s' % api_root)
+        self.api_root = api_root
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.scheme == 'https' else 80)
+        default_port = 443 if self.scheme == 'https' else 80
+        self.host_header = self.host if self.port == default_port else '%s:%s' % (self.host, self.port)
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = collections.deque()
+        self._slots = asyncio.Semaphore(max_connections)
+
+        self.num_connections = 0
+        self.num_requests = 0
+        self.num_reused = 0
+
+    def __repr__(self):
+        return u'<AsyncConnectionPool: %s, idle=%s, size=%s>' % (self.api_root, len(self._idle), self.pool_size)
+
+    async def _new_conn(self):
+        ssl_context = ssl.create_default_context() if self.scheme == 'https' else None
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=ssl_context)
+        self.num_connections += 1
+        return AsyncConnection(reader, writer)
+
+    async def _get_conn(self):
+        now = time.time()
+        while self._idle:
+            conn = self._idle.pop()
+            if (self.idle_timeout and now - conn.last_used > self.idle_timeout) or conn.dropped():
+                conn.close()
+                continue
+            return conn, True
+        return await self._new_conn(), False
+
+    def _put_conn(self, conn):
+        if len(self._idle) < self.pool_size and not conn.dropped():
+            conn.last_used = time.time()
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    def clear(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    async def _send(self, conn, method, path, body, headers):
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % self.host_header]
+        lines.extend('%s: %s' % (k, v) for k, v in headers.items())
+        lines.append('Content-Length: %d' % len(body))
+        conn.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await conn.writer.drain()
+
+    async def _roundtrip(self, conn, method, path, body, headers, sent):
+        await self._send(conn, method, path, body, headers)
+        sent[0] = True
+        return await _read_response(conn.reader, method)
+
+    async def urlopen(self, method, url, body=b'', headers=None):
+        '''
+            Make a request over a pooled connection, raising HTTPError and
+            URLError the same way the blocking pool does
+        '''
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        headers = headers or {}
+
+        async with self._slots:
+            conn, reused = await self._get_conn()
+            try:
+                sent = [False]
+                try:
+                    response, will_close = await asyncio.wait_for(
+                        self._roundtrip(conn, method, path, body, headers, sent), self.timeout)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    conn.close()
+                    if not reused or (sent[0] and method not in IDEMPOTENT_METHODS):
+                        # the server may have acted on it already
+                        raise
+                    # stale keep-alive connection, try once more on a new one
+                    conn, reused, sent = await self._new_conn(), False, [False]
+                    response, will_close = await asyncio.wait_for(
+                        self._roundtrip(conn, method, path, body, headers, sent), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                conn.close()
+                raise network_error(e, sent[0])
+
+            self.num_requests += 1
+            if reused:
+                self.num_reused += 1
+            if will_close:
+                conn.close()
+            else:
+                self._put_conn(conn)
+
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(response.body))
+        return response
+
+
+async def _read_response(reader, method):
+    '''Read one HTTP/1.1 response. Returns (AsyncResponse, will_close)'''
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError('Connection closed by server')
+    parts = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    version, status = parts[0], int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ''
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    connection = headers.get('connection', '').lower()
+    will_close = connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive')
+
+    if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+        body = b''
+    elif 'chunked' in headers.get('transfer-encoding', '').lower():
+        parts = []
+        while True:
+            size = int(((await reader.readline()).split(b';', 1)[0]).strip(), 16)
+            if size == 0:
+                # skip any trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            parts.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(parts)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        will_close = True
+
+    return AsyncResponse(status, reason, headers, body), will_close
+
+
+def get_pool(api_root, keys=None):
+    '''Return the connection pool for api_root on the running event loop'''
+    loop = asyncio.get_event_loop()
+    pools = _POOLS.get(loop)
+    if pools is None:
+        pools = _POOLS[loop] = {}
+    pool = pools.get(api_root)
+    if pool is None:
+        keys = keys or {}
+        pool = pools[api_root] = AsyncConnectionPool(
+            api_root,
+            pool_size=keys.get('pool_size') or DEFAULT_POOL_SIZE,
+            idle_timeout=keys.get('pool_idle_timeout', DEFAULT_IDLE_TIMEOUT),
+            timeout=keys.get('pool_timeout', DEFAULT_TIMEOUT),
+            max_connections=keys.get('async_max_connections') or DEFAULT_MAX_CONNECTIONS)
+    return pool
+
+
+async def close_pools():
+    '''Close the idle connections of every pool on the running event loop'''
+    for pool in _POOLS.pop(asyncio.get_event_loop(), {}).values():
+        pool.clear()
+
+
+async def throttle_wait(throttle):
+    '''
+        Async equivalent of entering a throttle. The round is recorded as
+        soon as it's let through since other coroutines will be checking
+        the throttle while this request is in flight.
+    '''
+    while True:
+        wait = throttle.wait_time()
+        if wait <= 0:
+            break
+        await asyncio.sleep(wait)
+    throttle.record()
+
+
+async def execute(cls, uri, http_verb, extra_headers=None, _app_id=None, _user=None, _throttle=None,
+                  _high_volume=False, _retry=None, retry_on_temp_error=True, error_wait=None,
+                  max_error_wait=None, **kw):
+    '''Coroutine version of ParseBase.execute()'''
+    _throttle = _throttle or DEFAULT_THROTTLE
+    prepare = functools.partial(cls._prepare_request, uri, http_verb, extra_headers=extra_headers,
+                                _app_id=_app_id, _user=_user, **kw)
+    if _user is not None and not _user.is_authenticated():
+        # the user is logged in first, with blocking requests of its own
+        request = await asyncio.get_event_loop().run_in_executor(None, prepare)
+    else:
+        request = prepare()
+    pool = get_pool(request.api_root, request.keys)
+    data = b'' if request.data is None else request.data
+    json_codec = codec_for(request.keys)
+
+    retry = None
+    if retry_on_temp_error:
+        retry = retry_policy_for(request.keys, _retry).start(http_verb, request.url, error_wait, max_error_wait)
+
+    while 1:
+        timer = metrics.begin(request.http_verb, request.url, request.keys.get('app_id'), request.api_root,
+                              request.num_operations, len(data), retry.attempt if retry is not None else 1,
+                              request.body_size)
+        try:
+            throttle = _throttle.calls_per(request.num_operations)
+            await throttle_wait(throttle)
+            timer.sent()
+            started = time.time()
+            response = await pool.urlopen(request.http_verb, request.url, data, request.headers)
+            raw = response.read()
+            try:
+                content = compression.decompress(raw, compression.content_encoding(response.headers))
+            except zlib.error as e:
+                raise network_error(e)
+            throttle.feedback(time.time() - started)
+            if profiling.ACTIVE:
+                # other requests run while this one awaits, so it can't be a phase
+                profiling.add('network', time.time() - started)
+            timer.finished(response.status, len(raw), uncompressed_bytes_received=len(content))
+            if retry is not None:
+                retry.succeeded()
+            with profiling.phase('json_decode'):
+                return json_codec.loads(content)
+        except HTTPError as e:
+            throttle.feedback(time.time() - started, status=e.code)
+            content = e.read()
+            timer.finished(e.code, len(content))
+            delay = retry and retry.failed(status=e.code, headers=e.headers)
+            if delay is None:
+                raise http_error(e.code, error_content(content, e.headers), e)
+            LOGGER.warning(u'%s from %s %s. Retrying in %.2fs' % (e.code, http_verb, request.url, delay))
+            await asyncio.sleep(delay)
+        except URLError as e:
+            timer.finished(error=e)
+            delay = retry and retry.failed(error=e)
+            if delay is None:
+                if retry is not None:
+                    LOGGER.error('Giving up after %s attempts: %s' % (retry.attempt, e))
+                raise
+            LOGGER.warning(u'Temp error during execute(). Waiting %.2fs: %s' % (delay, e))
+            await asyncio.sleep(delay)
+
+
+async def execute_batch_request(request, _using=None, _as_user=None, _throttle=None):
+    '''
+        Run one of the dictionaries produced by execute(batch=True) as a
+        call of its own
+    '''
+    path = request['path']
+    root_path = urlparse(ParseBase.api_root_for(_using)).path.rstrip('/')
+    if root_path and path.startswith(root_path + '/'):
+        path = path[len(root_path):]
+    return await execute(ParseBase, path, request['method'], _app_id=_using, _user=_as_user,
+                         _throttle=_throttle, **request.get('body', {}))
+
+
+async def _get(cursor, kw):
+    '''GET one page for cursor, going through the query cache'''
+    res, generation = cursor.cached(kw)
+    if res is None:
+        res = await execute(cursor.model_class, cursor.uri, 'GET', **kw)
+        cursor.remember(kw, res, generation)
+    return res
+
+
+async def fetch(queryset, count=False):
+    '''Coroutine version of Queryset._fetch()'''
+    options = queryset._fetch_options()
+    klass = queryset._manager.model_class
+
+    if count:
+        using = options.pop('_using', None)
+        as_user = options.pop('_as_user', None)
+        throttle = options.pop('_throttle', None)
+        for key in [k for k in options if k.startswith('_')]:
+            del options[key]
+        options.update({"count": 1, "limit": 0})
+        res = await execute(klass, klass.ENDPOINT_ROOT, 'GET', _app_id=using, _user=as_user,
+                            _throttle=throttle, **options)
+        return res.get('count')
+
+    cursor = PageCursor(klass, options)
+    results = []
+    if cursor.high_volume and cursor.partitions and cursor.partitions > 1:
+        slots = asyncio.Semaphore(concurrency_for(cursor.partitions, cursor.throttle))
+
+        async def scan(object_id_range):
+            part = PageCursor(klass, options, object_id_range=object_id_range)
+            found = []
+            async with slots:
+                while not part.done:
+                    res = await _get(part, part.request())
+                    found.extend(part.decode(part.advance(res)))
+            return found
+
+        for part in await asyncio.gather(*[scan(r) for r in object_id_ranges(cursor.partitions)]):
+            results.extend(part)
+        return await prefetch(cursor, results)
+
+    if cursor.parallel and cursor.parallel > 1 and not cursor.high_volume:
+        n = concurrency_for(cursor.parallel, cursor.throttle)
+        while not cursor.done:
+            pages = await asyncio.gather(*[_get(cursor, kw) for kw in cursor.requests_ahead(n)])
+            for res in pages:
+                if cursor.done:
+                    break
+                results.extend(cursor.decode(cursor.advance(res)))
+        return await prefetch(cursor, results)
+
+    while not cursor.done:
+        res = await _get(cursor, cursor.request())
+        results.extend(cursor.decode(cursor.advance(res)))
+    return await prefetch(cursor, results)
+
+
+async def prefetch(cursor, results):
+    '''Coroutine version of QueryManager._prefetch(), running the lookups together'''
+    if not cursor.prefetch or not cursor.returns_objects:
+        return results
+    querysets, slots = prefetch_plan(results, cursor.prefetch, cursor.using, cursor.as_user, cursor.throttle)
+    loaded = await asyncio.gather(*[fetch(qs) for qs in querysets])
+    fill_prefetched(slots, [obj for objs in loaded for obj in objs])
+    return results
+
+
+async def retrieve(cls, resource_id, _using=None, _as_user=None, _throttle=None):
+    '''Coroutine version of ParseResource.retrieve()'''
+    obj = cls._cached(resource_id, _using=_using, _as_user=_as_user)
+    if obj is not None:
+        return obj
+    res = await execute(cls, '/' + resource_id, 'GET', _app_id=_using, _user=_as_user)
+    return cls._from_parse(res, _using=_using, _as_user=_as_user, _throttle=_throttle)
+
+
+async def save(obj, _using=None, _as_user=None, _throttle=None):
+    '''Coroutine version of ParseResource.save()'''
+    using = _using or getattr(obj, '_using', None)
+    as_user = _as_user or getattr(obj, '_as_user', None)
+    call = obj.save(batch=True, _using=using, _as_user=as_user)
+    if call is None:
+        # nothing changed
+        return None
+    request, callback = call
+    response = await execute_batch_request(request, using, as_user, _throttle)
+    return callback(response)
+
+
+async def delete(obj, _using=None, _as_user=None, _throttle=None):
+    '''Coroutine version of ParseResource.delete()'''
+    using = _using or getattr(obj, '_using', None)
+    as_user = _as_user or getattr(obj, '_as_user', None)
+    request, callback = obj.delete(batch=True, _using=using, _as_user=as_user)
+    response = await execute_batch_request(request, using, as_user, _throttle)
+    return callback(response)
+
+
+async def batch(batcher, methods, _using=None, _as_user=None, _throttle=None, max_in_flight=1):
+    '''Coroutine version of ParseBatcher.batch()'''
+    queries_and_callbacks = batcher._prepare_chunks(methods, _throttle)
+    slots = asyncio.Semaphore(max(max_in_flight, 1))
+    failed = []
+
+    async def send(queries):
+        async with slots:
+            if failed:
+                # a request failed as a whole: the rest aren't sent
+                return None
+            try:
+                return await execute(batcher.__class__, "", "POST", requests=queries, _app_id=_using,
+                                     _user=_as_user, _throttle=_throttle)
+            except Exception as e:
+                failed.append(e)
+                LOGGER.warning(u'Batch request of %s operations failed: %s' % (len(queries), e))
+                return e
+
+    all_responses = await asyncio.gather(*[send(queries) for queries, _, _ in queries_and_callbacks])
+    batcher._finish(queries_and_callbacks, all_responses)
+
+
+async def call(function, _using=None, _as_user=None, _throttle=None, **kwargs):
+    '''Coroutine version of Function.__call__()'''
+    return await execute(function.__class__, '/' + function.name, 'POST', _app_id=_using, _user=_as_user,
+                         _throttle=_throttle, **kwargs)
@@ -0,0 +1,24 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmarks for parse_rest. These don't talk to Parse and aren't part of the
+test suite; run a module directly, e.g.
+
+    python -m parse_rest.benchmarks.micro
+    python -m parse_rest.benchmarks.suite --output results.json
+
+suite runs the client end to end against server.StandInServer, a local
+stand-in for the Parse API.
+"""
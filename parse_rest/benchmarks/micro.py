@@ -0,0 +1,96 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Microbenchmarks for the CPU bound parts of decoding query results: JSON,
+type conversion and building objects, each on its own and together.
+
+    python -m parse_rest.benchmarks.micro [rows]
+"""
+from __future__ import print_function, division
+
+from builtins import range
+
+import json
+import sys
+import timeit
+
+import dateutil.parser
+
+from parse_rest import codec, profiling
+from parse_rest.datatypes import Date, Object, ParseType, Pointer
+
+
+class BenchmarkRow(Object):
+    pass
+
+
+def make_rows(n):
+    """a page of n rows shaped like a Parse query response"""
+    return [{
+        'objectId': 'obj%07d' % i,
+        'createdAt': '2020-01-%02dT10:%02d:%02d.%03dZ' % (i % 28 + 1, i % 60, (i * 7) % 60, i % 1000),
+        'updatedAt': '2020-02-%02dT11:%02d:%02d.%03dZ' % (i % 28 + 1, i % 60, (i * 3) % 60, i % 1000),
+        'score': i,
+        'playedAt': {'__type': 'Date', 'iso': '2019-12-31T23:59:%02d.%03dZ' % (i % 60, i % 1000)},
+    } for i in range(n)]
+
+
+def make_pointers(n):
+    return [{'__type': 'Pointer', 'className': 'BenchmarkPlayer', 'objectId': 'ply%07d' % i} for i in range(n)]
+
+
+def bench(label, func, rows, repeat=5):
+    """run func over rows repeat times and report the best time per row"""
+    number = max(1, 20000 // len(rows))
+    best = min(timeit.repeat(lambda: func(rows), number=number, repeat=repeat)) / number
+    print('%-36s %9.2f us/row' % (label, best / len(rows) * 1e6))
+    return best
+
+
+def main(n=1000):
+    rows = make_rows(n)
+    dates = [row['createdAt'] for row in rows]
+    print('%d rows, best of 5\n' % n)
+
+    slow = bench('dateutil.parser.parse', lambda ds: [dateutil.parser.parse(d) for d in ds], dates)
+    fast = bench('Date._from_str', lambda ds: [Date._from_str(d) for d in ds], dates)
+    print('%-36s %9.1fx\n' % ('date speedup', slow / fast))
+
+    page = json.dumps({'results': rows}).encode('utf8')
+    bench('json.loads', lambda rs: json.loads(page), rows)
+    for name in sorted(codec.CODECS):
+        json_codec = codec.get_codec(name)
+        bench('%s codec loads' % name, lambda rs: json_codec.loads(page), rows)
+        bench('%s codec dumps' % name, lambda rs: json_codec.dumps(rs), rows)
+    fields = [dict((k, v) for k, v in r.items() if k not in ('createdAt', 'updatedAt')) for r in rows]
+    bench('ParseResource.__init__', lambda fs: [BenchmarkRow(**f) for f in fs], fields)
+    played = [r['playedAt'] for r in rows]
+    bench('convert_from_parse Date', lambda ps: [ParseType.convert_from_parse(p) for p in ps], played)
+    pointers = make_pointers(n)
+    bench('convert_from_parse Pointer', lambda ps: [ParseType.convert_from_parse(p) for p in ps], pointers)
+    bench('Pointer.from_native', lambda ps: [Pointer.from_native(**p) for p in ps], pointers)
+    bench('Object.factory', lambda ps: [Object.factory(p['className']) for p in ps], pointers)
+    print()
+
+    plain = bench('decode rows into objects', lambda rs: [BenchmarkRow._from_parse(r) for r in rs], rows)
+    bench('decode rows lazily', lambda rs: [BenchmarkRow._from_parse(r, _lazy=True) for r in rs], rows)
+    bench('decode lazily, read one date', lambda rs: [BenchmarkRow._from_parse(r, _lazy=True).playedAt for r in rs], rows)
+    with profiling.profile():
+        profiled = bench('decode rows, profiling', lambda rs: [BenchmarkRow._from_parse(r) for r in rs], rows)
+    print('%-36s %9.1f%%' % ('profiling overhead', (profiled / plain - 1) * 100))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
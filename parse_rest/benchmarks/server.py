@@ -0,0 +1,446 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+An in-process stand-in for the parts of the Parse REST API parse_rest uses
+(/classes, /batch, /functions, /users and /login), kept in memory. It can
+add latency, enforce a rate limit and inject errors, so the library can be
+measured without a real Parse app:
+
+    with StandInServer(latency=0.005, rate_limit=500) as server:
+        register('app', 'key', api_root=server.url)
+        ...
+"""
+from __future__ import division
+from future import standard_library
+standard_library.install_aliases()
+
+from builtins import object, range
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+import collections
+import datetime
+import json
+import random
+import string
+import threading
+import zlib
+import time
+
+OBJECT_ID_CHARS = string.ascii_letters + string.digits
+
+
+def now_iso():
+    now = datetime.datetime.utcnow()
+    return now.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (now.microsecond // 1000)
+
+
+def new_id(length=10):
+    return ''.join(random.choice(OBJECT_ID_CHARS) for _ in range(length))
+
+
+def comparable(value):
+    """what a stored or queried value is compared by"""
+    if isinstance(value, dict):
+        if value.get('__type') in ('Pointer', 'Object'):
+            return value.get('objectId')
+        if value.get('__type') == 'Date':
+            return value.get('iso')
+    return value
+
+
+def matches(row, where):
+    """whether row satisfies a (subset of Parse's) where clause"""
+    for key, condition in where.items():
+        value = comparable(row.get(key))
+        if isinstance(condition, dict) and not condition.get('__type'):
+            for op, arg in condition.items():
+                arg = [comparable(a) for a in arg] if isinstance(arg, list) else comparable(arg)
+                if op == '$exists':
+                    if (key in row) != bool(arg):
+                        return False
+                    continue
+                if op in ('$in', '$nin'):
+                    if (value in arg) != (op == '$in'):
+                        return False
+                    continue
+                if op == '$ne':
+                    if value == arg:
+                        return False
+                    continue
+                if value is None:
+                    return False
+                if (op == '$gt' and not value > arg) or (op == '$gte' and not value >= arg) or \
+                   (op == '$lt' and not value < arg) or (op == '$lte' and not value <= arg):
+                    return False
+        elif value != comparable(condition):
+            return False
+    return True
+
+
+def order_rows(rows, order):
+    for key in reversed([k for k in order.split(',') if k]):
+        reverse = key.startswith('-')
+        key = key.lstrip('-')
+        rows.sort(key=lambda r: (comparable(r.get(key)) is not None, comparable(r.get(key))), reverse=reverse)
+    return rows
+
+
+class ApiError(Exception):
+    def __init__(self, status, code, error, headers=None):
+        Exception.__init__(self, error)
+        self.status = status
+        self.body = {'code': code, 'error': error}
+        self.headers = headers or {}
+
+
+class Backend(object):
+    """The data and behaviour behind the server, independent of HTTP"""
+    def __init__(self):
+        self.classes = collections.defaultdict(dict)
+        self.sessions = {}
+        self.functions = {}
+        self.lock = threading.RLock()
+
+    def handle(self, method, path, params, session_token=None):
+        """Return (status, body) for one call, or raise ApiError"""
+        parts = [p for p in path.split('/') if p]
+        if parts and parts[0] == '1':
+            parts = parts[1:]
+        if not parts:
+            raise ApiError(404, 101, 'unknown endpoint')
+        if parts[0] == 'batch' and method == 'POST':
+            return 200, [self._batch_one(r, session_token) for r in params.get('requests', [])]
+        if parts[0] == 'functions' and len(parts) == 2:
+            function = self.functions.get(parts[1])
+            return 200, {'result': function(params) if function else params}
+        if parts[0] == 'login':
+            return self.login(params.get('username'), params.get('password'))
+        if parts[0] == 'users':
+            if parts[1:] == ['me']:
+                return self.me(session_token)
+            return self.objects(method, '_User', parts[1:], params)
+        if parts[0] == 'classes' and len(parts) > 1:
+            return self.objects(method, parts[1], parts[2:], params)
+        raise ApiError(404, 101, 'unknown endpoint')
+
+    def _batch_one(self, request, session_token):
+        try:
+            return {'success': self.handle(request['method'], request['path'], request.get('body') or {}, session_token)[1]}
+        except ApiError as e:
+            return {'error': e.body}
+
+    def objects(self, method, class_name, rest, params):
+        table = self.classes[class_name]
+        with self.lock:
+            if not rest:
+                if method == 'POST':
+                    return 201, self.create(class_name, params)
+                if method == 'GET':
+                    return 200, self.query(table, params)
+            else:
+                object_id = rest[0]
+                if object_id not in table:
+                    raise ApiError(404, 101, 'object not found for %s' % method.lower())
+                row = table[object_id]
+                if method == 'GET':
+                    return 200, self.public(row)
+                if method == 'PUT':
+                    self.update(row, params)
+                    return 200, {'updatedAt': row['updatedAt']}
+                if method == 'DELETE':
+                    del table[object_id]
+                    return 200, {}
+        raise ApiError(400, 107, 'unsupported method %s' % method)
+
+    def create(self, class_name, params):
+        table = self.classes[class_name]
+        object_id = new_id()
+        while object_id in table:
+            object_id = new_id()
+        row = {'objectId': object_id, 'createdAt': now_iso()}
+        row['updatedAt'] = row['createdAt']
+        self.update(row, params, touch=False)
+        table[object_id] = row
+        response = {'objectId': object_id, 'createdAt': row['createdAt']}
+        if class_name == '_User':
+            response['sessionToken'] = self.new_session(object_id)
+        return response
+
+    def update(self, row, params, touch=True):
+        for key, value in params.items():
+            if key in ('objectId', 'createdAt', 'updatedAt'):
+                continue
+            op = value.get('__op') if isinstance(value, dict) else None
+            if op == 'Increment':
+                row[key] = (row.get(key) or 0) + value.get('amount', 1)
+            elif op == 'Delete':
+                row.pop(key, None)
+            elif op in ('Add', 'AddUnique', 'Remove'):
+                current = list(row.get(key) or [])
+                for item in value.get('objects', []):
+                    if op == 'Remove':
+                        current = [c for c in current if c != item]
+                    elif op == 'Add' or item not in current:
+                        current.append(item)
+                row[key] = current
+            elif op in ('AddRelation', 'RemoveRelation'):
+                row[key] = {'__type': 'Relation', 'className': (value.get('objects') or [{}])[0].get('className')}
+            else:
+                row[key] = value
+        if touch:
+            row['updatedAt'] = now_iso()
+
+    def query(self, table, params):
+        where = params.get('where') or {}
+        if not isinstance(where, dict):
+            where = json.loads(where)
+        rows = [row for row in table.values() if matches(row, where)]
+        if params.get('count') and int(params['count']):
+            count = len(rows)
+        else:
+            count = None
+        rows = order_rows(rows, params.get('order') or 'createdAt,objectId')
+        skip = int(params.get('skip') or 0)
+        limit = int(params['limit']) if 'limit' in params else 100
+        rows = rows[skip:skip + min(limit, 1000)]
+        keys = params.get('keys')
+        if keys:
+            keep = set(keys.split(',')) | set(['objectId', 'createdAt', 'updatedAt'])
+            rows = [dict((k, v) for k, v in row.items() if k in keep) for row in rows]
+        response = {'results': [self.public(row) for row in rows]}
+        if count is not None:
+            response['count'] = count
+        return response
+
+    @staticmethod
+    def public(row):
+        return dict((k, v) for k, v in row.items() if k != 'password')
+
+    def new_session(self, object_id):
+        token = 'r:' + new_id(24)
+        self.sessions[token] = object_id
+        return token
+
+    def login(self, username, password):
+        with self.lock:
+            for row in self.classes['_User'].values():
+                if row.get('username') == username and row.get('password') == password:
+                    user = self.public(row)
+                    user['sessionToken'] = self.new_session(row['objectId'])
+                    return 200, user
+        raise ApiError(404, 101, 'invalid login parameters')
+
+    def me(self, session_token):
+        object_id = self.sessions.get(session_token)
+        row = self.classes['_User'].get(object_id)
+        if row is None:
+            raise ApiError(400, 209, 'invalid session token')
+        user = self.public(row)
+        user['sessionToken'] = session_token
+        return 200, user
+
+
+class RateLimiter(object):
+    """Parse style request limit: rate requests per second, batch operations each counting"""
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def allow(self, n=1):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens < n:
+                return False
+            self.tokens -= n
+            return True
+
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes: without this, delayed
+    # ACKs add 40ms to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf8')
+        encoding = None
+        if self.server.stand_in.compress and len(data) >= 1024:
+            accepted = [e.split(';')[0].strip() for e in self.headers.get('Accept-Encoding', '').split(',')]
+            encoding = next((e for e in ('gzip', 'deflate') if e in accepted), None)
+        if encoding == 'gzip':
+            data = gzip_compress(data)
+        elif encoding == 'deflate':
+            data = zlib.compress(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if raw and self.headers.get('Content-Encoding') == 'gzip':
+            raw = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+        return raw
+
+    def _handle(self, method):
+        server = self.server.stand_in
+        raw = self._read_body()
+        url = urlparse(self.path)
+        try:
+            params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+            body = json.loads(raw.decode('utf8')) if raw else {}
+            if body.pop('_method', None) == 'GET':
+                method = 'GET'
+            params.update(body)
+            if isinstance(params.get('where'), str):
+                params['where'] = json.loads(params['where'])
+        except ValueError:
+            return self._respond(400, {'code': 107, 'error': 'invalid JSON'})
+
+        operations = len(params.get('requests', [])) if url.path.rstrip('/').endswith('/batch') else 1
+        server.record(method, url.path, operations)
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        try:
+            server.check(self.headers, operations)
+            status, response = server.backend.handle(method, url.path, params,
+                                                     self.headers.get('X-Parse-Session-Token'))
+        except ApiError as e:
+            return self._respond(e.status, e.body, e.headers)
+        self._respond(status, response)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StandInServer(object):
+    """
+    A local Parse stand-in running on a background thread.
+
+    latency (plus up to jitter) seconds is added to every request.
+    rate_limit caps requests per second, counting each operation of a batch,
+    answering 429 with Parse's request limit error beyond it. A share of
+    error_rate requests fail with one of error_statuses, and fail_next()
+    fails the next few for certain. With compress, responses of 1KB or
+    more are gzipped for clients that accept it.
+    """
+    def __init__(self, latency=0, jitter=0, rate_limit=None, error_rate=0, error_statuses=(503,),
+                 host='127.0.0.1', port=0, compress=True):
+        self.latency = latency
+        self.compress = compress
+        self.jitter = jitter
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.backend = Backend()
+        self.requests = collections.Counter()
+        self.operations = 0
+        self._failures = collections.deque()
+        self._lock = threading.Lock()
+        self._address = (host, port)
+        self._httpd = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self):
+        """the api_root to register with"""
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        self._httpd = _HTTPServer(self._address, Handler)
+        self._httpd.stand_in = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='parse-stand-in')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def fail_next(self, status=503, count=1):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def register_function(self, name, function):
+        """cloud function name returns function(params) rather than echoing params"""
+        self.backend.functions[name] = function
+
+    def record(self, method, path, operations):
+        with self._lock:
+            self.requests['%s %s' % (method, path.split('?')[0])] += 1
+            self.operations += operations
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+            self.operations = 0
+
+    def check(self, headers, operations):
+        """raise the error this request should get, if any"""
+        if not headers.get('X-Parse-Application-Id'):
+            raise ApiError(401, 0, 'unauthorized')
+        with self._lock:
+            status = self._failures.popleft() if self._failures else None
+        if status is None and self.error_rate and random.random() < self.error_rate:
+            status = random.choice(self.error_statuses)
+        if status is not None:
+            raise ApiError(status, 1, 'injected error')
+        if self.rate_limiter is not None and not self.rate_limiter.allow(operations):
+            raise ApiError(429, 155, 'This application performed too many requests', {'Retry-After': '1'})
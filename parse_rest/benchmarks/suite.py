@@ -0,0 +1,256 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+End to end benchmarks against a local StandInServer. Results are written as
+JSON so runs can be compared over time; a summary goes to stderr.
+
+    python -m parse_rest.benchmarks.suite [--rows 5000] [--latency 0.002]
+        [--rate-limit 2000] [--error-rate 0.01] [--output results.json]
+        [--only fetch,retrieve] [--no-compress]
+"""
+from __future__ import print_function, division
+
+from builtins import range, object
+
+import argparse
+import datetime
+import json
+import platform
+import sys
+import threading
+import time
+
+from parse_rest import core, metrics
+from parse_rest.connection import register, ParseBatcher, close_pools
+from parse_rest.datatypes import Function, Object
+from parse_rest.retry import RetryPolicy
+from parse_rest.benchmarks.server import RateLimiter, StandInServer
+
+APP_ID = 'benchmark'
+
+
+class BenchmarkScore(Object):
+    pass
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class Recorder(object):
+    """collects the time taken by every request made while it's active"""
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.bytes = {'sent': 0, 'received': 0, 'uncompressed_sent': 0, 'uncompressed_received': 0}
+        self.paused = False
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        if self.paused:
+            return
+        with self._lock:
+            self.latencies.append(event.elapsed)
+            status = str(event.status or type(event.error).__name__)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes['sent'] += event.bytes_sent
+            self.bytes['received'] += event.bytes_received
+            self.bytes['uncompressed_sent'] += event.uncompressed_bytes_sent
+            self.bytes['uncompressed_received'] += event.uncompressed_bytes_received
+
+    def __enter__(self):
+        metrics.add_hook(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        metrics.remove_hook(self)
+
+
+def measure(name, func, items, runs, setup=None):
+    """
+    Run func runs times (after setup, if given, which isn't timed) and
+    summarise it. func handles items things per run
+    """
+    times = []
+    errors = 0
+    with Recorder() as recorder:
+        for _ in range(runs):
+            recorder.paused = True
+            state = setup() if setup else None
+            recorder.paused = False
+            start = time.time()
+            try:
+                func(state) if setup else func()
+            except core.ParseError:
+                # with error injection on, some runs don't get everything through
+                errors += 1
+            times.append(time.time() - start)
+    median = percentile(times, 50)
+    latencies = recorder.latencies
+    return {
+        'name': name,
+        'items': items,
+        'runs': runs,
+        'failed_runs': errors,
+        'seconds': {'min': min(times), 'median': median, 'max': max(times)},
+        'items_per_second': items / median if median else None,
+        'requests': len(latencies) // runs,
+        'statuses': recorder.statuses,
+        'bytes_per_run': dict((k, v // runs) for k, v in recorder.bytes.items()),
+        'request_latency': {
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+        },
+    }
+
+
+def seed(rows):
+    objects = [BenchmarkScore(score=i, player='player %d' % (i % 100), cheat_mode=bool(i % 2),
+                              tags=['a', 'b'], level={'n': i % 10}) for i in range(rows)]
+    ParseBatcher().batch_save(objects, max_in_flight=4)
+    return objects
+
+
+def bench_fetch(rows, runs):
+    return measure('fetch', lambda: BenchmarkScore.Query.all()._fetch(), rows, runs)
+
+
+def bench_fetch_high_volume(rows, runs):
+    return measure('fetch_high_volume', lambda: BenchmarkScore.Query.all().high_volume(True)._fetch(), rows, runs)
+
+
+def bench_batch_save(rows, runs):
+    def setup():
+        return [BenchmarkScore(score=i, player='new player') for i in range(rows)]
+    return measure('batch_save', lambda objects: ParseBatcher().batch_save(objects), rows, runs, setup)
+
+
+def bench_batch_delete(rows, runs):
+    def setup():
+        objects = [BenchmarkScore(score=i, player='doomed') for i in range(rows)]
+        ParseBatcher().batch_save(objects, max_in_flight=4)
+        return objects
+    return measure('batch_delete', lambda objects: ParseBatcher().batch_delete(objects), rows, runs, setup)
+
+
+def bench_retrieve(object_ids, runs):
+    def retrieve_all():
+        for object_id in object_ids:
+            BenchmarkScore.retrieve(object_id)
+    return measure('retrieve', retrieve_all, len(object_ids), runs)
+
+
+def bench_function(calls, runs):
+    echo = Function('echo')
+
+    def call_all():
+        for i in range(calls):
+            echo(value=i)
+    return measure('function_call', call_all, calls, runs)
+
+
+def bench_hydration(rows, runs):
+    page = BenchmarkScore.GET('', limit=min(rows, 1000))['results']
+
+    def hydrate():
+        for row in page:
+            BenchmarkScore._from_parse(row)
+    return measure('hydration', hydrate, len(page), runs)
+
+
+BENCHMARKS = ('fetch', 'fetch_high_volume', 'batch_save', 'batch_delete', 'retrieve', 'function_call', 'hydration')
+
+
+def run(rows=5000, runs=3, calls=200, latency=0, jitter=0, rate_limit=None, error_rate=0, only=None,
+        compress=True):
+    only = set(only or BENCHMARKS)
+    config = dict(rows=rows, runs=runs, calls=calls, latency=latency, jitter=jitter,
+                  rate_limit=rate_limit, error_rate=error_rate, compress=compress)
+    results = []
+    with StandInServer(latency=latency, jitter=jitter, compress=compress) as server:
+        register(APP_ID, 'key', api_root=server.url, compress_requests=compress, accept_compressed=compress,
+                 retry_policy=RetryPolicy(base_delay=0.01, max_delay=1, max_wait=60))
+        objects = seed(rows)
+        # limits and errors only apply once the data is in
+        if rate_limit:
+            server.rate_limiter = RateLimiter(rate_limit)
+        server.error_rate = error_rate
+        ids = [o.objectId for o in objects[:calls]]
+        for name, bench in (('fetch', lambda: bench_fetch(rows, runs)),
+                            ('fetch_high_volume', lambda: bench_fetch_high_volume(rows, runs)),
+                            ('batch_save', lambda: bench_batch_save(min(rows, 1000), runs)),
+                            ('batch_delete', lambda: bench_batch_delete(min(rows, 1000), runs)),
+                            ('retrieve', lambda: bench_retrieve(ids, runs)),
+                            ('function_call', lambda: bench_function(calls, runs)),
+                            ('hydration', lambda: bench_hydration(rows, runs))):
+            if name in only:
+                results.append(bench())
+        close_pools()
+    return {
+        'meta': {
+            'time': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'config': config,
+        },
+        'results': results,
+    }
+
+
+def summary(report, out=sys.stderr):
+    print('%-20s %8s %12s %10s %10s %10s' % ('benchmark', 'items', 'items/s', 'requests', 'p50 ms', 'p99 ms'), file=out)
+    for r in report['results']:
+        latency = r['request_latency']
+        print('%-20s %8d %12.1f %10d %10s %10s' % (
+            r['name'], r['items'], r['items_per_second'] or 0, r['requests'],
+            '%.2f' % (latency['p50'] * 1000) if latency['p50'] is not None else '-',
+            '%.2f' % (latency['p99'] * 1000) if latency['p99'] is not None else '-'), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='parse_rest benchmarks against a local Parse stand-in')
+    parser.add_argument('--rows', type=int, default=5000, help='rows to seed and fetch')
+    parser.add_argument('--runs', type=int, default=3, help='times each benchmark is run')
+    parser.add_argument('--calls', type=int, default=200, help='retrieves and function calls per run')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many more seconds per request')
+    parser.add_argument('--rate-limit', type=int, default=None, help='requests per second the server allows')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests that fail with a 503')
+    parser.add_argument('--no-compress', dest='compress', action='store_false',
+                        help='send and ask for uncompressed bodies')
+    parser.add_argument('--only', default=None, help='comma separated benchmarks to run: %s' % ','.join(BENCHMARKS))
+    parser.add_argument('--output', default=None, help='file to write the JSON report to (default stdout)')
+    args = parser.parse_args(argv)
+
+    report = run(rows=args.rows, runs=args.runs, calls=args.calls, latency=args.latency, jitter=args.jitter,
+                 rate_limit=args.rate_limit, error_rate=args.error_rate,
+                 only=args.only.split(',') if args.only else None, compress=args.compress)
+    summary(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
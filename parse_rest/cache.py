@@ -0,0 +1,248 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from builtins import object
+from past.builtins import basestring
+
+import collections
+import json
+import threading
+import time
+
+# Defaults for the query cache. Caching is off unless a queryset asks for
+# it with cached() or the app is registered with query_cache_ttl
+DEFAULT_QUERY_CACHE_SIZE = 1000
+DEFAULT_QUERY_CACHE_TTL = 60
+
+
+def user_key(user):
+    '''
+        Part of a cache key that tells users apart, since ACLs mean different
+        users can see different rows. A user without a session token still
+        gets a key of its own, apart from anonymous requests
+    '''
+    if user is None:
+        return None
+    if user.is_master():
+        return '__master__'
+    token = getattr(user, 'sessionToken', None)
+    if token:
+        return token
+    return ('__user__', getattr(user, 'objectId', None) or id(user))
+
+
+class LRUCache(object):
+    '''
+        Thread safe, size bounded LRU mapping with optional expiry per
+        entry and hit/miss counters
+    '''
+    def __init__(self, max_size=1000, ttl=None):
+        if max_size < 1:
+            raise ValueError('Cache size should be at least 1')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def __repr__(self):
+        return u'<%s: %s/%s, hits=%s, misses=%s>' % (self.__class__.__name__, len(self._data), self.max_size, self.hits, self.misses)
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+            # move to the most recently used end
+            del self._data[key]
+            self._data[key] = entry
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+            self._data[key] = (value, expires)
+            while len(self._data) > self.max_size:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data[key][0]
+            self._remove(key)
+            return value
+
+    def _remove(self, key):
+        del self._data[key]
+
+    def resize(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            while len(self._data) > self.max_size:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class QueryCache(LRUCache):
+    '''
+        Raw query responses keyed on the normalised request, grouped by the
+        class endpoint they were read from so a write to a class can drop
+        everything cached for it.
+
+        Responses are stored as JSON text, so every hit decodes a fresh copy
+        and callers are free to change the objects they get back.
+    '''
+    def __init__(self, max_size=DEFAULT_QUERY_CACHE_SIZE, ttl=DEFAULT_QUERY_CACHE_TTL):
+        super(QueryCache, self).__init__(max_size=max_size, ttl=ttl)
+        # endpoint -> keys cached for it
+        self._endpoints = collections.defaultdict(set)
+        # endpoint -> times it was invalidated. A response that was in
+        # flight during a write isn't cached
+        self._generations = collections.defaultdict(int)
+        # per class TTL overrides, by parse class name or endpoint
+        self.class_ttls = {}
+        self.class_hits = collections.Counter()
+        self.class_misses = collections.Counter()
+
+    @staticmethod
+    def make_key(endpoint, app_id, user, kw):
+        '''
+            Normalise a query into a hashable key. where is re-encoded with
+            sorted keys so equivalent filters built in a different order
+            share an entry.
+        '''
+        options = []
+        for k, v in sorted(kw.items()):
+            if k.startswith('_'):
+                continue
+            if k == 'where' and v:
+                v = json.dumps(json.loads(v) if isinstance(v, basestring) else v, sort_keys=True)
+            options.append((k, v if isinstance(v, (basestring, int, float, bool, type(None))) else json.dumps(v, sort_keys=True)))
+        return (endpoint, app_id, user_key(user), tuple(options))
+
+    def ttl_for(self, endpoint, default=None):
+        class_name = endpoint.rstrip('/').split('/')[-1]
+        for name in (endpoint, class_name):
+            if name in self.class_ttls:
+                return self.class_ttls[name]
+        return self.ttl if default is None else default
+
+    def generation(self, endpoint):
+        return self._generations[endpoint]
+
+    def get_response(self, key):
+        with self._lock:
+            raw = self.get(key)
+            if raw is None:
+                self.class_misses[key[0]] += 1
+                return None
+            self.class_hits[key[0]] += 1
+        return json.loads(raw)
+
+    def set_response(self, key, response, ttl=None, generation=None):
+        raw = json.dumps(response)
+        with self._lock:
+            if generation is not None and generation != self._generations[key[0]]:
+                # the class was written to while this was being fetched
+                return
+            self.set(key, raw, ttl=ttl)
+            self._endpoints[key[0]].add(key)
+
+    def _remove(self, key):
+        super(QueryCache, self)._remove(key)
+        keys = self._endpoints.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+
+    def invalidate(self, endpoint):
+        '''Drop every cached query for a class endpoint'''
+        with self._lock:
+            self._generations[endpoint] += 1
+            for key in list(self._endpoints.pop(endpoint, ())):
+                if key in self._data:
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            for endpoint in list(self._endpoints):
+                self._generations[endpoint] += 1
+            self._data.clear()
+            self._endpoints.clear()
+
+    def stats(self):
+        stats = super(QueryCache, self).stats()
+        stats['classes'] = dict((endpoint, {'hits': self.class_hits[endpoint], 'misses': self.class_misses[endpoint]})
+                                for endpoint in set(self.class_hits) | set(self.class_misses))
+        return stats
+
+
+class ObjectCache(LRUCache):
+    '''
+        Identity map for one app: the live instance for each row, keyed on
+        (class name, objectId, user). Retrieves and pointer lookups are
+        answered from it, and rows that come back from queries update and
+        return the instance already in memory rather than a copy.
+    '''
+    @staticmethod
+    def make_key(class_name, object_id, user=None):
+        return (class_name, object_id, user_key(user))
+
+    def hydrate(self, key, build, refresh, klass=None):
+        '''
+            Return the instance cached for key, passing it to refresh(), or
+            build() and cache a new one. An instance that isn't a klass is
+            replaced.
+        '''
+        with self._lock:
+            obj = self.get(key)
+            if obj is not None and (klass is None or isinstance(obj, klass)):
+                refresh(obj)
+            else:
+                obj = build()
+                self.set(key, obj)
+            return obj
+
+
+QUERY_CACHE = QueryCache()
+
+
+def invalidate_queries(endpoint):
+    QUERY_CACHE.invalidate(endpoint)
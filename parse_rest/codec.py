@@ -0,0 +1,131 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+The JSON encoder/decoder used for request bodies, query parameters and
+responses. orjson or ujson is used if installed, otherwise the standard
+library json:
+
+    from parse_rest import codec
+    codec.set_default('json')          # for every app
+    register(<application_id>, <rest_api_key>, json_codec='orjson')   # for one
+'''
+
+from builtins import object
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONCodec(object):
+    '''
+        dumps() returns UTF-8 bytes, dumps_str() text; loads() takes
+        either, so responses can be decoded straight from the bytes read
+    '''
+    name = 'json'
+
+    def dumps(self, obj):
+        return self.dumps_str(obj).encode('utf8')
+
+    def dumps_str(self, obj):
+        return json.dumps(obj)
+
+    def loads(self, data):
+        if isinstance(data, bytes) and not isinstance(data, str):
+            # the standard library only takes bytes from python 3.6
+            data = data.decode('utf8')
+        return json.loads(data)
+
+    def __repr__(self):
+        return '<%s codec>' % self.name
+
+
+class OrjsonCodec(JSONCodec):
+    name = 'orjson'
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # integers beyond 64 bits, non-string keys...
+            return JSONCodec.dumps(self, obj)
+
+    def dumps_str(self, obj):
+        return self.dumps(obj).decode('utf8')
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(JSONCodec):
+    name = 'ujson'
+
+    def dumps_str(self, obj):
+        try:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+        except (TypeError, OverflowError):
+            return json.dumps(obj)
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+CODECS = {'json': JSONCodec}
+if ujson is not None:
+    CODECS['ujson'] = UjsonCodec
+if orjson is not None:
+    CODECS['orjson'] = OrjsonCodec
+
+# fastest first
+PREFERENCE = ('orjson', 'ujson', 'json')
+
+_instances = {}
+_default = None
+
+
+def get_codec(codec=None):
+    '''
+        The codec named codec ('auto' for the fastest installed), or codec
+        itself if it's already one. None is the default codec
+    '''
+    if codec is None:
+        return _default
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec == 'auto':
+        codec = next(name for name in PREFERENCE if name in CODECS)
+    instance = _instances.get(codec)
+    if instance is None:
+        if codec not in CODECS:
+            raise ValueError('Unknown or uninstalled JSON codec %r (have %s)' % (codec, ', '.join(sorted(CODECS))))
+        instance = _instances[codec] = CODECS[codec]()
+    return instance
+
+
+def set_default(codec='auto'):
+    '''Use codec (a name or a JSONCodec) wherever an app doesn't name its own'''
+    global _default
+    _default = get_codec(codec)
+    return _default
+
+
+set_default()
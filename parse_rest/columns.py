@@ -0,0 +1,200 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Build per-field arrays from query results for values_columns(), one page
+at a time. Columns are NumPy arrays when NumPy is installed and
+array.array (or a list, for text and other values) otherwise.
+"""
+from __future__ import division
+
+from builtins import object
+
+import array
+import collections
+import datetime
+import numbers
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .datatypes import Date
+
+# 64 bit integers where array supports them
+INT_TYPECODE = 'q' if 'q' in getattr(array, 'typecodes', '') else 'l'
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=Date.UTC)
+NAN = float('nan')
+
+
+def value_kind(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, numbers.Integral):
+        return 'int'
+    if isinstance(value, numbers.Real):
+        return 'float'
+    if isinstance(value, dict) and value.get('__type') == 'Date':
+        return 'date'
+    return 'object'
+
+
+def widen(kind, other):
+    """the kind that can hold values of both kinds"""
+    if kind is None or kind == other:
+        return other
+    if other is None:
+        return kind
+    if set([kind, other]) == set(['int', 'float']):
+        return 'float'
+    return 'object'
+
+
+def page_kind(values):
+    """what a page of values has to be stored as, and whether any are missing"""
+    kind = None
+    missing = False
+    for value in values:
+        if value is None:
+            missing = True
+        elif kind != 'object':
+            kind = widen(kind, value_kind(value))
+    return kind, missing
+
+
+def nullable(kind):
+    """the kind to use once values can be missing: ints and bools can't mark that"""
+    return {'int': 'float', 'bool': 'object'}.get(kind, kind)
+
+
+def utc_iso(iso):
+    """
+    iso as naive UTC, which is all numpy's datetime64 takes. Parse's own
+    format just loses its Z
+    """
+    if len(iso) == 24 and iso[23] == 'Z':
+        return iso[:23]
+    date = Date._from_str(iso)
+    if date.tzinfo is not None:
+        date = date.astimezone(Date.UTC).replace(tzinfo=None)
+    return date.isoformat()
+
+
+def object_value(value):
+    """a raw value as it's kept in an object column: dates as datetimes"""
+    if isinstance(value, dict) and value.get('__type') == 'Date':
+        return Date._from_str(value['iso'])
+    return value
+
+
+def to_array(values, kind):
+    """one page of raw values as an array of kind"""
+    if kind == 'object':
+        values = [object_value(v) for v in values]
+    if numpy is not None:
+        if kind == 'int':
+            return numpy.array(values, dtype=numpy.int64)
+        if kind == 'float':
+            return numpy.array(values, dtype=numpy.float64)
+        if kind == 'bool':
+            return numpy.array(values, dtype=numpy.bool_)
+        if kind == 'date':
+            return numpy.array([utc_iso(v['iso']) if v else 'NaT' for v in values], dtype='datetime64[ms]')
+        return numpy.array(values, dtype=object)
+
+    if kind == 'int':
+        return array.array(INT_TYPECODE, values)
+    if kind == 'float':
+        return array.array('d', [NAN if v is None else v for v in values])
+    if kind == 'bool':
+        return array.array('b', values)
+    if kind == 'date':
+        # seconds since the epoch
+        return array.array('d', [(Date._from_str(v['iso']) - EPOCH).total_seconds() if v else NAN for v in values])
+    return list(values)
+
+
+def as_objects(chunk, kind):
+    """a page stored as kind, as the values an object column holds"""
+    if numpy is not None:
+        if kind == 'date':
+            # datetime64 comes back naive, NaT as None
+            return numpy.array([v and v.replace(tzinfo=Date.UTC) for v in chunk.astype(object)], dtype=object)
+        return chunk.astype(object)
+    if kind == 'date':
+        return [None if v != v else EPOCH + datetime.timedelta(seconds=v) for v in chunk]
+    if kind == 'bool':
+        return [bool(v) for v in chunk]
+    return list(chunk)
+
+
+def join(chunks, kind):
+    """
+    concatenate the pages of a column, given as (kind, array) pairs,
+    converting earlier ones if kind widened
+    """
+    if kind == 'object':
+        chunks = [(kind, as_objects(chunk, chunk_kind)) for chunk_kind, chunk in chunks]
+    if numpy is not None:
+        if not chunks:
+            return to_array([], kind or 'object')
+        return numpy.concatenate([chunk for _, chunk in chunks])
+
+    if kind == 'object':
+        return [value for _, chunk in chunks for value in chunk]
+    joined = to_array([], kind or 'object')
+    for _, chunk in chunks:
+        joined.extend(chunk if isinstance(chunk, array.array) and chunk.typecode == joined.typecode
+                      else array.array(joined.typecode, chunk))
+    return joined
+
+
+class ColumnBuilder(object):
+    """Accumulates pages of raw rows as one array per field"""
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.kinds = dict((field, None) for field in self.fields)
+        self.chunks = dict((field, []) for field in self.fields)
+        # values missing from every row so far, until the kind is known
+        self.leading_missing = dict((field, 0) for field in self.fields)
+
+    def add(self, rows):
+        for field in self.fields:
+            values = [row.get(field) for row in rows]
+            if field in ('createdAt', 'updatedAt'):
+                # sent as bare ISO strings rather than Dates
+                values = [{'__type': 'Date', 'iso': v} if v else v for v in values]
+            kind, missing = page_kind(values)
+            kind = widen(self.kinds[field], kind)
+            if missing or self.leading_missing[field]:
+                kind = nullable(kind)
+            if kind is None:
+                self.leading_missing[field] += len(values)
+                continue
+            if self.leading_missing[field]:
+                values = [None] * self.leading_missing[field] + values
+                self.leading_missing[field] = 0
+            self.kinds[field] = kind
+            self.chunks[field].append((kind, to_array(values, kind)))
+
+    def result(self):
+        columns = collections.OrderedDict()
+        for field in self.fields:
+            if self.kinds[field] is None:
+                columns[field] = to_array([None] * self.leading_missing[field], 'object')
+            else:
+                columns[field] = join(self.chunks[field], self.kinds[field])
+        return columns
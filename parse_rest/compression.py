@@ -0,0 +1,198 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compressed responses and request bodies. Responses are asked for gzip or
+deflate (and br, if brotli is installed) and decompressed a chunk at a time
+as they're read. Request bodies are only gzipped for apps registered with
+compress_requests, since not every server accepts them.
+'''
+
+from future import standard_library
+standard_library.install_aliases()
+
+from builtins import object
+from http.client import HTTPException
+from urllib.error import URLError
+
+import socket
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# bytes read from a response at a time
+CHUNK_SIZE = 65536
+# bodies smaller than this aren't worth gzipping
+COMPRESS_MIN_SIZE = 16384
+COMPRESS_LEVEL = 6
+
+ENCODINGS = ('gzip', 'deflate', 'br') if brotli is not None else ('gzip', 'deflate')
+ACCEPT_ENCODING = ', '.join(ENCODINGS)
+
+
+class _Identity(object):
+    def pieces(self, data, size=0):
+        yield data
+
+    def flush(self):
+        return b''
+
+
+class _Zlib(object):
+    '''
+        gzip, or zlib wrapped deflate falling back to the raw deflate some
+        servers send
+    '''
+    def __init__(self, wbits=zlib.MAX_WBITS, raw_fallback=False):
+        self._decoder = zlib.decompressobj(wbits)
+        self._raw_fallback = raw_fallback
+
+    def pieces(self, data, size=0):
+        '''Decompress data, size bytes at a time (all at once for 0)'''
+        while data:
+            try:
+                out = self._decoder.decompress(data, size)
+            except zlib.error:
+                if not self._raw_fallback:
+                    raise
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                out = self._decoder.decompress(data, size)
+            self._raw_fallback = False
+            data = self._decoder.unconsumed_tail
+            if out:
+                yield out
+
+    def flush(self):
+        return self._decoder.flush()
+
+
+class _Brotli(object):
+    def __init__(self):
+        self._decoder = brotli.Decompressor()
+        self._process = getattr(self._decoder, 'process', None) or self._decoder.decompress
+
+    def pieces(self, data, size=0):
+        yield self._process(data)
+
+    def flush(self):
+        return b''
+
+
+def decoder(encoding):
+    '''
+        Something with pieces(chunk, size), generating what chunk
+        decompresses to, and flush() for a response's Content-Encoding.
+        Unknown encodings raise ValueError
+    '''
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding in ('identity', ''):
+        return _Identity()
+    if encoding in ('gzip', 'x-gzip'):
+        return _Zlib(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return _Zlib(raw_fallback=True)
+    if encoding == 'br' and brotli is not None:
+        return _Brotli()
+    raise ValueError('Unsupported Content-Encoding: %s' % encoding)
+
+
+def content_encoding(headers):
+    if headers is None:
+        return None
+    return headers.get('Content-Encoding') or headers.get('content-encoding')
+
+
+def read_all(response):
+    '''Whether response says there's nothing more to read from it'''
+    isclosed = getattr(response, 'isclosed', None)
+    return isclosed is not None and isclosed()
+
+
+class Body(object):
+    '''
+        Iterating over a Body reads a response a chunk at a time and
+        yields it decompressed. wire_bytes counts what came over the
+        network and size what it came to. read_time is the time spent
+        waiting on the network, and on_end() is called once the whole
+        response is in. Errors reading or decompressing it are raised as
+        URLError, like a failed request
+    '''
+    def __init__(self, response, encoding=None, chunk_size=CHUNK_SIZE, on_end=None):
+        self.response = response
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.on_end = on_end
+        self.wire_bytes = 0
+        self.size = 0
+        self.read_time = 0
+
+    def __iter__(self):
+        decompressor = decoder(self.encoding)
+        try:
+            while True:
+                started = time.time()
+                chunk = self.response.read(self.chunk_size)
+                self.read_time += time.time() - started
+                if not chunk:
+                    break
+                if read_all(self.response):
+                    self._end()
+                self.wire_bytes += len(chunk)
+                # a well compressed chunk can come to many times its size, so
+                # it's handed out a chunk_size at a time
+                for data in decompressor.pieces(chunk, self.chunk_size):
+                    self.size += len(data)
+                    yield data
+            data = decompressor.flush()
+        except (socket.error, HTTPException, zlib.error) as e:
+            raise URLError(e)
+        self._end()
+        if data:
+            self.size += len(data)
+            yield data
+
+    def _end(self):
+        if self.on_end is not None:
+            on_end, self.on_end = self.on_end, None
+            on_end()
+
+    def read(self):
+        return b''.join(self)
+
+
+def decompress(data, encoding):
+    '''Decompress a whole body, e.g. one that's already been read'''
+    decompressor = decoder(encoding)
+    return b''.join(decompressor.pieces(data)) + decompressor.flush()
+
+
+def compress(data, headers, min_size=COMPRESS_MIN_SIZE):
+    '''
+        Gzip request body data if it's at least min_size bytes and it gets
+        smaller, marking headers to say so. Returns the body to send
+    '''
+    if not data or len(data) < min_size:
+        return data
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) >= len(data):
+        return data
+    headers['Content-Encoding'] = 'gzip'
+    return compressed
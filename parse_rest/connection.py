@@ -22,18 +22,28 @@ from urllib.request import Request, urlopen
 from urllib.error import HTTPError, URLError
 from urllib.parse import urlencode, urlparse
 
-import json
-import datetime
+import copy
+import os
+import struct
 import time
-#import grequests
 import re
 import collections
 import math
+import threading
+from multiprocessing.pool import ThreadPool
+try:
+    import fcntl
+except ImportError:
+    # not on Windows: TokenBucketThrottle can't be shared between processes
+    fcntl = None
 
 import logging
 LOGGER = logging.getLogger(__name__)
 
-from . import core
+from . import codec, compression, core, metrics, profiling, streaming
+from .cache import QUERY_CACHE, ObjectCache
+from .retry import RetryPolicy, RetryBudget
+from .pool import HTTPConnectionPool, DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT, DEFAULT_TIMEOUT
 
 # Changed to relative URL so we can add the customer-specific API_ROOT late in the game
 #API_ROOT = 'https://api.parse.com/1'
@@ -44,12 +54,20 @@ ACCESS_KEYS = {}
 
 # Longest we'll wait for temp network or request errors to clear
 MAX_ERROR_WAIT=60*10
-# Wait period between attempts
+# Longest wait between attempts
 ERROR_WAIT = 50
 
 # Completely lame Parse, completely lame
 MAX_PARSE_OFFSET = 10000
 
+# Keep-alive connection pools, one per api_root
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+POOL_OPTIONS = ('pool_size', 'pool_idle_timeout', 'pool_timeout')
+
+# Identity maps for apps registered with object_cache_size, by app_id
+OBJECT_CACHES = {}
+
 def chunks(l, n):
     """ Yield successive n-sized chunks from l.
     """
@@ -60,6 +78,34 @@ def register(app_id, rest_key, **kw):
     '''
         Register one or more sets of keys by app_id. If only one set 
         is registered, that set is used automatically.
+
+        Requests are made over persistent connections pooled per api_root.
+        The pool can be tuned with pool_size (idle connections kept),
+        pool_idle_timeout (seconds before an idle connection is dropped) and
+        pool_timeout (socket timeout), or disabled with keep_alive=False.
+
+        query_cache_ttl caches every query made with this app for that many
+        seconds (see Queryset.cached()). query_cache_size bounds the number
+        of cached pages and query_cache_class_ttls maps class names to their
+        own TTLs.
+
+        object_cache_size turns on an identity map for the app: at most that
+        many objects are kept (for object_cache_ttl seconds, if given) and
+        retrieve() and pointers to them are answered without a request.
+
+        retry_policy (a retry.RetryPolicy) decides how failed requests made
+        with this app are retried.
+
+        json_codec ('json', 'orjson', 'ujson', 'auto' or a codec.JSONCodec)
+        encodes requests and decodes responses for this app instead of the
+        default codec.
+
+        Compressed responses are asked for unless accept_compressed is
+        False. compress_requests gzips request bodies of that many bytes or
+        more (True for compression.COMPRESS_MIN_SIZE).
+
+        stream_responses=False stops iterator(), values() and values_list()
+        decoding query pages while they're read.
     '''
     global ACCESS_KEYS
 
@@ -78,6 +124,68 @@ def register(app_id, rest_key, **kw):
     }
     ACCESS_KEYS[app_id].update(**kw)
 
+    if any(k in kw for k in POOL_OPTIONS):
+        # Apply the new settings to an existing pool for this api_root
+        pool = POOLS.get(ParseBase.api_root_for(app_id))
+        if pool:
+            pool.configure(pool_size=kw.get('pool_size'),
+                           idle_timeout=kw.get('pool_idle_timeout'),
+                           timeout=kw.get('pool_timeout'))
+
+    if 'object_cache_size' in kw or 'object_cache_ttl' in kw:
+        OBJECT_CACHES.pop(app_id, None)
+
+    if kw.get('query_cache_size'):
+        QUERY_CACHE.resize(kw['query_cache_size'])
+    if kw.get('query_cache_class_ttls'):
+        QUERY_CACHE.class_ttls.update(kw['query_cache_class_ttls'])
+
+def get_pool(api_root, keys=None):
+    '''
+        Return the connection pool for api_root, creating it with the
+        settings in keys (as registered for an app_id) if needed
+    '''
+    pool = POOLS.get(api_root)
+    if pool is None:
+        keys = keys or {}
+        with POOLS_LOCK:
+            pool = POOLS.get(api_root)
+            if pool is None:
+                pool = HTTPConnectionPool(api_root,
+                                          pool_size=keys.get('pool_size') or DEFAULT_POOL_SIZE,
+                                          idle_timeout=keys.get('pool_idle_timeout', DEFAULT_IDLE_TIMEOUT),
+                                          timeout=keys.get('pool_timeout', DEFAULT_TIMEOUT))
+                POOLS[api_root] = pool
+    return pool
+
+def get_object_cache(app_id=None):
+    '''
+        Return the identity map for app_id (or the default app), or None if
+        it wasn't registered with object_cache_size
+    '''
+    keys = get_keys(app_id)
+    if not keys or not keys.get('object_cache_size'):
+        return None
+    cache = OBJECT_CACHES.get(keys['app_id'])
+    if cache is None:
+        with POOLS_LOCK:
+            cache = OBJECT_CACHES.get(keys['app_id'])
+            if cache is None:
+                cache = ObjectCache(max_size=keys['object_cache_size'],
+                                    ttl=keys.get('object_cache_ttl'))
+                OBJECT_CACHES[keys['app_id']] = cache
+    return cache
+
+def clear_object_caches():
+    '''Forget every cached object, e.g. at the end of a unit of work'''
+    for cache in list(OBJECT_CACHES.values()):
+        cache.clear()
+
+def close_pools():
+    '''Close all idle pooled connections'''
+    for pool in list(POOLS.values()):
+        pool.clear()
+
 def get_keys(app_id):
     '''
         Return keys associated with app_id, or the default set if
@@ -105,6 +213,38 @@ def master_key_required(func):
 class ConnectionException(Exception): pass
 
 
+def http_error(code, content, e=None):
+    '''
+        Map an HTTP error status and response body onto the matching
+        core.ResourceRequest* exception
+    '''
+    exc = {
+        400: core.ResourceRequestBadRequest,
+        401: core.ResourceRequestLoginRequired,
+        403: core.ResourceRequestForbidden,
+        404: core.ResourceRequestNotFound
+        }.get(code, core.ParseError)
+    if exc != core.ParseError:
+        return exc(content)
+    else:
+        return exc(code, content, e)
+
+
+def error_content(content, headers):
+    '''The body of an error response, decompressed if it can be'''
+    try:
+        return compression.decompress(content, compression.content_encoding(headers))
+    except Exception:
+        # zlib.error, brotli.error, an unknown encoding...
+        return content
+
+
+# Everything execute() needs to make a call, worked out ahead of the transport
+# body_size is the length of data before it was compressed
+PreparedRequest = collections.namedtuple('PreparedRequest',
+    ['http_verb', 'url', 'data', 'headers', 'num_operations', 'api_root', 'keys', 'body_size'])
+
+
 @python_2_unicode_compatible
 class Throttle(object):
     def __str__(self):
@@ -113,6 +253,54 @@ class Throttle(object):
     def __repr__(self):
         return self.__str__()
 
+    def __deepcopy__(self, memo):
+        # Querysets are deep copied as they're refined, but a throttle is
+        # shared state: every copy has to count against the same one
+        return self
+
+    def wait_time(self):
+        """
+            Seconds until the next round of calls is allowed. Lets callers
+            that can't block in __enter__ (asyncio) do their own waiting
+        """
+        return 0
+
+    def record(self):
+        """
+            Count a round of calls as made. What __exit__ does on success
+        """
+        return
+
+    def feedback(self, elapsed, status=200):
+        """
+            Told how a round of calls went: how many seconds it took and
+            the HTTP status it got. For throttles that adapt to the server
+        """
+        return
+
+class ThrottleSlot(object):
+    """
+        Holds a throttle for one request, like a with statement, but can
+        let it go early with release(): once the response has been read,
+        say, rather than after it's been decoded
+    """
+    def __init__(self, throttle):
+        self.throttle = throttle
+        self.held = False
+
+    def __enter__(self):
+        self.throttle.__enter__()
+        self.held = True
+        return self
+
+    def release(self, exc_type=None, exc_val=None, exc_tb=None):
+        if self.held:
+            self.held = False
+            self.throttle.__exit__(exc_type, exc_val, exc_tb)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release(exc_type, exc_val, exc_tb)
+
 class NullThrottle(Throttle):
     batch_limit = 1000000
 
@@ -140,26 +328,52 @@ class TimeBasedThrottle(Throttle):
         self.calls.extend(time.time() for x in range(0, limit))
         self.calls_per_iteration = calls_per_iteration
 
+        # Shared with calls_per() clones so worker threads can share one
+        # throttle. Calls that are under way count against the limit until
+        # they're recorded on the way out
+        self._lock = threading.Condition()
+        self._in_flight = [0]
+
     def __str__(self):
         return u'<TimeBasedThrottle: Period=%s,limit=%s, remaining: %s' % (self.period,self.limit,self.max_calls)
 
     def __enter__(self):
-        
-        while self.calls_per_iteration > self.max_calls:
-            time.sleep(.25)
+        with self._lock:
+            while self.calls_per_iteration > self.max_calls:
+                self._lock.wait(.25)
+            self._in_flight[0] += self.calls_per_iteration
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is None:
+        with self._lock:
+            self._in_flight[0] -= self.calls_per_iteration
+            if exc_type is None:
+                self.record()
+            self._lock.notify_all()
+
+    def record(self):
+        with self._lock:
             self.calls.extend([time.time() for x in range(0, self.calls_per_iteration)])
             self.clean_calls()
 
+    def wait_time(self):
+        waiting_on = self.calls_per_iteration - self.max_calls
+        if waiting_on <= 0:
+            return 0
+        if waiting_on > len(self.calls):
+            # asking for more than the limit allows in one period
+            return self.period
+        # wait for enough of the recorded calls to age out
+        return max(self.calls[waiting_on - 1] + self.period - time.time(), 0.01)
+
     def calls_per(self,num_calls):
         """
             Return another throttle that assumes num_calls have been made per round
         """
         clone = self.__class__(limit=self.limit,period=self.period,calls_per_iteration=num_calls)
         clone.calls = self.calls
+        clone._lock = self._lock
+        clone._in_flight = self._in_flight
         return clone
 
     def clean_calls(self):
@@ -179,10 +393,290 @@ class TimeBasedThrottle(Throttle):
     @property
     def max_calls(self):
         self.clean_calls()
-        return int(math.floor(float(self.limit) - len(self.calls)))
+        return int(math.floor(float(self.limit) - len(self.calls) - self._in_flight[0]))
+
+class TokenBucket(object):
+    """
+        limit tokens, refilled evenly over period seconds. Only the token
+        count and when it was last worked out are kept, so accounting takes
+        the same time whatever the limit
+    """
+    def __init__(self, limit, period):
+        self.capacity = limit
+        self.rate = limit / period
+        self._lock = threading.Lock()
+        # start empty, as TimeBasedThrottle does: the last run may have
+        # just used up the quota
+        self._state = (0.0, time.time())
+
+    def _locked(self):
+        return self._lock
+
+    def _load(self):
+        return self._state
+
+    def _store(self, tokens, stamp):
+        self._state = (tokens, stamp)
+
+    def take(self, n, wait_only=False):
+        """
+            Take n tokens and return 0, or return how many seconds until
+            there will be enough. Calls needing more than the bucket holds go
+            through once it's full, leaving it in debt. With wait_only,
+            nothing is taken
+        """
+        with self._locked():
+            tokens, stamp = self._load()
+            now = time.time()
+            tokens = min(self.capacity, tokens + (now - stamp) * self.rate)
+            needed = min(n, self.capacity)
+            if tokens < needed:
+                self._store(tokens, now)
+                return (needed - tokens) / self.rate
+            if not wait_only:
+                tokens -= n
+            self._store(tokens, now)
+            return 0
+
+    def take_now(self, n):
+        """take n tokens whether or not they're there"""
+        with self._locked():
+            tokens, stamp = self._load()
+            now = time.time()
+            tokens = min(self.capacity, tokens + (now - stamp) * self.rate)
+            self._store(tokens - n, now)
+
+
+class FileTokenBucket(TokenBucket):
+    """
+        A TokenBucket kept in a file, locked with flock, so that every
+        process on the host using the same path shares one quota
+    """
+    RECORD = struct.Struct('<dd')
+
+    def __init__(self, limit, period, path):
+        if fcntl is None:
+            raise NotImplementedError('Sharing a throttle between processes needs fcntl')
+        super(FileTokenBucket, self).__init__(limit, period)
+        self.path = path
+        self._file = None
+        self._pid = None
+
+    def _locked(self):
+        return _FileLock(self)
+
+    def _open(self):
+        # a file inherited across fork() shares its lock with the parent,
+        # so every process opens its own
+        if self._file is None or self._pid != os.getpid():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._file = os.fdopen(fd, 'r+b')
+            self._pid = os.getpid()
+        return self._file
+
+    def _load(self):
+        self._file.seek(0)
+        data = self._file.read(self.RECORD.size)
+        if len(data) < self.RECORD.size:
+            return (0.0, time.time())
+        return self.RECORD.unpack(data)
+
+    def _store(self, tokens, stamp):
+        self._file.seek(0)
+        self._file.write(self.RECORD.pack(tokens, stamp))
+        self._file.flush()
+
+
+class _FileLock(object):
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def __enter__(self):
+        self.bucket._lock.acquire()
+        try:
+            fcntl.flock(self.bucket._open().fileno(), fcntl.LOCK_EX)
+        except Exception:
+            self.bucket._lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            fcntl.flock(self.bucket._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.bucket._lock.release()
+
+
+@python_2_unicode_compatible
+class TokenBucketThrottle(Throttle):
+    """
+        Allows limit calls per period, like TimeBasedThrottle, but as a
+        token bucket: memory and time per call don't grow with the limit,
+        and callers sleep exactly until enough tokens are back rather than
+        polling. Thread safe, and calls_per() clones share the bucket.
+
+        Given a path, the bucket is kept in that file instead, so that all
+        the processes on a host throttling with the same path share the
+        quota rather than each assuming it has all of it.
+
+        A call counts as soon as it's let through, whether or not it
+        succeeds.
+    """
+    def __init__(self, limit, period, calls_per_iteration=1, path=None):
+        if period <= 0:
+            raise ValueError('Throttle period should be greater than 0')
+        if limit <= 0:
+            raise ValueError('Throttle limit should be > 0')
+
+        self.limit = limit
+        self.period = period
+        self.path = path
+        self.calls_per_iteration = calls_per_iteration
+        if path:
+            self._bucket = FileTokenBucket(limit, period, path)
+        else:
+            self._bucket = TokenBucket(limit, period)
+
+    def __str__(self):
+        return u'<TokenBucketThrottle: Period=%s,limit=%s%s>' % (self.period, self.limit,
+                                                                 self.path and u', path=%s' % self.path or u'')
+
+    def __enter__(self):
+        while True:
+            wait = self._bucket.take(self.calls_per_iteration)
+            if not wait:
+                return self
+            time.sleep(wait)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return
+
+    def wait_time(self):
+        return self._bucket.take(self.calls_per_iteration, wait_only=True)
+
+    def record(self):
+        self._bucket.take_now(self.calls_per_iteration)
+
+    def calls_per(self, num_calls):
+        """
+            Return another throttle that assumes num_calls have been made per round
+        """
+        clone = copy.copy(self)
+        clone.calls_per_iteration = num_calls
+        return clone
+
+    @property
+    def batch_limit(self):
+        return max(int(self.limit // self.period), 1)
+
+class AdaptiveTokenBucket(TokenBucket):
+    """A TokenBucket whose rate can be changed as it's used"""
+    def __init__(self, rate, burst):
+        super(AdaptiveTokenBucket, self).__init__(max(rate * burst, 1), burst)
+        self.burst = burst
+        self.last_cut = 0
+        # held while the rate is worked out and changed
+        self._lock = threading.RLock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            tokens, stamp = self._state
+            now = time.time()
+            tokens = min(self.capacity, tokens + (now - stamp) * self.rate)
+            self.rate = rate
+            self.capacity = max(rate * self.burst, 1)
+            self._state = (min(tokens, self.capacity), now)
+
+
+@python_2_unicode_compatible
+class AdaptiveThrottle(TokenBucketThrottle):
+    """
+        A token bucket throttle that works out the rate Parse will take
+        rather than being told it. The rate (calls per second) starts at
+        rate and, while calls succeed, grows by about increase calls per
+        second every second. A response with one of rate_limit_statuses,
+        or one slower than slow_response seconds, cuts it by
+        decrease_factor, at most once per cooldown seconds so that a burst
+        of failures that were already in flight only counts once. It stays
+        between min_rate and max_rate.
+
+        rate gives the current estimate, and batch_limit (used by
+        ParseBatcher to size its chunks) follows it.
+    """
+    RATE_LIMIT_STATUSES = (429, 503)
+
+    def __init__(self, rate=10, min_rate=1, max_rate=1000, increase=1, decrease_factor=0.5,
+                 slow_response=None, cooldown=1, burst=1, calls_per_iteration=1):
+        if not 0 < min_rate <= rate <= max_rate:
+            raise ValueError('Throttle rates should be 0 < min_rate <= rate <= max_rate')
+        if not 0 < decrease_factor < 1:
+            raise ValueError('Throttle decrease_factor should be between 0 and 1')
+
+        # rate calls per 1 second period to start with
+        super(AdaptiveThrottle, self).__init__(rate, 1, calls_per_iteration=calls_per_iteration)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.slow_response = slow_response
+        self.cooldown = cooldown
+        self._bucket = AdaptiveTokenBucket(rate, burst)
+
+    def __str__(self):
+        return u'<AdaptiveThrottle: rate=%.2f/s, min_rate=%s, max_rate=%s>' % (self.rate, self.min_rate, self.max_rate)
+
+    @property
+    def rate(self):
+        return self._bucket.rate
+
+    @property
+    def limit(self):
+        """calls per period, which is whatever the rate has got to"""
+        return self._bucket.rate
+
+    @limit.setter
+    def limit(self, value):
+        # TokenBucketThrottle.__init__ sets it before there's a bucket
+        if '_bucket' in self.__dict__:
+            self._bucket.set_rate(value)
+
+    def feedback(self, elapsed, status=200):
+        bucket = self._bucket
+        slow = self.slow_response is not None and elapsed > self.slow_response
+        with bucket._lock:
+            rate = bucket.rate
+            if status in self.RATE_LIMIT_STATUSES or slow:
+                now = time.time()
+                if now - bucket.last_cut < self.cooldown:
+                    return
+                bucket.last_cut = now
+                new_rate = max(rate * self.decrease_factor, self.min_rate)
+                LOGGER.info(u'Throttling back from %.2f to %.2f calls/s' % (rate, new_rate))
+            elif status < 400:
+                # each success is worth a fraction of the increase, so a
+                # second's worth of calls at the current rate adds it once
+                new_rate = min(rate + self.increase * self.calls_per_iteration / rate, self.max_rate)
+            else:
+                return
+            if new_rate != rate:
+                bucket.set_rate(new_rate)
+
+    @property
+    def batch_limit(self):
+        return max(int(self.rate), 1)
 
 DEFAULT_THROTTLE = NullThrottle()
 
+# Used for apps registered without a retry_policy
+DEFAULT_RETRY_POLICY = RetryPolicy(max_delay=ERROR_WAIT, max_wait=MAX_ERROR_WAIT, budget=RetryBudget())
+
+def retry_policy_for(keys, _retry=None):
+    '''The retry policy for a call: the one passed in, the app's, or the default'''
+    return _retry or (keys or {}).get('retry_policy') or DEFAULT_RETRY_POLICY
+
+def codec_for(keys):
+    '''The JSON codec for an app: its json_codec, or the default'''
+    return codec.get_codec((keys or {}).get('json_codec'))
+
 class ParseBase(object):
     ENDPOINT_ROOT = API_ROOT
     _using = None # required now that we do customer-specific domains
@@ -203,17 +697,47 @@ class ParseBase(object):
             return api_root
             
     @classmethod
-    def execute(cls, uri, http_verb, extra_headers=None, batch=False, _app_id=None,_user=None,_throttle=None,_high_volume=False,retry_on_temp_error=True,error_wait=ERROR_WAIT,max_error_wait=MAX_ERROR_WAIT,**kw):
+    def execute(cls, uri, http_verb, extra_headers=None, batch=False, _app_id=None,_user=None,_throttle=None,_high_volume=False,_retry=None,_stream=None,retry_on_temp_error=True,error_wait=None,max_error_wait=None,**kw):
         """
         if batch == False, execute a command with the given parameters and
         return the response JSON.
+        If _stream is given, the response's results are handed to it as
+        they're read (see streaming.parse()) and replaced by what it returns.
         If batch == True, return the dictionary that would be used in a batch
         command.
+
+        Failed calls are retried as _retry (a retry.RetryPolicy, by default
+        the app's retry_policy) allows, unless retry_on_temp_error is False.
+        error_wait and max_error_wait override the policy's longest wait
+        between attempts and longest wait overall.
         """
         
         if not _throttle and not batch:
             _throttle = DEFAULT_THROTTLE
 
+        request = cls._prepare_request(uri, http_verb, extra_headers=extra_headers, batch=batch, _app_id=_app_id, _user=_user, **kw)
+        if batch:
+            return request
+
+        pool = None
+        if request.keys.get('keep_alive', True) and request.url.startswith(request.api_root):
+            pool = get_pool(request.api_root, request.keys)
+
+        retry = None
+        if retry_on_temp_error:
+            # a long GET sent as a POST is still a GET as far as retrying goes
+            retry = retry_policy_for(request.keys, _retry).start(http_verb, request.url, error_wait, max_error_wait)
+        return cls._serial_execute(request.http_verb,request.url,request.data,request.headers,retry,_throttle,request.num_operations,
+                                   pool=pool,app_id=request.keys.get('app_id'),api_root=request.api_root,
+                                   json_codec=codec_for(request.keys),body_size=request.body_size,stream=_stream)
+
+    @classmethod
+    def _prepare_request(cls, uri, http_verb, extra_headers=None, batch=False, _app_id=None, _user=None, **kw):
+        """
+        Work out the URL, headers and body for a call. Returns the batch
+        dictionary if batch == True, otherwise a PreparedRequest. Shared by
+        the blocking and asyncio transports.
+        """
         keys = get_keys(_app_id)
         
         if not keys or not 'app_id' in keys:
@@ -267,15 +791,14 @@ class ParseBase(object):
 
             return ret
         
-        data = kw and json.dumps(kw) or "{}"
-        
         num_operations = 1
         if 'requests' in kw:
             # Batch operation. Note how many operations are being done for lame
             # API limit purposes
             num_operations=len(kw['requests'])
 
-        if http_verb == 'GET' and data:
+        # the body is encoded once, straight to bytes, and only if it's sent
+        if http_verb == 'GET':
             new_url = '%s?%s' % (url,urlencode(kw))
 
             # deal with parse's crappy URL length limit that throws 
@@ -284,99 +807,99 @@ class ParseBase(object):
             if len(new_url) > 5000:
                 http_verb = 'POST'
                 kw['_method'] = 'GET'
-                data = json.dumps(kw)
+                data = codec_for(keys).dumps(kw)
                 if 'limit' in kw:
                     # it appears that limit needs to be in the URL?!
                     url += '?%s' % urlencode({'limit':kw.get('limit')})                
             else:
                 url = new_url
                 data = None
-        
-        return cls._serial_execute(http_verb,url,data,headers,retry_on_temp_error,error_wait,max_error_wait,_throttle,num_operations)
+        else:
+            data = kw and codec_for(keys).dumps(kw) or b'{}'
+
+        body_size = len(data) if data else 0
+        if keys.get('accept_compressed', True):
+            headers['Accept-Encoding'] = compression.ACCEPT_ENCODING
+        min_size = keys.get('compress_requests')
+        if data and min_size:
+            data = compression.compress(data, headers, compression.COMPRESS_MIN_SIZE if min_size is True else min_size)
+
+        return PreparedRequest(http_verb, url, data, headers, num_operations, api_root, keys, body_size)
 
     @classmethod
-    def _serial_execute(cls,http_verb,url,data,headers,retry_on_temp_error,error_wait,max_error_wait,_throttle,num_operations):
+    def _serial_execute(cls,http_verb,url,data,headers,retry,_throttle,num_operations,pool=None,app_id=None,api_root=None,json_codec=None,body_size=None,stream=None):
+        """
+        Make the call, going through the throttle for every attempt. retry
+        is a retry.RetryState, or None to raise the first error. Each
+        attempt is recorded in metrics. The response is decompressed as
+        it's read and decoded with json_codec, or the default codec.
+        body_size is the size of data before any compression. stream
+        decodes the results while they're read, as in execute()
+        """
         if data is None:
             data = b''
-        else:
-            data = bytes(data, encoding='utf8')
-        request = Request(url, data, headers)
-        request.get_method = lambda: http_verb
+        elif isinstance(data, str):
+            data = data.encode('utf8')
+        if pool is None:
+            request = Request(url, data, headers)
+            request.get_method = lambda: http_verb
 
-        start_time = datetime.datetime.now()
-        
         while 1:
+            timer = metrics.begin(http_verb, url, app_id, api_root, num_operations, len(data),
+                                  retry.attempt if retry is not None else 1, body_size)
             try:
-                with _throttle.calls_per(num_operations):
-                    response = urlopen(request)
-                return json.loads(response.read())
+                throttle = _throttle.calls_per(num_operations)
+                with ThrottleSlot(throttle) as slot:
+                    timer.sent()
+                    started = time.time()
+                    with profiling.phase('network'):
+                        if pool is not None:
+                            response = pool.urlopen(http_verb, url, data, headers)
+                        else:
+                            response = urlopen(request)
+                        responded = time.time() - started
+                        # the throttle is let go as soon as the last byte is
+                        # in, rather than once the results have been decoded
+                        body = compression.Body(response, compression.content_encoding(response.headers),
+                                                on_end=slot.release)
+                        try:
+                            if stream is None:
+                                content = body.read()
+                            else:
+                                content = streaming.parse(body, stream, json_codec=json_codec)
+                        except Exception:
+                            # the rest of the body is never read, so the connection can't be reused
+                            response.close()
+                            raise
+                # what the server and network took, leaving out decoding
+                elapsed = responded + body.read_time
+                throttle.feedback(elapsed)
+                timer.finished(getattr(response, 'status', None) or response.getcode(), body.wire_bytes,
+                               uncompressed_bytes_received=body.size, elapsed=elapsed)
+                if retry is not None:
+                    retry.succeeded()
+                if stream is not None:
+                    return content
+                with profiling.phase('json_decode'):
+                    return codec.get_codec(json_codec).loads(content)
             except HTTPError as e:
-                exc = {
-                    400: core.ResourceRequestBadRequest,
-                    401: core.ResourceRequestLoginRequired,
-                    403: core.ResourceRequestForbidden,
-                    404: core.ResourceRequestNotFound
-                    }.get(e.code, core.ParseError)
-                if exc != core.ParseError:
-                    raise exc(e.read())
-                else:
-                    raise exc(e.code,e.read(),e)
+                throttle.feedback(time.time() - started, status=e.code)
+                content = e.read()
+                timer.finished(e.code, len(content))
+                delay = retry and retry.failed(status=e.code, headers=e.headers)
+                if delay is None:
+                    raise http_error(e.code, error_content(content, e.headers), e)
+                LOGGER.warning(u'%s from %s %s. Retrying in %.2fs' % (e.code, http_verb, url, delay))
+                time.sleep(delay)
             except URLError as e:
-                if not retry_on_temp_error:
+                timer.finished(error=e)
+                delay = retry and retry.failed(error=e)
+                if delay is None:
+                    if retry is not None:
+                        LOGGER.error('Giving up after %s attempts: %s' % (retry.attempt, e))
                     raise
-
-                now = datetime.datetime.now()
-                if max_error_wait == 0 or (now - start_time).total_seconds() <= max_error_wait:
-                    LOGGER.warn(u'Temp error during execute(). Waiting %s: %s' % (error_wait,e))
-                    time.sleep(error_wait)
-                else:
-                    LOGGER.error('Temp errors for too long. Bailing due to: %s' % e)
-                    raise
-
-    """
-    Parse changed their throttling scheme so this isn't useful anymore
-    @classmethod
-    def _concurrent_execute(cls,http_verb,url,data,headers,_throttle,num_operations):
-        # Error handling in grequests is non-existent. We just try three times and call it a day
-        reqs = []
-        for offset in xrange(0,MAX_PARSE_OFFSET+1000,1000):
-            if data:
-                data['skip'] = offset
-            else:
-                if 'skip' not in url:
-                    if '?' not in url:
-                        url += '?'
-                    url += '&skip=%s' % offset
-                else:
-                    url = re.sub('skip=[0-9]+','skip=%s' % offset,url)
-            reqs.append( getattr(grequests,http_verb.lower())(url,data=data,headers=headers) )
-
-        cur_reqs = reqs[:]
-        res = {'results':[],'count':0}
-        if (num_operations * len(cur_reqs)) > _throttle.batch_limit:
-            raise Exception("Unable to do concurrent execution since total calls of %s is higher than allowed by throttle at %s" * (num_operations * len(cur_reqs), _throttle.batch_limit))
-
-        for i in xrange(0,3):
-            with _throttle.calls_per(num_operations * len(cur_reqs)):
-                grequests.map(cur_reqs)
-            c = cur_reqs[:]
-            for i in c:
-                if i.response:
-                    # Not this one
-                    cur_reqs.remove(i)
-            if not cur_reqs:
-                # they all succeeded
-                for req in reqs:
-                    resp = json.loads(req.response.content)
-                    res['results'].extend(resp.get('results',[]))
-                    res['count'] += resp.get('count',0)
-                return res
-
-            # else try again
-
-        # 3 attempts and they didn't succeed
-        raise ConnectionException('%s of %s requests failed' % (len(cur_reqs),len(reqs)) )
-    """
+                LOGGER.warning(u'Temp error during execute(). Waiting %.2fs: %s' % (delay,e))
+                time.sleep(delay)
 
     @classmethod
     def GET(cls, uri, **kw):
@@ -399,40 +922,121 @@ class ParseBatcher(ParseBase):
     """Batch together create, update or delete operations"""
     ENDPOINT_ROOT = '/'.join((API_ROOT, 'batch'))
 
-    def batch(self, methods,_using=None,_as_user=None,_throttle=None):
+    def batch(self, methods,_using=None,_as_user=None,_throttle=None,max_in_flight=1):
         """
         Given a list of create, update or delete methods to call, call all
         of them in a single batch operation.
+
+        With max_in_flight > 1, that many chunks are sent at once from a pool
+        of worker threads. Callbacks still run chunk by chunk, in order, on
+        the calling thread. A failed operation doesn't stop the others: once
+        everything has been sent a core.ParseBatchError listing the failures
+        is raised. A request that fails as a whole (bad keys, say) stops
+        any more chunks being sent, and its exception is raised once the
+        chunks already sent have been dealt with.
         """
+        queries_and_callbacks = self._prepare_chunks(methods,_throttle)
+        stop = threading.Event()
+
+        def send(queries):
+            if stop.is_set():
+                return None
+            try:
+                return self.execute("", "POST", requests=queries,_app_id=_using,_user=_as_user,_throttle=_throttle)
+            except Exception as e:
+                stop.set()
+                LOGGER.warning(u'Batch request of %s operations failed: %s' % (len(queries),e))
+                return e
+
+        pool = None
+        if max_in_flight > 1 and len(queries_and_callbacks) > 1:
+            pool = ThreadPool(min(max_in_flight, len(queries_and_callbacks)))
+            # imap hands the responses back in chunk order
+            all_responses = pool.imap(send, [queries for queries, _, _ in queries_and_callbacks])
+        else:
+            all_responses = (send(queries) for queries, _, _ in queries_and_callbacks)
 
+        try:
+            self._finish(queries_and_callbacks, all_responses)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    @staticmethod
+    def _prepare_chunks(methods,_throttle=None):
+        """
+        split methods into [(queries, callbacks, indexes), ...], one per batch
+        request. indexes are the positions of the operations in methods
+        """
         # Parse sucks and counts each object in a batch request as a separate call
         # against its limits. We obviously don't want a batch size greater than our
         # per-second limit
         limit = 1000000
         if _throttle:
             limit = _throttle.batch_limit
-        
+
+        # It's not necessary to pass in using and as_users here since this eventually
+        # calls execute() with the batch flag, which doesn't actually do a callout.
+        # A method with nothing to send (saving an unchanged object) returns None
+        prepared = []
+        for index, method in enumerate(methods):
+            call = method(batch=True)
+            if call is not None:
+                prepared.append((call[0], call[1], index))
+
         # parse has a 50 record limit in batch mode
-        for thisBatch in chunks(methods,min(limit,50)):
-            # It's not necessary to pass in using and as_users here since this eventually
-            # calls execute() with the batch flag, which doesn't actually do a callout
-            queries, callbacks = list(zip(*[m(batch=True) for m in thisBatch]))
-
-            # perform all the operations in one batch
-            responses = self.execute("", "POST", requests=queries,_app_id=_using,_user=_as_user,_throttle=_throttle)
-            # perform the callbacks with the response data (updating the existing
-            # objets, etc)
-            for callback, response in zip(callbacks, responses):
-                if 'error' in response:
-                    raise core.ParseError('Error: %s' % response['error'])
+        return [list(zip(*thisBatch)) for thisBatch in chunks(prepared,min(limit,50))]
+
+    @classmethod
+    def _finish(cls, queries_and_callbacks, all_responses):
+        """
+        Run the callbacks of every chunk that went through, given the
+        responses in chunk order: the response, the exception its request
+        raised, or None if it wasn't sent. Raises the first exception, or
+        else a core.ParseBatchError for the operations that failed
+        """
+        errors = []
+        failure = None
+        for (queries, callbacks, indexes), responses in zip(queries_and_callbacks, all_responses):
+            if isinstance(responses, Exception):
+                failure = failure or responses
+            elif responses is not None:
+                cls._run_callbacks(indexes, callbacks, responses, errors)
+        if failure is not None:
+            raise failure
+        if errors:
+            raise core.ParseBatchError(errors)
+
+    @staticmethod
+    def _run_callbacks(indexes, callbacks, responses, errors):
+        """
+        perform the callbacks with the response data (updating the existing
+        objets, etc), collecting (index, error) for anything that failed
+        """
+        for index, callback, response in zip(indexes, callbacks, responses):
+            if 'error' in response:
+                errors.append((index, response['error']))
+            else:
                 callback(response["success"])
 
-    def batch_save(self, objects,_using=None,_as_user=None,_throttle=None):
+    def batch_save(self, objects,_using=None,_as_user=None,_throttle=None,max_in_flight=1):
         """save a list of objects in one operation"""
-        self.batch([o.save for o in objects],_using=_using,_as_user=_as_user,_throttle=_throttle)
+        self.batch([o.save for o in objects],_using=_using,_as_user=_as_user,_throttle=_throttle,max_in_flight=max_in_flight)
 
-    def batch_delete(self, objects,_using=None,_as_user=None,_throttle=None):
+    def batch_delete(self, objects,_using=None,_as_user=None,_throttle=None,max_in_flight=1):
         """delete a list of objects in one operation"""
-        self.batch([o.delete for o in objects],_using=_using,_as_user=_as_user,_throttle=_throttle)
+        self.batch([o.delete for o in objects],_using=_using,_as_user=_as_user,_throttle=_throttle,max_in_flight=max_in_flight)
+
+    def abatch(self, methods,_using=None,_as_user=None,_throttle=None,max_in_flight=1):
+        """asyncio version of batch(). Returns a coroutine"""
+        from .aio import batch
+        return batch(self, methods,_using=_using,_as_user=_as_user,_throttle=_throttle,max_in_flight=max_in_flight)
+
+    def abatch_save(self, objects,_using=None,_as_user=None,_throttle=None,max_in_flight=1):
+        return self.abatch([o.save for o in objects],_using=_using,_as_user=_as_user,_throttle=_throttle,max_in_flight=max_in_flight)
+
+    def abatch_delete(self, objects,_using=None,_as_user=None,_throttle=None,max_in_flight=1):
+        return self.abatch([o.delete for o in objects],_using=_using,_as_user=_as_user,_throttle=_throttle,max_in_flight=max_in_flight)
 
 
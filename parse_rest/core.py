@@ -40,3 +40,14 @@ class ResourceRequestForbidden(ParseError):
 class ResourceRequestNotFound(ParseError):
     '''Request returns a 404'''
     pass
+
+
+class ParseBatchError(ParseError):
+    '''
+    One or more operations in a batch failed. errors is a list of
+    (index, error) pairs, index being the position of the operation in the
+    batch and error Parse's error for it
+    '''
+    def __init__(self, errors):
+        ParseError.__init__(self, '%s batch operations failed' % len(errors))
+        self.errors = errors
@@ -17,10 +17,21 @@ from past.builtins import basestring
 import base64
 import datetime
 import dateutil.parser
+import dateutil.tz
 import copy
 
-from .connection import API_ROOT, ParseBase
+from . import profiling
+from .cache import invalidate_queries
+from .connection import API_ROOT, ParseBase, get_object_cache
 from .query import QueryManager
+from .unitofwork import current_session
+
+
+def class_attribute(klass, name):
+    """name as defined on klass or a base, without invoking descriptors"""
+    for k in klass.__mro__:
+        if name in k.__dict__:
+            return k.__dict__[name]
 
 
 class ParseType(object):
@@ -50,7 +61,10 @@ class ParseType(object):
             'Relation': Relation
             }.get(parse_type)
         
-        return native and native.from_native(_using=_using,_as_user=_as_user,_throttle=_throttle,**parse_data) or parse_data
+        if not native:
+            return parse_data
+        with profiling.phase('conversion'):
+            return native.from_native(_using=_using,_as_user=_as_user,_throttle=_throttle,**parse_data) or parse_data
 
     @staticmethod
     def convert_to_parse(python_object, as_pointer=False):
@@ -110,18 +124,20 @@ class ForeignKey(object):
             # if we queried this, it only has the objectId
             if hasattr(obj,'_loaded') and not getattr(obj,'_loaded'):
                 obj = self.cls.retrieve(obj.objectId,_using=instance._using,_as_user=instance._as_user,_throttle=instance._throttle)
-                obj._loaded = True
-                setattr(instance,'_'+self.name+'_obj',obj)
-                setattr(instance,'_'+self.name+'_id',obj.objectId)
+                self._fill(instance,obj)
             return obj
 
         oid = getattr(instance,self.name+'_id',None)
         if not oid:
             return None
         obj = self.cls.retrieve(oid,_using=instance._using,_as_user=instance._as_user,_throttle=instance._throttle)
+        self._fill(instance,obj)
+        return obj
+    def _fill(self, instance, obj):
+        """point instance at a loaded obj"""
+        obj._loaded = True
         setattr(instance,'_'+self.name+'_obj',obj)
         setattr(instance,'_'+self.name+'_id',obj.objectId)
-        return obj
     def __set__(self, instance, value):
         #instance.__dict__[self.name] = value
         if isinstance(value, basestring):
@@ -132,18 +148,33 @@ class ForeignKey(object):
 class Pointer(ParseType):
 
     @classmethod
-    def from_native(cls, _using=None,_as_user=None,**kw):
+    def from_native(cls, _using=None,_as_user=None,_throttle=None,**kw):
+        # Anything more than these was included in the query
+        loaded = set(kw.keys()) != set(['objectId','className','__type'])
+        cache = get_object_cache(_using)
+        if cache is not None and kw.get('objectId'):
+            key = cache.make_key(kw.get('className'), kw['objectId'], _as_user)
+            if loaded:
+                return cache.hydrate(key,
+                                     lambda: cls._build(loaded,_using,_as_user,_throttle,kw),
+                                     lambda obj: obj._merge(kw,_using=_using,_as_user=_as_user,_throttle=_throttle))
+            obj = cache.get(key)
+            if obj is not None:
+                return obj
+        return cls._build(loaded,_using,_as_user,_throttle,kw)
+
+    @staticmethod
+    def _build(loaded, _using, _as_user, _throttle, kw):
         klass = Object.factory(kw.get('className'))
         # This would have been added during the query so we know
         # which data store it came from
         #app_id = kw.get('_app_id',None)
         #user   = kw.get('_user',None)
-        o = klass(**kw)
-        if set(kw.keys()) == set(['objectId','className','__type']):
-            # not really loaded, just the id
-            o._loaded = False
-        else:
-            o._loaded = True
+        o = klass(_throttle=_throttle,**kw)
+        # if not loaded, it's just the id
+        o._loaded = loaded
+        if loaded:
+            o._take_snapshot(kw)
         o._using = _using
         o._as_user = _as_user
         return o
@@ -173,18 +204,31 @@ class Date(ParseType):
     def from_native(cls, **kw):
         return cls._from_str(kw.get('iso', ''))
 
+    UTC = dateutil.tz.tzutc()
+
     @staticmethod
     def _from_str(date_str):
         """turn a ISO 8601 string into a datetime object"""
+        # Parse always sends YYYY-MM-DDTHH:MM:SS.mmmZ, which can be picked
+        # apart by position far quicker than dateutil works it out
+        if (len(date_str) == 24 and date_str[23] == 'Z' and date_str[19] == '.' and
+                date_str[4] == '-' and date_str[7] == '-' and date_str[10] == 'T' and
+                date_str[13] == ':' and date_str[16] == ':'):
+            try:
+                return datetime.datetime(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]),
+                                         int(date_str[11:13]), int(date_str[14:16]), int(date_str[17:19]),
+                                         int(date_str[20:23]) * 1000, Date.UTC)
+            except ValueError:
+                pass
         return dateutil.parser.parse(date_str)
-        #return datetime.datetime.strptime(date_str[:-1] + 'UTC', Date.FORMAT)
 
     def __init__(self, date):
         """Can be initialized either with a string or a datetime"""
         if isinstance(date, datetime.datetime):
             self._date = date
         elif isinstance(date, new_str):
-            self._date = Date._from_str(date)
+            with profiling.phase('conversion'):
+                self._date = Date._from_str(date)
 
     def _to_native(self):
         return {
@@ -256,6 +300,11 @@ class Function(ParseBase):
     def __call__(self, _using=None,_as_user=None,_throttle=None,**kwargs):
         return self.POST('/' + self.name, _app_id=_using,_user=_as_user,_throttle=_throttle,**kwargs)
 
+    def acall(self, _using=None,_as_user=None,_throttle=None,**kwargs):
+        """asyncio version of calling the function. Returns a coroutine"""
+        from .aio import call
+        return call(self, _using=_using,_as_user=_as_user,_throttle=_throttle,**kwargs)
+
 
 class ParseResource(ParseBase, Pointer):
 
@@ -267,21 +316,179 @@ class ParseResource(ParseBase, Pointer):
 
     @classmethod
     def retrieve(cls, resource_id,_using=None,_as_user=None,_throttle=None):
-        return cls(**dict(cls.GET('/' + resource_id,_app_id=_using,_user=_as_user),_using=_using,_as_user=_as_user,_throttle=_throttle) )
+        obj = cls._cached(resource_id,_using=_using,_as_user=_as_user)
+        if obj is not None:
+            return obj
+        return cls._from_parse(cls.GET('/' + resource_id,_app_id=_using,_user=_as_user),_using=_using,_as_user=_as_user,_throttle=_throttle)
+
+    @classmethod
+    def aretrieve(cls, resource_id,_using=None,_as_user=None,_throttle=None):
+        """asyncio version of retrieve(). Returns a coroutine"""
+        from .aio import retrieve
+        return retrieve(cls, resource_id,_using=_using,_as_user=_as_user,_throttle=_throttle)
+
+    @classmethod
+    def _class_name(cls):
+        return getattr(cls,'parse_table',None) or cls.__name__
+
+    @classmethod
+    def _from_parse(cls, data,_using=None,_as_user=None,_throttle=None,_lazy=False):
+        """
+        Turn a row from the server into an instance. If the app has an object
+        cache, the instance already in memory for the row is updated and
+        returned instead of a new one
+        """
+        def build():
+            obj = cls(_using=_using,_as_user=_as_user,_throttle=_throttle,_lazy=_lazy,**data)
+            obj._take_snapshot(data)
+            return obj
+        cache = get_object_cache(_using)
+        if cache is None or not data.get('objectId'):
+            return build()
+        key = cache.make_key(cls._class_name(), data['objectId'], _as_user)
+        return cache.hydrate(key, build,
+                             lambda obj: obj._merge(data,_using=_using,_as_user=_as_user,_throttle=_throttle),
+                             klass=cls)
+
+    @classmethod
+    def _cached(cls, resource_id,_using=None,_as_user=None):
+        """the fully loaded instance for resource_id in the object cache, if any"""
+        cache = get_object_cache(_using)
+        if cache is None:
+            return None
+        obj = cache.get(cache.make_key(cls._class_name(), resource_id, _as_user))
+        if isinstance(obj, cls) and getattr(obj,'_loaded',True):
+            return obj
+
+    def _merge(self, data,_using=None,_as_user=None,_throttle=None):
+        """
+        update a cached instance from a newer copy of its row. Fields
+        changed locally but not saved yet keep their local values, and are
+        still saved by the next save()
+        """
+        updated = data.get('updatedAt')
+        if getattr(self,'_loaded',True) and updated and self.updatedAt == Date._from_str(updated):
+            return
+        dirty = ()
+        if self.__dict__.get('_snapshot') is not None:
+            dirty = self._changed_fields(self._to_native())
+        for key, value in list(data.items()):
+            if key in dirty:
+                continue
+            setattr(self, key, ParseType.convert_from_parse(value,_using=_using,_as_user=_as_user,_throttle=_throttle))
+        if hasattr(self,'_loaded'):
+            self._loaded = True
+        self._take_snapshot(data)
+
+    def _take_snapshot(self, data):
+        """
+        Record field values (encoded as Parse sends them) as what the server
+        has, so that saving only sends what has changed since
+        """
+        snapshot = dict(self.__dict__.get('_snapshot') or ())
+        for key, value in list(data.items()):
+            if isinstance(value, list) or (isinstance(value, dict) and '__type' not in value):
+                # these can be changed in place
+                value = copy.deepcopy(value)
+            snapshot[key] = value
+        self._snapshot = snapshot
+
+    def _changed_fields(self, native):
+        """
+        The fields of native (from _to_native()) that differ from the last
+        snapshot. Everything, if there's no snapshot
+        """
+        snapshot = self.__dict__.get('_snapshot')
+        if snapshot is None:
+            return native
+        changed = {}
+        for key, value in list(native.items()):
+            if key not in snapshot or self._normalised(snapshot[key]) != value:
+                changed[key] = value
+        return changed
+
+    def _normalised(self, value):
+        """a snapshot value encoded the way _to_native() would encode it"""
+        if not isinstance(value, dict) or '__type' not in value:
+            return value
+        if value['__type'] in ('Pointer', 'Object'):
+            return {'__type': 'Pointer', 'className': value.get('className'), 'objectId': value.get('objectId')}
+        decoded = ParseType.convert_from_parse(value,_using=self._using,_as_user=self._as_user)
+        return ParseType.convert_to_parse(decoded, as_pointer=True)
+
+    def _remember(self,_using=None,_as_user=None):
+        cache = get_object_cache(_using)
+        if cache is not None and self.objectId:
+            cache.set(cache.make_key(self._class_name(), self.objectId, _as_user), self)
+
+    def _forget(self,_using=None,_as_user=None):
+        cache = get_object_cache(_using)
+        if cache is not None and self.objectId:
+            cache.pop(cache.make_key(self._class_name(), self.objectId, _as_user))
 
     @property
     def _editable_attrs(self):
+        self._decode_lazy_fields()
         protected_attrs = self.__class__.PROTECTED_ATTRIBUTES
         allowed = lambda a: a not in protected_attrs and not a.startswith('_')
         return dict([(k, v) for k, v in list(self.__dict__.items()) if allowed(k)])
 
-    def __init__(self, _using=None,_as_user=None,_throttle=None,**kw):
+    def __init__(self, _using=None,_as_user=None,_throttle=None,_lazy=False,**kw):
+        self._using = _using
+        self._as_user = _as_user
+        self._throttle = _throttle
+        if _lazy:
+            kw = self._defer_fields(kw)
         for key, value in list(kw.items()):
             a = ParseType.convert_from_parse(value,_using=_using,_as_user=_as_user,_throttle=_throttle)
             setattr(self, key, a)
-        self._using = _using
-        self._as_user = _as_user
 
+    def _defer_fields(self, kw):
+        """
+        Keep the values that need decoding (dates and other parse types) as
+        they came from the server, to be decoded when first read. Returns
+        the rest, which are set as usual
+        """
+        lazy, eager = {}, {}
+        klass = self.__class__
+        for key, value in list(kw.items()):
+            if key in ('createdAt', 'updatedAt'):
+                lazy[key] = value
+            elif isinstance(value, dict) and '__type' in value and not class_attribute(klass, key):
+                lazy[key] = value
+            else:
+                eager[key] = value
+        if lazy:
+            self._lazy_fields = lazy
+        return eager
+
+    def __getattr__(self, name):
+        # only called when name isn't found normally: it may be a field
+        # that hasn't been decoded yet
+        if name in self.__dict__.get('_lazy_fields', ()):
+            self._decode_lazy_field(name)
+            return getattr(self, name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+
+    def _drop_lazy_field(self, key):
+        lazy = self.__dict__.get('_lazy_fields')
+        if not lazy or key not in lazy:
+            return None
+        # replaced rather than changed, as copies of the object share it
+        lazy = dict(lazy)
+        value = lazy.pop(key)
+        self._lazy_fields = lazy
+        return value
+
+    def _decode_lazy_field(self, key):
+        value = self._drop_lazy_field(key)
+        # skip fields that have been set since
+        if value is not None and key not in self.__dict__:
+            setattr(self, key, ParseType.convert_from_parse(value,_using=self._using,_as_user=self._as_user,_throttle=self._throttle))
+
+    def _decode_lazy_fields(self):
+        for key in list(self.__dict__.get('_lazy_fields', ())):
+            self._decode_lazy_field(key)
 
 
     def _to_native(self):
@@ -302,28 +509,54 @@ class ParseResource(ParseBase, Pointer):
         self._object_id = value
 
     def _get_updated_datetime(self):
+        if 'updatedAt' in self.__dict__.get('_lazy_fields', ()):
+            self._decode_lazy_field('updatedAt')
         return self.__dict__.get('_updated_at') and self._updated_at._date
 
     def _set_updated_datetime(self, value):
+        self._drop_lazy_field('updatedAt')
         self._updated_at = Date(value)
 
     def _get_created_datetime(self):
+        if 'createdAt' in self.__dict__.get('_lazy_fields', ()):
+            self._decode_lazy_field('createdAt')
         return self.__dict__.get('_created_at') and self._created_at._date
 
     def _set_created_datetime(self, value):
+        self._drop_lazy_field('createdAt')
         self._created_at = Date(value)
 
     def save(self, batch=False,_using=None,_as_user=None,_throttle=None):
+        """
+        Create the object, or send the fields changed since it was loaded
+        or last saved. With batch=True the (request, callback) pair is
+        returned for ParseBatcher instead, or None if there is nothing to
+        send
+        """
         using = _using or getattr(self,'_using',None)
         as_user = _as_user or getattr(self,'_as_user',None)
+        session = None if batch else current_session()
+        if session is not None:
+            return session.save(self,_using=using,_as_user=as_user)
         if self.objectId:
             return self._update(batch=batch,_using=using,_as_user=as_user,_throttle=_throttle)
         else:
             return self._create(batch=batch,_using=using,_as_user=as_user,_throttle=_throttle)
 
+    def asave(self,_using=None,_as_user=None,_throttle=None):
+        """asyncio version of save(). Returns a coroutine"""
+        from .aio import save
+        return save(self,_using=_using,_as_user=_as_user,_throttle=_throttle)
+
+    def adelete(self,_using=None,_as_user=None,_throttle=None):
+        """asyncio version of delete(). Returns a coroutine"""
+        from .aio import delete
+        return delete(self,_using=_using,_as_user=_as_user,_throttle=_throttle)
+
     def _create(self, batch=False,_using=None,_as_user=None,_throttle=None):
         uri = self.__class__.ENDPOINT_ROOT
-        response = self.__class__.POST(uri, batch=batch, _app_id=_using,_user=_as_user,_throttle=_throttle,**self._to_native())
+        native = self._to_native()
+        response = self.__class__.POST(uri, batch=batch, _app_id=_using,_user=_as_user,_throttle=_throttle,**native)
 
         if not hasattr(self,'ACL') or self.ACL is None:
             self.ACL = copy.copy(self.DEFAULT_ACL)
@@ -341,6 +574,9 @@ class ParseResource(ParseBase, Pointer):
             self.createdAt = self.updatedAt = response_dict['createdAt']
             self.objectId = response_dict['objectId']
             self.id = self.objectId
+            self._take_snapshot(native)
+            self._remember(_using,_as_user)
+            invalidate_queries(self.__class__.ENDPOINT_ROOT)
             return self
 
         if batch:
@@ -349,11 +585,18 @@ class ParseResource(ParseBase, Pointer):
             return call_back(response)
 
     def _update(self, batch=False,_using=None,_as_user=None,_throttle=None):
+        native = self._changed_fields(self._to_native())
+        if not native:
+            # nothing has changed since it was loaded or saved: no request,
+            # and nothing for a batch to send either
+            return None
         response = self.__class__.PUT(self._absolute_url, batch=batch,
-                                      _app_id=_using,_user=_as_user,_throttle=_throttle,**self._to_native())
+                                      _app_id=_using,_user=_as_user,_throttle=_throttle,**native)
 
         def call_back(response_dict):
             self.updatedAt = response_dict['updatedAt']
+            self._take_snapshot(native)
+            invalidate_queries(self.__class__.ENDPOINT_ROOT)
 
         if batch:
             return response, call_back
@@ -361,9 +604,14 @@ class ParseResource(ParseBase, Pointer):
             call_back(response)
 
     def delete(self, batch=False,_using=None,_as_user=None,_throttle=None):
+        session = None if batch else current_session()
+        if session is not None:
+            return session.delete(self,_using=_using,_as_user=_as_user)
         response = self.__class__.DELETE(self._absolute_url, batch=batch,_app_id=_using,_user=_as_user,_throttle=_throttle)
         def call_back(response_dict):
+            self._forget(_using,_as_user)
             self.__dict__ = {}
+            invalidate_queries(self.__class__.ENDPOINT_ROOT)
 
         if batch:
             return response, call_back
@@ -381,11 +629,23 @@ class ParseResource(ParseBase, Pointer):
     def __repr__(self):
         return '<%s:%s>' % (new_str(self.parse_table or self.__class__.__name__), self.objectId)
 
+# Object subclasses by parse class name, so pointers decode into the class
+# defined for them. Classes made up by Object.factory only fill the gaps
+CLASS_REGISTRY = {}
+
+
 class ObjectMetaclass(type):
     def __new__(cls, name, bases, dct):
         cls = super(ObjectMetaclass, cls).__new__(cls, name, bases, dct)
         cls.set_endpoint_root()
         cls.Query = QueryManager(cls)
+        if any(isinstance(base, ObjectMetaclass) for base in bases):
+            if dct.get('_factory_made'):
+                # under the name it was made for, even if it inherits a
+                # parse_table
+                CLASS_REGISTRY.setdefault(name, cls)
+            else:
+                CLASS_REGISTRY[cls._class_name()] = cls
         return cls
 
 
@@ -395,11 +655,18 @@ class Object(with_metaclass(ObjectMetaclass, ParseResource)):
 
     @classmethod
     def factory(cls, class_name):
-        class DerivedClass(cls):
-            pass
-        DerivedClass.__name__ = str(class_name)
-        DerivedClass.set_endpoint_root()
-        return DerivedClass
+        """
+        The class for parse class class_name: the subclass defined for it
+        if there is one, otherwise one made (once) on the fly
+        """
+        klass = CLASS_REGISTRY.get(class_name)
+        if klass is None or not issubclass(klass, cls):
+            klass = ObjectMetaclass(str(class_name), (cls,), {'_factory_made': True})
+            # another thread may have registered one first
+            registered = CLASS_REGISTRY.get(class_name)
+            if registered is not None and issubclass(registered, cls):
+                klass = registered
+        return klass
 
     @classmethod
     def set_endpoint_root(cls):
@@ -421,6 +688,7 @@ class Object(with_metaclass(ObjectMetaclass, ParseResource)):
                 })
 
     def serialize(self):
+        self._decode_lazy_fields()
         vals = {'pk':getattr(self,'objectId',None),
                 '__type':self.parse_table or self.__class__.__name__,
                 'objectId':self.objectId,
@@ -442,7 +710,9 @@ class Object(with_metaclass(ObjectMetaclass, ParseResource)):
     def increment(self, key, amount=1,_using=None,_as_user=None,_throttle=None):
         """
         Increment one value in the object. Note that this happens immediately:
-        it does not wait for save() to be called
+        it does not wait for save() to be called. Inside a session it is
+        queued, and increments to the same field are added together. The
+        object in memory changes once Parse has applied it
         """
         payload = {
             key: {
@@ -450,8 +720,16 @@ class Object(with_metaclass(ObjectMetaclass, ParseResource)):
                 'amount': amount
                 }
             }
-        self.__class__.PUT(self._absolute_url, _app_id=_using,_user=_as_user,_throttle=_throttle,**payload)
-        self.__dict__[key] += amount
+        session = current_session()
+        if session is None:
+            self._operations(payload,_using=_using,_as_user=_as_user,_throttle=_throttle)
+        elif not self.objectId:
+            # nothing to increment on the server yet: it's created with
+            # the new value
+            self.__dict__[key] = (self.__dict__.get(key) or 0) + amount
+            session.save(self,_using=_using,_as_user=_as_user)
+        else:
+            session.operation(self, payload,_using=_using,_as_user=_as_user)
 
     def removeRelation(self, key, objs,_using=None,_as_user=None,_throttle=None):
         self.manageRelation('RemoveRelation', key, objs,_using=_using,_as_user=_as_user,_throttle=_throttle)
@@ -474,6 +752,46 @@ class Object(with_metaclass(ObjectMetaclass, ParseResource)):
                  "objects": objects
                 }
             }
-        self.__class__.PUT(self._absolute_url, _app_id=_using,_user=_as_user,_throttle=_throttle,**payload)
-        self.__dict__[key] = ''
+        session = current_session()
+        if session is None:
+            self._operations(payload,_using=_using,_as_user=_as_user,_throttle=_throttle)
+        else:
+            session.operation(self, payload,_using=_using,_as_user=_as_user)
+
+    def _operations(self, payload, batch=False,_using=None,_as_user=None,_throttle=None,_queued=None):
+        """send field operations ({key: {'__op': ...}}) for the object"""
+        response = self.__class__.PUT(self._absolute_url, batch=batch,
+                                      _app_id=_using,_user=_as_user,_throttle=_throttle,**payload)
+
+        def call_back(response_dict):
+            self._apply_operations(payload, _queued)
+            invalidate_queries(self.__class__.ENDPOINT_ROOT)
 
+        if batch:
+            return response, call_back
+        else:
+            call_back(response)
+
+    def _apply_operations(self, payload, queued=None):
+        """
+        Make the changes Parse has made for field operations. A field
+        changed locally keeps its change on top of an increment. queued
+        has the local values of fields when their increments were queued:
+        a field set again since then keeps the value it was set to
+        """
+        snapshot = self.__dict__.get('_snapshot')
+        for key, op in list(payload.items()):
+            if op['__op'] == 'Increment':
+                before = self.__dict__.get(key)
+                replaced = queued is not None and key in queued and queued[key] != before
+                if not replaced:
+                    self.__dict__[key] = (before or 0) + op['amount']
+                if snapshot is None:
+                    continue
+                if key in snapshot:
+                    snapshot[key] = (snapshot[key] or 0) + op['amount']
+                elif before is None and not replaced:
+                    snapshot[key] = self.__dict__[key]
+            else:
+                self.__dict__[key] = ''
+                self._take_snapshot({key: ''})
@@ -0,0 +1,278 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Counters and histograms for every request made to Parse, plus hooks for
+anything that wants to see each one (logging, tracing):
+
+    from parse_rest import metrics
+    metrics.snapshot()['histograms']['latency_seconds{endpoint=GameScore,method=GET}']['p99']
+
+Every attempt is recorded, including the ones that are retried. Set
+metrics.ENABLED = False to turn the counters off; hooks and the tracer
+still run.
+'''
+
+from __future__ import division
+from builtins import object
+
+import bisect
+import collections
+import threading
+import time
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+ENABLED = True
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# What one attempt at a request came to, passed to the hooks. status is
+# None if no response came back, in which case error says why. bytes_* are
+# what went over the network, uncompressed_bytes_* the bodies before
+# compression (or after decompression)
+RequestEvent = collections.namedtuple('RequestEvent',
+    ['app_id', 'method', 'url', 'endpoint', 'status', 'error', 'elapsed', 'throttle_wait',
+     'bytes_sent', 'bytes_received', 'operations', 'attempt',
+     'uncompressed_bytes_sent', 'uncompressed_bytes_received'])
+
+_lock = threading.Lock()
+_counters = collections.Counter()
+_histograms = {}
+_hooks = []
+_tracer = None
+
+
+class Histogram(object):
+    '''Counts of observations in fixed buckets, with their sum, min and max'''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last one is for everything above the top bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        '''Upper bound of the bucket holding the q-th percentile'''
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+def metric_name(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s=%s' % item for item in sorted(labels.items())))
+
+
+def incr(name, value=1, **labels):
+    with _lock:
+        _counters[metric_name(name, labels)] += value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    key = metric_name(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def snapshot():
+    '''Everything counted since the last reset(), as plain dicts'''
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'histograms': dict((key, h.snapshot()) for key, h in _histograms.items()),
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def add_hook(hook):
+    '''Call hook with a RequestEvent after every attempt at a request'''
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def set_tracer(tracer):
+    '''
+        Open a span for every attempt at a request. tracer needs an
+        OpenTelemetry style start_span(name, attributes=...) returning a
+        span with set_attribute(), record_exception() and end(). None
+        turns tracing off
+    '''
+    global _tracer
+    _tracer = tracer
+
+
+def endpoint_of(url, api_root=None):
+    '''
+        What a request was for, for grouping: the class name for
+        /classes/<name>, otherwise the first part of the path (users,
+        batch, functions...)
+    '''
+    path = url[len(api_root):] if api_root and url.startswith(api_root) else url
+    path = path.split('?', 1)[0]
+    if '://' in path:
+        path = path.split('://', 1)[1].partition('/')[2]
+    parts = [p for p in path.split('/') if p]
+    if parts and parts[0] == '1':
+        parts = parts[1:]
+    if not parts:
+        return ''
+    if parts[0] == 'classes' and len(parts) > 1:
+        return parts[1]
+    return parts[0]
+
+
+class RequestTimer(object):
+    '''Follows one attempt at a request. See begin()'''
+    def __init__(self, method, url, app_id=None, api_root=None, operations=1, bytes_sent=0, attempt=1,
+                 uncompressed_bytes_sent=None):
+        self.method = method
+        self.url = url
+        self.app_id = app_id or 'default'
+        self.endpoint = endpoint_of(url, api_root)
+        self.operations = operations
+        self.bytes_sent = bytes_sent
+        self.uncompressed_bytes_sent = bytes_sent if uncompressed_bytes_sent is None else uncompressed_bytes_sent
+        self.attempt = attempt
+        self.created = self.started = time.time()
+        self.span = None
+        if _tracer is not None:
+            try:
+                self.span = _tracer.start_span('parse %s %s' % (method, self.endpoint), attributes={
+                    'http.method': method, 'http.url': url, 'parse.app_id': self.app_id,
+                    'parse.endpoint': self.endpoint, 'parse.operations': operations, 'parse.attempt': attempt})
+            except Exception as e:
+                LOGGER.warning(u'Could not start a span: %s' % e)
+
+    def sent(self):
+        '''The request got through the throttle and is about to go out'''
+        self.started = time.time()
+
+    def finished(self, status=None, bytes_received=0, error=None, uncompressed_bytes_received=None, elapsed=None):
+        '''
+            The response (or error) is in. elapsed is how long it took, if
+            that's better known than the time since sent(), e.g. leaving
+            out decoding
+        '''
+        if elapsed is None:
+            elapsed = time.time() - self.started
+        waited = self.started - self.created
+        if uncompressed_bytes_received is None:
+            uncompressed_bytes_received = bytes_received
+        if ENABLED:
+            self._count(status, bytes_received, uncompressed_bytes_received, error, elapsed, waited)
+        if _hooks:
+            event = RequestEvent(self.app_id, self.method, self.url, self.endpoint, status, error, elapsed,
+                                 waited, self.bytes_sent, bytes_received, self.operations, self.attempt,
+                                 self.uncompressed_bytes_sent, uncompressed_bytes_received)
+            for hook in list(_hooks):
+                try:
+                    hook(event)
+                except Exception as e:
+                    LOGGER.warning(u'Metrics hook %r failed: %s' % (hook, e))
+        if self.span is not None:
+            try:
+                if status is not None:
+                    self.span.set_attribute('http.status_code', status)
+                self.span.set_attribute('http.response_content_length', bytes_received)
+                self.span.set_attribute('http.response_content_length_uncompressed', uncompressed_bytes_received)
+                if error is not None:
+                    self.span.record_exception(error)
+                self.span.end()
+            except Exception as e:
+                LOGGER.warning(u'Could not end a span: %s' % e)
+
+    def _count(self, status, bytes_received, uncompressed_bytes_received, error, elapsed, waited):
+        app = {'app_id': self.app_id}
+        incr('requests', method=self.method, endpoint=self.endpoint, **app)
+        if status is not None:
+            incr('responses', status='%sxx' % (status // 100), **app)
+        else:
+            incr('network_errors', error=type(error).__name__, **app)
+        if self.attempt > 1:
+            incr('retries', method=self.method, **app)
+        incr('bytes_sent', self.bytes_sent, **app)
+        incr('bytes_received', bytes_received, **app)
+        incr('uncompressed_bytes_sent', self.uncompressed_bytes_sent, **app)
+        incr('uncompressed_bytes_received', uncompressed_bytes_received, **app)
+        observe('latency_seconds', elapsed, method=self.method, endpoint=self.endpoint)
+        observe('throttle_wait_seconds', waited, **app)
+        if self.endpoint == 'batch':
+            observe('batch_size', self.operations, buckets=SIZE_BUCKETS, **app)
+
+
+class _NullTimer(object):
+    def sent(self):
+        pass
+
+    def finished(self, status=None, bytes_received=0, error=None, uncompressed_bytes_received=None, elapsed=None):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+
+def begin(method, url, app_id=None, api_root=None, operations=1, bytes_sent=0, attempt=1,
+          uncompressed_bytes_sent=None):
+    '''
+        Start following an attempt at a request, before it waits on the
+        throttle. Call sent() on what comes back once it's through and
+        finished() when the response (or error) is in
+    '''
+    if not (ENABLED or _hooks or _tracer is not None):
+        return _NULL_TIMER
+    return RequestTimer(method, url, app_id, api_root, operations, bytes_sent, attempt, uncompressed_bytes_sent)
@@ -0,0 +1,267 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from future import standard_library
+standard_library.install_aliases()
+
+from builtins import object
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+
+import collections
+import io
+import select
+import socket
+import threading
+import time
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+# Idle connections kept per pool. Anything over this is closed once it's
+# handed back rather than blocking the caller
+DEFAULT_POOL_SIZE = 10
+# Idle keep-alive connections older than this are thrown away instead of
+# reused. Parse (and most load balancers in front of parse-server) drop
+# idle connections somewhere around a minute
+DEFAULT_IDLE_TIMEOUT = 50
+# Socket timeout for new connections. None means the global socket default,
+# which is what urlopen() used
+DEFAULT_TIMEOUT = None
+# Requests that can safely be sent again if the connection fails after
+# they've gone out
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+def connection_dropped(conn):
+    '''
+        Health check for an idle connection. An idle keep-alive socket
+        should have nothing to read, so if select() says it's readable the
+        server has either closed it or sent something we didn't ask for.
+    '''
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (ValueError, select.error, socket.error):
+        return True
+    return bool(readable)
+
+
+def network_error(error, sent=True):
+    '''
+        error as a URLError, noting whether the request had been sent when
+        it happened: if it hadn't, the server can't have acted on it
+    '''
+    wrapped = URLError(error)
+    wrapped.sent = sent
+    return wrapped
+
+
+class PooledResponse(object):
+    '''
+        Thin wrapper around an http.client response that hands its
+        connection back to the pool once the body has been consumed
+    '''
+    def __init__(self, pool, conn, response):
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def isclosed(self):
+        '''Whether the whole body has been read (or abandoned)'''
+        return self._response is None or self._response.isclosed()
+
+    def read(self, amt=None):
+        if self._response is None:
+            return b''
+        try:
+            data = self._response.read(amt) if amt is not None else self._response.read()
+        except (socket.error, HTTPException):
+            self.close()
+            raise
+        if self._response.isclosed():
+            self.release()
+        return data
+
+    def release(self):
+        '''Return the connection to the pool. Only valid once the body is read'''
+        if self._conn is not None:
+            self._pool._put_conn(self._conn, will_close=self._response.will_close)
+            self._conn = None
+        self._response = None
+
+    def close(self):
+        '''Abandon the response, closing the underlying connection'''
+        if self._conn is not None:
+            self._conn.close()
+            self._pool._discard()
+            self._conn = None
+        self._response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class HTTPConnectionPool(object):
+    '''
+        Persistent HTTP/1.1 connections to a single API root.
+
+        Connections are checked out for one request/response at a time and
+        put back once the response body has been read, so each thread gets
+        its own socket while idle sockets are shared.
+    '''
+    def __init__(self, api_root, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_TIMEOUT):
+        parsed = urlparse(api_root)
+        if parsed.scheme not in ('http', 'https'):
+            raise ValueError('Unsupported scheme for connection pool: %s' % api_root)
+        if pool_size < 1:
+            raise ValueError('Pool size should be at least 1')
+
+        self.api_root = api_root
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        # (connection, time it was put back) pairs, most recently used last
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+        # Stats, mostly so we can see whether connections are being reused
+        self.num_connections = 0
+        self.num_requests = 0
+        self.num_reused = 0
+        self.num_dropped = 0
+
+    def __repr__(self):
+        return u'<HTTPConnectionPool: %s, idle=%s, size=%s>' % (self.api_root, len(self._idle), self.pool_size)
+
+    def configure(self, pool_size=None, idle_timeout=None, timeout=None):
+        with self._lock:
+            if pool_size is not None:
+                self.pool_size = pool_size
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            if timeout is not None:
+                self.timeout = timeout
+            while len(self._idle) > self.pool_size:
+                self._idle.popleft()[0].close()
+
+    def _new_conn(self):
+        kw = {}
+        if self.timeout is not None:
+            kw['timeout'] = self.timeout
+        klass = HTTPSConnection if self.scheme == 'https' else HTTPConnection
+        with self._lock:
+            self.num_connections += 1
+        return klass(self.host, self.port, **kw)
+
+    def _get_conn(self):
+        '''Return a (connection, reused) pair'''
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if (self.idle_timeout and now - last_used > self.idle_timeout) or connection_dropped(conn):
+                conn.close()
+                with self._lock:
+                    self.num_dropped += 1
+                continue
+            return conn, True
+        return self._new_conn(), False
+
+    def _put_conn(self, conn, will_close=False):
+        if will_close or conn.sock is None:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def _discard(self):
+        with self._lock:
+            self.num_dropped += 1
+
+    def clear(self):
+        '''Close every idle connection'''
+        with self._lock:
+            idle, self._idle = self._idle, collections.deque()
+        for conn, _ in idle:
+            conn.close()
+
+    def urlopen(self, method, url, body=None, headers=None):
+        '''
+            Make a request over a pooled connection. Errors are raised as
+            HTTPError/URLError so callers can treat this exactly like
+            urllib's urlopen(). A URLError's sent says whether the request
+            had gone out
+        '''
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        conn, reused = self._get_conn()
+        try:
+            sent = False
+            try:
+                conn.request(method, path, body, headers or {})
+                sent = True
+                response = conn.getresponse()
+            except (socket.error, HTTPException) as e:
+                conn.close()
+                if not reused or (sent and method not in IDEMPOTENT_METHODS):
+                    # once it's been sent, the server may have acted on it
+                    # before the connection went: a POST can't be replayed
+                    raise
+                # The server closed a keep-alive socket between our health
+                # check and the request, so try once more on a fresh
+                # connection.
+                LOGGER.debug(u'Stale pooled connection to %s: %s' % (self.api_root, e))
+                with self._lock:
+                    self.num_dropped += 1
+                conn, reused, sent = self._new_conn(), False, False
+                conn.request(method, path, body, headers or {})
+                sent = True
+                response = conn.getresponse()
+        except (socket.error, HTTPException) as e:
+            conn.close()
+            raise network_error(e, sent)
+
+        with self._lock:
+            self.num_requests += 1
+            if reused:
+                self.num_reused += 1
+
+        pooled = PooledResponse(self, conn, response)
+        if response.status >= 400:
+            content = pooled.read()
+            raise HTTPError(url, response.status, response.reason, response.msg, io.BytesIO(content))
+        return pooled
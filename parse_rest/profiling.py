@@ -0,0 +1,202 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Where the time goes when fetching queries: waiting on the network, decoding
+JSON, converting Parse types (dates, pointers...) and building objects.
+
+    with parse_rest.profile() as p:
+        GameScore.Query.all()._fetch()
+    print(p.report())
+
+Setting PARSE_REST_PROFILE=1 in the environment profiles the whole run and
+logs the report at exit. Each phase's time excludes the phases nested in
+it, so they add up. Nothing is timed while no profile is running.
+'''
+
+from __future__ import division
+from builtins import object
+
+import atexit
+import collections
+import os
+import threading
+import time
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+ENV_VAR = 'PARSE_REST_PROFILE'
+PHASES = ('network', 'json_decode', 'conversion', 'construction')
+
+# True while any profile is running. Checked before timing anything, so
+# profiling costs nothing when it's off
+ACTIVE = False
+
+_clock = getattr(time, 'perf_counter', time.time)
+_lock = threading.Lock()
+_profiles = []
+_local = threading.local()
+
+
+class FetchRecord(object):
+    '''The phases of one QueryManager._fetch()'''
+    def __init__(self, class_name):
+        self.class_name = class_name
+        self.rows = 0
+        self.total = 0
+        self.phases = collections.Counter()
+
+    def as_dict(self):
+        return {'class': self.class_name, 'rows': self.rows, 'total': self.total, 'phases': dict(self.phases)}
+
+
+class Profile(object):
+    '''Totals per phase, and a FetchRecord per fetch, while it runs'''
+    def __init__(self):
+        self.totals = collections.Counter()
+        self.fetches = []
+
+    def __enter__(self):
+        start(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        stop(self)
+
+    def as_dict(self):
+        with _lock:
+            return {'phases': dict(self.totals), 'fetches': [f.as_dict() for f in self.fetches]}
+
+    def report(self):
+        with _lock:
+            fetches = list(self.fetches)
+            totals = dict(self.totals)
+        timed = sum(totals.get(name, 0) for name in PHASES)
+        # requests outside of fetches (saves, batches) count too
+        whole = max(sum(f.total for f in fetches), timed)
+        lines = ['%-14s %10s %7s' % ('phase', 'ms', 'share')]
+        for name in PHASES:
+            seconds = totals.get(name, 0)
+            lines.append('%-14s %10.2f %6.1f%%' % (name, seconds * 1000, 100 * seconds / whole if whole else 0))
+        if whole:
+            lines.append('%-14s %10.2f %6.1f%%' % ('other', (whole - timed) * 1000, 100 * (whole - timed) / whole))
+        lines.append('')
+        lines.append('%-20s %7s %10s ' % ('fetch', 'rows', 'ms') + ' '.join('%12s' % name for name in PHASES))
+        for f in fetches:
+            lines.append('%-20s %7d %10.2f ' % (f.class_name[:20], f.rows, f.total * 1000) +
+                         ' '.join('%12.2f' % (f.phases.get(name, 0) * 1000) for name in PHASES))
+        return '\n'.join(lines)
+
+
+def profile():
+    '''Profile everything fetched inside a with block, on any thread'''
+    return Profile()
+
+
+def start(p):
+    global ACTIVE
+    with _lock:
+        _profiles.append(p)
+        ACTIVE = True
+
+
+def stop(p):
+    global ACTIVE
+    with _lock:
+        _profiles.remove(p)
+        ACTIVE = bool(_profiles)
+
+
+class _Phase(object):
+    __slots__ = ('name', 'started', 'nested')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.nested = 0
+        self.started = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = _clock() - self.started
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        add(self.name, elapsed - self.nested)
+
+
+def add(name, seconds):
+    '''Count seconds towards phase name, for time that can't be a with block'''
+    fetch = getattr(_local, 'fetch', None)
+    with _lock:
+        for p in _profiles:
+            p.totals[name] += seconds
+        if fetch is not None:
+            fetch.phases[name] += seconds
+
+
+class _NoPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    '''Time a with block as part of phase name, if profiling'''
+    return _Phase(name) if ACTIVE else _NO_PHASE
+
+
+class fetch(object):
+    '''
+        Group the phases of one fetch on this thread. Set rows on what
+        the with statement returns
+    '''
+    def __init__(self, class_name):
+        self.record = FetchRecord(class_name)
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'fetch', None)
+        _local.fetch = self.record
+        self.started = _clock()
+        return self.record
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.record.total = _clock() - self.started
+        _local.fetch = self.previous
+        with _lock:
+            for p in _profiles:
+                p.fetches.append(self.record)
+
+
+def _report_at_exit(p):
+    stop(p)
+    LOGGER.warning(u'parse_rest profile:\n%s' % p.report())
+
+
+if os.environ.get(ENV_VAR, '').lower() not in ('', '0', 'false', 'no'):
+    _env_profile = Profile()
+    start(_env_profile)
+    atexit.register(_report_at_exit, _env_profile)
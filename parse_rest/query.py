@@ -16,9 +16,16 @@ from builtins import str, object
 from future.utils import with_metaclass
 from past.builtins import basestring
 
-import json
 import collections
 import copy
+import functools
+import queue
+import threading
+from multiprocessing.pool import ThreadPool
+
+from . import profiling
+from .cache import QUERY_CACHE
+from .connection import MAX_PARSE_OFFSET, codec_for, get_keys
 
 
 class QueryResourceDoesNotExist(Exception):
@@ -34,103 +41,567 @@ class BadQueryParametersException(Exception):
     ''' Bad query args '''
     pass
 
+# Rows decoded together when a response is streamed. Only this many raw
+# rows are held at once
+STREAM_BATCH_SIZE = 100
+
+# objectIds are random strings over this alphabet, in the order Parse
+# (MongoDB) compares them
+OBJECT_ID_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+def object_id_ranges(n):
+    """
+    Split the objectId keyspace into n contiguous [lower, upper) ranges,
+    evenly by two character prefix. The first range is open below and
+    the last open above, so ids from outside the alphabet aren't missed.
+    """
+    base = len(OBJECT_ID_ALPHABET)
+    n = max(1, min(int(n), base * base))
+    bounds = [None]
+    for i in range(1, n):
+        k = i * base * base // n
+        bounds.append(OBJECT_ID_ALPHABET[k // base] + OBJECT_ID_ALPHABET[k % base])
+    bounds.append(None)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def concurrency_for(n, throttle=None):
+    """how many requests to have in flight at once, given the throttle"""
+    if throttle:
+        n = min(n, int(throttle.batch_limit))
+    return max(1, n)
+
+
+# Most objectIds looked up by a single prefetch_related query
+PREFETCH_BATCH_SIZE = 1000
+
+
+def _unloaded(value):
+    from .datatypes import ParseResource
+    return isinstance(value, ParseResource) and value.objectId and not getattr(value, '_loaded', True)
+
+
+def prefetch_plan(instances, fields, _using=None, _as_user=None, _throttle=None):
+    """
+    Work out what prefetch_related(*fields) has to load for instances.
+    Returns the querysets to run, one per target class and
+    PREFETCH_BATCH_SIZE objectIds, and (class name, objectId, setter)
+    slots for fill_prefetched() to put the loaded objects in place.
+    """
+    from .datatypes import ForeignKey, ParseResource, class_attribute
+
+    targets = collections.OrderedDict()
+    slots = []
+
+    def want(klass, oid, setter):
+        name = klass._class_name()
+        targets.setdefault(name, (klass, set()))[1].add(oid)
+        slots.append((name, oid, setter))
+
+    for obj in instances:
+        if not isinstance(obj, ParseResource):
+            continue
+        for field in fields:
+            fk = class_attribute(type(obj), field)
+            if isinstance(fk, ForeignKey):
+                target = obj.__dict__.get('_' + field + '_obj')
+                if target is not None:
+                    oid = target.objectId if _unloaded(target) else None
+                else:
+                    oid = obj.__dict__.get('_' + field + '_id') or getattr(obj, field + '_id', None)
+                if oid:
+                    want(fk.cls, oid, functools.partial(fk._fill, obj))
+                continue
+            value = getattr(obj, field, None)
+            if _unloaded(value):
+                want(type(value), value.objectId, functools.partial(setattr, obj, field))
+
+    querysets = []
+    for klass, ids in targets.values():
+        ids = sorted(ids)
+        for i in range(0, len(ids), PREFETCH_BATCH_SIZE):
+            qs = Queryset(klass.Query, _using=_using, _as_user=_as_user, _throttle=_throttle)
+            querysets.append(qs.filter(objectId__in=ids[i:i + PREFETCH_BATCH_SIZE]))
+    return querysets, slots
+
+
+def fill_prefetched(slots, loaded):
+    """put the objects loaded for a prefetch_plan() where they belong"""
+    found = dict(((obj._class_name(), obj.objectId), obj) for obj in loaded)
+    for name, oid, setter in slots:
+        obj = found.get((name, oid))
+        if obj is not None:
+            setter(obj)
+
+
+class RowFields(object):
+    """
+    Field names shared by the Rows of one query, each row storing just a
+    tuple of values in this order. Names are added as rows with new fields
+    turn up, so earlier rows may have shorter tuples.
+    """
+
+    def __init__(self, model_class, _using=None, _as_user=None, _throttle=None):
+        self.model_class = model_class
+        self.using = _using
+        self.as_user = _as_user
+        self.throttle = _throttle
+        self.names = []
+        self.index = {}
+
+    def build(self, rows):
+        """turn raw rows into Rows"""
+        names, index = self.names, self.index
+        results = []
+        for row in rows:
+            for name in row:
+                if name not in index:
+                    index[name] = len(names)
+                    names.append(name)
+            results.append(Row(self, tuple([row.get(name, Row.MISSING) for name in names])))
+        return results
+
+
+class _Missing(object):
+    """Row.MISSING, which unpickles as itself"""
+    def __reduce__(self):
+        return '_MISSING'
+
+    def __repr__(self):
+        return '<missing>'
+
+_MISSING = _Missing()
+
+
+class Row(object):
+    """
+    Compact, read only query result: attribute access to the row's fields
+    (typed ones decoded on each read) and to_object() for a full object
+    """
+    __slots__ = ('_fields', '_values')
+
+    # marks fields the row doesn't have
+    MISSING = _MISSING
+
+    def __init__(self, fields, values):
+        self._fields = fields
+        self._values = values
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            # not a Parse field name. copy and pickle look up the likes of
+            # __setstate__ before _fields has been set
+            raise AttributeError(name)
+        i = self._fields.index.get(name)
+        value = self._values[i] if i is not None and i < len(self._values) else Row.MISSING
+        if value is Row.MISSING:
+            raise AttributeError("Row has no field '%s'" % name)
+        from .datatypes import Date, ParseType
+        if name in ('createdAt', 'updatedAt'):
+            return Date._from_str(value)
+        fields = self._fields
+        return ParseType.convert_from_parse(value, _using=fields.using, _as_user=fields.as_user, _throttle=fields.throttle)
+
+    def __repr__(self):
+        return '<Row %s>' % self._raw()
+
+    def _raw(self):
+        """the row as it came from the server"""
+        return dict((name, value) for name, value in zip(self._fields.names, self._values) if value is not Row.MISSING)
+
+    def to_object(self):
+        """the full model class instance for this row"""
+        fields = self._fields
+        return fields.model_class._from_parse(self._raw(), _using=fields.using, _as_user=fields.as_user, _throttle=fields.throttle)
+
+
+class StreamedPage(list):
+    """
+    A page of results decoded while its response was read. last_object_id
+    is the objectId of its last raw row, for high volume paging
+    """
+    last_object_id = None
+
+
+class PageCursor(object):
+    """
+    Paging state for one query. Parse caps a page at 1000 rows, so a fetch
+    walks either skip offsets or (in high volume mode) objectId order. The
+    cursor only works out the next request and turns the raw rows of a
+    response into results, so any transport can drive it.
+    """
+
+    def __init__(self, model_class, kw, page_size=None, object_id_range=None):
+        kw = dict(kw)
+        self.model_class = model_class
+        self.uri = model_class.ENDPOINT_ROOT
+        self.using = kw.pop('_using', None)
+        self.as_user = kw.pop('_as_user', None)
+        self.high_volume = kw.pop('_high_volume', False)
+        self.values_list = kw.pop('_values_list', None)
+        self.values = kw.pop('_values', None)
+        self.throttle = kw.pop('_throttle', None)
+        self.parallel = kw.pop('_parallel', None)
+        self.partitions = kw.pop('_partitions', None)
+        self.cache_ttl = kw.pop('_cache_ttl', None)
+        self.prefetch = kw.pop('_prefetch', None)
+        self.lazy = kw.pop('_lazy', False)
+        # iterating and values()/values_list() decode pages as they're read
+        self.stream = kw.pop('_stream', False)
+        self.rows = None
+        if kw.pop('_as_rows', False):
+            self.rows = RowFields(model_class, self.using, self.as_user, self.throttle)
+        # [lower, upper) bounds on objectId for a partitioned scan
+        self.lower, self.upper = object_id_range or (None, None)
+
+        self.done = False
+        self.limit = kw.get('limit',1000)
+        # An explicit limit (under 1000) is a single request. Otherwise page
+        # through everything, page_size rows at a time
+        self.paged = self.limit >= 1000
+        if self.paged:
+            self.limit = max(1, min(page_size or 1000, 1000))
+        kw['limit'] = self.limit
+        self.offset = kw.get('skip',0)
+        kw['skip'] = self.offset
+        self.last_object_id = None
+        self.codec = codec_for(get_keys(self.using))
+        if self.high_volume:
+            kw['order'] = 'objectId'
+            # Where is actually a JSON string. Decode it once, not per page
+            where = kw.get('where', '{}')
+            self.where = self.codec.loads(where) if isinstance(where, basestring) else where
+        self.kw = kw
+
+    def request(self):
+        """keyword arguments for the GET of the next page"""
+        kw = dict(self.kw)
+        if self.high_volume:
+            bounds = {}
+            if self.last_object_id:
+                bounds['$gt'] = self.last_object_id
+            elif self.lower:
+                bounds['$gte'] = self.lower
+            if self.upper:
+                bounds['$lt'] = self.upper
+            if bounds:
+                where = dict(self.where)
+                where['objectId'] = bounds
+                kw['where'] = self.codec.dumps_str(where)
+        else:
+            kw['skip'] = self.offset
+        kw.update(_app_id=self.using,_user=self.as_user,_throttle=self.throttle)
+        return kw
+
+    def _resolved_cache_ttl(self):
+        """
+        TTL to cache this query's pages for, or None if it isn't cached.
+        cached() on the queryset wins, then the app's query_cache_ttl
+        """
+        ttl = self.cache_ttl
+        if ttl is None:
+            keys = get_keys(self.using) or {}
+            ttl = keys.get('query_cache_ttl')
+            if not ttl:
+                return None
+            return QUERY_CACHE.ttl_for(self.uri, ttl)
+        if ttl is True:
+            return QUERY_CACHE.ttl_for(self.uri)
+        return ttl or None
+
+    def cached(self, kw):
+        """
+        Return (response, generation) for request kw. response is None if
+        the page has to be fetched; pass generation on to remember()
+        """
+        if self._resolved_cache_ttl() is None:
+            return None, None
+        key = self._cache_key(kw)
+        return QUERY_CACHE.get_response(key), QUERY_CACHE.generation(self.uri)
+
+    def remember(self, kw, res, generation=None):
+        """cache the response to request kw, if this query is cached"""
+        ttl = self._resolved_cache_ttl()
+        if ttl is not None:
+            QUERY_CACHE.set_response(self._cache_key(kw), res, ttl=ttl, generation=generation)
+
+    def _cache_key(self, kw):
+        keys = get_keys(self.using) or {}
+        return QUERY_CACHE.make_key(self.uri, keys.get('app_id'), self.as_user, kw)
+
+    def requests_ahead(self, n):
+        """
+        Requests for the next n skip windows, so they can be fetched at the
+        same time. Feed the responses to advance() in the same order.
+        """
+        if self.high_volume:
+            raise ValueError('High volume queries page on objectId and can only be fetched in order')
+        if not self.paged:
+            return [self.request()]
+        requests = []
+        offset = self.offset
+        while len(requests) < n and offset <= MAX_PARSE_OFFSET:
+            kw = self.request()
+            kw['skip'] = offset
+            requests.append(kw)
+            offset += self.limit
+        return requests
+
+    def advance(self, res):
+        """
+        Take the response for the page just requested, move on to the next
+        page and return the raw rows
+        """
+        # apparently parse server can return a signular result instead their normal format
+        if 'results' not in res:
+            res = {'results':[res]}
+        rows = res.get('results')
+
+        if len(rows) < self.limit or not self.paged:
+            self.done = True
+        elif self.high_volume:
+            self.last_object_id = rows.last_object_id if isinstance(rows, StreamedPage) else rows[-1]['objectId']
+        else:
+            self.offset += self.limit
+            if self.offset > MAX_PARSE_OFFSET:
+                # parse can't handle offsets > 10k without a serious hack (order_by)
+                self.done = True
+        return rows
+
+    @property
+    def returns_objects(self):
+        return not (self.values_list or self.values or self.rows)
+
+    @property
+    def streams(self):
+        """
+        Whether pages are decoded while they're read. Cached queries keep
+        the raw responses, so they aren't, and stream_responses=False in
+        register() turns it off for an app
+        """
+        if not (self.stream or self.values or self.values_list):
+            return False
+        keys = get_keys(self.using) or {}
+        return keys.get('stream_responses', True) and self._resolved_cache_ttl() is None
+
+    def decode_stream(self, rows):
+        """
+        Decode rows, an iterator over a response being read, a batch at a
+        time as they arrive. Returns a StreamedPage for advance()
+        """
+        page = StreamedPage()
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= STREAM_BATCH_SIZE:
+                page.last_object_id = batch[-1].get('objectId')
+                page.extend(self.decode(batch))
+                batch = []
+        if batch:
+            page.last_object_id = batch[-1].get('objectId')
+            page.extend(self.decode(batch))
+        return page
+
+    def decode(self, rows):
+        """turn raw rows into objects, value lists, dicts or Rows"""
+        if isinstance(rows, StreamedPage):
+            # already decoded
+            return rows
+        klass = self.model_class
+        if self.values_list:
+            return [[it[y] for y in self.values_list] for it in rows]
+        elif self.values:
+            return rows
+        elif self.rows:
+            return self.rows.build(rows)
+        with profiling.phase('construction'):
+            return [klass._from_parse(it,_using=self.using,_as_user=self.as_user,_throttle=self.throttle,_lazy=self.lazy) for it in rows]
+
+
 class QueryManager(object):
 
     def __init__(self, model_class):
         self.model_class = model_class
 
     def _fetch(self, **kw):
-        using = None
-        if '_using' in kw:
-            using = kw.get('_using')
-            del kw['_using']
-        as_user = None
-        if '_as_user' in kw:
-            as_user = kw.get('_as_user')
-            del kw['_as_user']
-        high_volume = False
-        if '_high_volume' in kw:
-            high_volume = kw.get('_high_volume')
-            del kw['_high_volume']
-        values_list = kw.get('_values_list')
-        if values_list:
-            del kw['_values_list']
-        values = kw.get('_values')
-        if values:
-            del kw['_values']
-        throttle = None
-        if '_throttle' in kw:
-            throttle = kw.get('_throttle')
-            del kw['_throttle']
-
-        klass = self.model_class
-        uri = self.model_class.ENDPOINT_ROOT
-
-        # This is to compensate for Parse's 1k query limit
-        done = False
-        limit = kw.get('limit',1000)
-        kw['limit'] = limit
-        offset = kw.get('skip',0)
-        kw['skip'] = offset
-        results = []
-        if not high_volume:
-            while not done:
-                res = klass.GET(uri, _app_id=using,_user=as_user,_throttle=throttle,**kw)
-                # apparently parse server can return a signular result instead their normal format
-                if 'results' not in res:
-                    res = {'results':[res]}
-                    
-                if not (values_list or values):
-                    new_res = [klass(_using=using,_as_user=as_user,_throttle=throttle,**it) for it in res.get('results')]
-                elif values_list:
-                    new_res = [[it[y] for y in values_list] for it in res.get('results')]
-                elif values:
-                    new_res = res.get('results')
-                    
-                results.extend(new_res)
-                if len(new_res) < limit or limit < 1000:
-                    done = True
-                else:
-                    offset += 1000
-                    kw['skip'] = offset
+        if profiling.ACTIVE:
+            with profiling.fetch(self.model_class.__name__) as record:
+                results = self._fetch_results(kw)
+                record.rows = len(results)
+                return results
+        return self._fetch_results(kw)
 
-                if offset > 10000:
-                    # parse can't handle offsets > 10k without a serious hack (order_by)
-                    done = True
-            return results
+    def _fetch_results(self, kw):
+        cursor = PageCursor(self.model_class, kw)
+        if cursor.high_volume and cursor.partitions and cursor.partitions > 1:
+            results = self._partitioned_fetch(kw)
+        elif cursor.parallel and cursor.parallel > 1 and not cursor.high_volume:
+            results = self._parallel_fetch(cursor)
         else:
-            lastObjId = None
-            kw['order'] = 'objectId'
-            while not done:
-                if lastObjId:
-                    # Where is actually a JSON string
-                    where = json.loads(kw.get('where','{}'))
-                    where['objectId'] = {'$gt':lastObjId}
-                    kw['where'] = json.dumps(where)
-                
-                res = klass.GET(uri, _app_id=using,_user=as_user,_throttle=throttle,**kw)
-                # apparently parse server can return a signular result instead their normal format
-                if 'results' not in res:
-                    res = {'results':[res]}
-                    
-                if not (values_list or values):
-                    new_res = [klass(_using=using,_as_user=as_user,_throttle=throttle,**it) for it in res.get('results')]
-                elif values_list:
-                    new_res = [[it[y] for y in values_list] for it in res.get('results')]
-                elif values:
-                    new_res = res.get('results')
-                    
-                results.extend(new_res)
-                if len(new_res) < limit or limit < 1000:
-                    done = True
-                else:
-                    if isinstance(results[-1], dict):
-                        # if they called values)()
-                        lastObjId = results[-1]['objectId']
-                    else:
-                        lastObjId = results[-1].objectId
+            results = self._drain(cursor)
+        return self._prefetch(cursor, results)
 
+    def _prefetch(self, cursor, results):
+        """load the pointers named by prefetch_related() for results"""
+        if not cursor.prefetch or not cursor.returns_objects:
             return results
+        querysets, slots = prefetch_plan(results, cursor.prefetch, cursor.using, cursor.as_user, cursor.throttle)
+        fill_prefetched(slots, [obj for qs in querysets for obj in qs._fetch()])
+        return results
+
+    def _drain(self, cursor):
+        """fetch every page of cursor, one after another"""
+        results = []
+        while not cursor.done:
+            res = self._get(cursor, cursor.request())
+            results.extend(cursor.decode(cursor.advance(res)))
+        return results
+
+    def _get(self, cursor, kw):
+        """GET one page for cursor, going through the query cache"""
+        if cursor.streams:
+            return self.model_class.GET(cursor.uri, _stream=cursor.decode_stream, **kw)
+        res, generation = cursor.cached(kw)
+        if res is None:
+            res = self.model_class.GET(cursor.uri, **kw)
+            cursor.remember(kw, res, generation)
+        return res
+
+    def _partition_cursors(self, kw, page_size=None):
+        n = kw.get('_partitions')
+        return [PageCursor(self.model_class, kw, page_size=page_size, object_id_range=r)
+                for r in object_id_ranges(n)]
+
+    def _partitioned_fetch(self, kw):
+        """
+        Scan the objectId keyspace as separate ranges, each on its own
+        worker. The ranges are put back together in order, so the results
+        are in objectId order just like a plain high volume fetch.
+        """
+        cursors = self._partition_cursors(kw)
+        pool = ThreadPool(concurrency_for(len(cursors), cursors[0].throttle))
+        try:
+            parts = pool.map(self._drain, cursors)
+        finally:
+            pool.close()
+            pool.join()
+        return [result for part in parts for result in part]
+
+    def _iterate(self, chunk_size=None, **kw):
+        """
+        Generate results a page (of chunk_size rows) at a time. The next
+        page is requested in the background while the current one is being
+        decoded and consumed, and nothing is kept once it's been handed out.
+        """
+        cursor = PageCursor(self.model_class, kw, page_size=chunk_size)
+        if cursor.high_volume and cursor.partitions and cursor.partitions > 1:
+            for result in self._iterate_partitions(kw, chunk_size):
+                yield result
+            return
+
+        def get(kw):
+            return self._get(cursor, kw)
+
+        pool = ThreadPool(1)
+        try:
+            pending = pool.apply_async(get, (cursor.request(),))
+            while pending is not None:
+                rows = cursor.advance(pending.get())
+                pending = None
+                if not cursor.done:
+                    pending = pool.apply_async(get, (cursor.request(),))
+                for result in self._prefetch(cursor, cursor.decode(rows)):
+                    yield result
+                rows = None
+        finally:
+            # if the caller stopped early, a prefetch may still be running.
+            # It's left to finish on its own and its page is dropped
+            pool.close()
+
+    def _iterate_partitions(self, kw, chunk_size=None):
+        """
+        Stream a partitioned scan. Pages are handed out as they arrive from
+        any partition, so they're not in objectId order. A bounded queue
+        keeps the workers from getting too far ahead of the caller.
+        """
+        cursors = self._partition_cursors(kw, page_size=chunk_size)
+        pages = queue.Queue(maxsize=2 * len(cursors))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=.25)
+                    return
+                except queue.Full:
+                    continue
+
+        def scan(cursor):
+            try:
+                while not cursor.done and not stop.is_set():
+                    put((cursor, cursor.advance(self._get(cursor, cursor.request()))))
+            except Exception as e:
+                put((None, e))
+            finally:
+                put(None)
+
+        pool = ThreadPool(concurrency_for(len(cursors), cursors[0].throttle))
+        pool.map_async(scan, cursors)
+        remaining = len(cursors)
+        try:
+            while remaining:
+                item = pages.get()
+                if item is None:
+                    remaining -= 1
+                    continue
+                cursor, rows = item
+                if cursor is None:
+                    raise rows
+                for result in self._prefetch(cursor, cursor.decode(rows)):
+                    yield result
+        finally:
+            stop.set()
+            pool.close()
+
+    def _parallel_fetch(self, cursor):
+        """
+        Fetch the skip windows in waves of cursor.parallel pages at a time
+        (no more than the throttle allows at once), keeping them in order
+        """
+        n = concurrency_for(cursor.parallel, cursor.throttle)
+
+        def get(kw):
+            return self._get(cursor, kw)
+
+        results = []
+        pool = ThreadPool(n)
+        try:
+            while not cursor.done:
+                for res in pool.map(get, cursor.requests_ahead(n)):
+                    if cursor.done:
+                        # an earlier page in this wave was the last one
+                        break
+                    results.extend(cursor.decode(cursor.advance(res)))
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+    def _columns(self, fields, **kw):
+        """
+        Fetch fields of every result as one array per field, converting
+        each page as it arrives. Only those fields are requested
+        """
+        from .columns import ColumnBuilder
+        for option in ('_values', '_values_list', '_as_rows', '_lazy', '_prefetch'):
+            kw.pop(option, None)
+        kw.setdefault('keys', ','.join(fields))
+        cursor = PageCursor(self.model_class, kw)
+        columns = ColumnBuilder(fields)
+        while not cursor.done:
+            columns.add(cursor.advance(self._get(cursor, cursor.request())))
+        return columns.result()
 
     def _count(self, **kw):
         using = None
@@ -145,6 +616,12 @@ class QueryManager(object):
         if '_throttle' in kw:
             throttle = kw.get('_throttle')
             del kw['_throttle']
+        kw.pop('_parallel', None)
+        kw.pop('_partitions', None)
+        kw.pop('_cache_ttl', None)
+        kw.pop('_prefetch', None)
+        kw.pop('_lazy', None)
+        kw.pop('_as_rows', None)
         
         kw.update({"count": 1, "limit": 0})
         return self.model_class.GET(self.model_class.ENDPOINT_ROOT,_app_id=using,_user=as_user,_throttle=throttle,
@@ -160,6 +637,24 @@ class QueryManager(object):
 
     def throttle(self,val):
         return Queryset(self,_throttle=val)
+
+    def parallel(self,val):
+        return self.all().parallel(val)
+
+    def partitions(self,val):
+        return self.all().partitions(val)
+
+    def cached(self,ttl=None):
+        return self.all().cached(ttl)
+
+    def prefetch_related(self,*fields):
+        return self.all().prefetch_related(*fields)
+
+    def lazy(self,val=True):
+        return self.all().lazy(val)
+
+    def as_rows(self):
+        return self.all().as_rows()
         
     def include(self,val):
         return self.all().include(val)
@@ -185,6 +680,9 @@ class QueryManager(object):
     def values(self,*args):
         return self.all().values(*args)
 
+    def values_columns(self,*args):
+        return self.all().values_columns(*args)
+
     def limit(self,val):
         return self.all().limit(val)
 
@@ -241,7 +739,7 @@ class Queryset(with_metaclass(QuerysetMetaclass, object)):
         
         raise Exception('Unknown operator')
 
-    def __init__(self, manager,_using=None,_as_user=None,_throttle=None,_high_volume=False,_values_list=None,_values=None):
+    def __init__(self, manager,_using=None,_as_user=None,_throttle=None,_high_volume=False,_values_list=None,_values=None,_parallel=None,_partitions=None,_cache_ttl=None,_prefetch=None,_lazy=False,_as_rows=False):
         self._manager = manager
         self._where = collections.defaultdict(dict)
 
@@ -252,6 +750,12 @@ class Queryset(with_metaclass(QuerysetMetaclass, object)):
         self._high_volume = _high_volume
         self._values_list = _values_list
         self._values=_values
+        self._parallel = _parallel
+        self._partitions = _partitions
+        self._cache_ttl = _cache_ttl
+        self._prefetch = _prefetch
+        self._lazy = _lazy
+        self._as_rows = _as_rows
 
     def __iter__(self):
         return iter(self._fetch())
@@ -273,11 +777,38 @@ class Queryset(with_metaclass(QuerysetMetaclass, object)):
     def serialize(self):
         return [x.serialize() for x in self]
 
+    def iterator(self, chunk_size=None):
+        """
+        Stream results instead of loading them all up front. Pages of
+        chunk_size rows (at most 1000, the default) are fetched one after
+        another, with the next page prefetched while the current one is
+        being processed.
+        """
+        return self._manager._iterate(chunk_size=chunk_size, _stream=True, **self._fetch_options())
+
+    def afetch(self):
+        """asyncio version of fetching the whole queryset. Returns a coroutine"""
+        from .aio import fetch
+        return fetch(self)
+
+    def acount(self):
+        """asyncio version of count(). Returns a coroutine"""
+        from .aio import fetch
+        return fetch(self, count=True)
+
     def _fetch(self, count=False):
         """
         Return a list of objects matching query, or if count == True return
         only the number of objects matching.
         """
+        options = self._fetch_options()
+
+        if count:
+            return self._manager._count(**options)
+
+        return self._manager._fetch(**options)
+
+    def _fetch_options(self):
         options = copy.deepcopy(self._options)  # make a local copy
         if self._using:
             options['_using'] = self._using
@@ -287,6 +818,18 @@ class Queryset(with_metaclass(QuerysetMetaclass, object)):
             options['_throttle'] = self._throttle
         if self._high_volume:
             options['_high_volume'] = self._high_volume
+        if self._parallel:
+            options['_parallel'] = self._parallel
+        if self._partitions:
+            options['_partitions'] = self._partitions
+        if self._cache_ttl is not None:
+            options['_cache_ttl'] = self._cache_ttl
+        if self._prefetch:
+            options['_prefetch'] = self._prefetch
+        if self._lazy:
+            options['_lazy'] = self._lazy
+        if self._as_rows:
+            options['_as_rows'] = self._as_rows
         
         if self._values_list:
             options['_values_list'] = self._values_list
@@ -295,17 +838,15 @@ class Queryset(with_metaclass(QuerysetMetaclass, object)):
 
         if self._where:
             # JSON encode WHERE values
-            where = json.dumps(self._where)
+            where = codec_for(get_keys(self._using)).dumps_str(self._where)
             options.update({'where': where})
-        
-        if count:
-            return self._manager._count(**options)
-
-        return self._manager._fetch(**options)
+        return options
 
     def _clone(self):
         clone = Queryset(manager=self._manager,_using=self._using,_as_user=self._as_user,_throttle=self._throttle,_high_volume=self._high_volume,
-                         _values_list=self._values_list,_values=self._values)
+                         _values_list=self._values_list,_values=self._values,_parallel=self._parallel,
+                         _partitions=self._partitions,_cache_ttl=self._cache_ttl,
+                         _prefetch=self._prefetch,_lazy=self._lazy,_as_rows=self._as_rows)
         clone._options = copy.deepcopy(self._options)
         clone._where = copy.deepcopy(self._where)
         return clone
@@ -330,6 +871,67 @@ class Queryset(with_metaclass(QuerysetMetaclass, object)):
         clone._high_volume = val
         return clone
 
+    def parallel(self,val):
+        """
+        Fetch up to val pages (skip windows) at the same time instead of one
+        after another. Only applies to the normal, skip based paging.
+        """
+        clone = self._clone()
+        clone._parallel = int(val)
+        return clone
+
+    def partitions(self,val):
+        """
+        Split a high volume scan into val objectId ranges and scan them at
+        the same time, sharing the queryset's throttle. Fetching keeps
+        objectId order; iterator() streams pages as they arrive instead.
+        """
+        clone = self._clone()
+        clone._partitions = int(val)
+        return clone
+
+    def cached(self,ttl=None):
+        """
+        Serve this query from the query cache when possible. ttl is in
+        seconds; without one the class's TTL (or the cache default) is
+        used. cached(0) skips the cache even if the app caches all queries.
+        Saving or deleting objects of the class drops its cached queries.
+        """
+        clone = self._clone()
+        clone._cache_ttl = True if ttl is None else ttl
+        return clone
+
+    def prefetch_related(self,*fields):
+        """
+        Load what the pointer fields (ForeignKeys or plain pointers) of the
+        results point to up front, with one objectId__in query per class
+        and 1000 objects, instead of a request per object when they're
+        first used.
+        """
+        clone = self._clone()
+        clone._prefetch = tuple(clone._prefetch or ()) + fields
+        return clone
+
+    def lazy(self,val=True):
+        """
+        Leave dates, pointers and other typed fields of the results as they
+        came from the server until they're first read. Saves decoding
+        fields that are never looked at.
+        """
+        clone = self._clone()
+        clone._lazy = val
+        return clone
+
+    def as_rows(self):
+        """
+        Return compact Rows instead of objects: much less memory per result
+        for big scans, with attribute access to fields and to_object() to
+        get the full object for a row.
+        """
+        clone = self._clone()
+        clone._as_rows = True
+        return clone
+
     def include(self,val):
         clone = self._clone()
         clone._options['include'] = val
@@ -407,6 +1009,16 @@ class Queryset(with_metaclass(QuerysetMetaclass, object)):
         clone = self._clone()
         clone._values = args
         return clone
+
+    def values_columns(self,*args):
+        """
+        Fetch the named fields of every result as columns: an ordered dict
+        of field name to a NumPy array if NumPy is installed, otherwise an
+        array.array (a list for text and mixed values). Dates become
+        datetime64 or seconds since the epoch (datetimes in a mixed
+        column), and missing numbers NaN.
+        """
+        return self._manager._columns(args, **self._fetch_options())
     
     # too lazy to put this in filter and it's a distinct enough operation
     def matchesQuery(self, fieldName, subquery):
@@ -0,0 +1,240 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from builtins import object
+
+import collections
+import email.utils
+import errno
+import random
+import socket
+import threading
+import time
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+# Statuses Parse (or whatever sits in front of it) returns when a request
+# can simply be made again later
+RETRY_STATUSES = (429, 502, 503, 504)
+# Verbs that are safe to repeat after the server may have acted on them
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# What one attempt came to, passed to the policy's listeners. outcome is
+# 'success', 'retry' or 'fail'; delay is the wait before the next attempt
+RetryEvent = collections.namedtuple('RetryEvent',
+    ['method', 'url', 'attempt', 'outcome', 'status', 'error', 'delay', 'elapsed'])
+
+
+def retry_after(headers):
+    '''
+        Seconds asked for by a Retry-After header, given either as a number
+        of seconds or as an HTTP date. None if there isn't a usable one
+    '''
+    if not headers:
+        return None
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(email.utils.mktime_tz(parsed) - time.time(), 0)
+
+
+def request_sent(error):
+    '''
+        Whether a network error may have come after the request went out.
+        Transports set sent on the errors they raise. Otherwise only a
+        connection that was refused or a host that couldn't be found is
+        known to have sent nothing
+    '''
+    sent = getattr(error, 'sent', None)
+    if sent is not None:
+        return sent
+    reason = getattr(error, 'reason', error)
+    if isinstance(reason, socket.gaierror):
+        return False
+    return getattr(reason, 'errno', None) != errno.ECONNREFUSED
+
+
+class RetryBudget(object):
+    '''
+        Caps retries at a fraction of the requests made over the last period
+        seconds (plus min_retries), shared by everything using the policy.
+        When Parse is down this stops every caller from multiplying the
+        load on it.
+    '''
+    def __init__(self, ratio=0.2, min_retries=10, period=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.period = period
+        self._requests = collections.deque()
+        self._retries = collections.deque()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return u'<RetryBudget: ratio=%s, min_retries=%s, period=%s>' % (self.ratio, self.min_retries, self.period)
+
+    def _clean(self, now):
+        oldest = now - self.period
+        for calls in (self._requests, self._retries):
+            while calls and calls[0] < oldest:
+                calls.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.time()
+            self._clean(now)
+            self._requests.append(now)
+
+    def withdraw(self):
+        '''Use up a retry if the budget allows one'''
+        with self._lock:
+            now = time.time()
+            self._clean(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+
+class RetryPolicy(object):
+    '''
+        Decides whether a failed request is tried again, and after how long.
+
+        Network errors and responses with one of statuses are retried for
+        the idempotent methods only (network errors for any verb if the
+        request never went out, see request_sent()), waiting for
+        as long as a Retry-After header asks if there is one. Otherwise
+        the wait grows exponentially from base_delay up to max_delay, with
+        full jitter so that clients that failed together don't come back
+        together. A request is given up on after max_attempts attempts,
+        after max_wait seconds, or when the budget runs out.
+
+        listeners are called with a RetryEvent after every attempt.
+    '''
+    def __init__(self, max_attempts=None, base_delay=0.5, max_delay=50, max_wait=60*10, jitter=True,
+                 statuses=RETRY_STATUSES, methods=IDEMPOTENT_METHODS, budget=None, listeners=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(methods)
+        self.budget = budget
+        self.listeners = list(listeners or ())
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def __repr__(self):
+        return u'<RetryPolicy: base_delay=%s, max_delay=%s, max_wait=%s, max_attempts=%s>' % (
+            self.base_delay, self.max_delay, self.max_wait, self.max_attempts)
+
+    def __deepcopy__(self, memo):
+        # shared state, like throttles
+        return self
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def backoff(self, attempt, max_delay=None):
+        '''Wait before attempt number attempt + 1'''
+        max_delay = self.max_delay if max_delay is None else max_delay
+        # past 2**62 the float overflows, and the delay is long since capped
+        delay = min(max_delay, self.base_delay * (2 ** min(attempt - 1, 62)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def start(self, method, url=None, max_delay=None, max_wait=None):
+        '''Track the attempts at one request'''
+        if self.budget is not None:
+            self.budget.record_request()
+        return RetryState(self, method, url, max_delay, max_wait)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _notify(self, event):
+        with self._lock:
+            self.counts['attempts'] += 1
+            self.counts[event.outcome] += 1
+            if event.status:
+                self.counts['status_%s' % event.status] += 1
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                LOGGER.warning(u'Retry listener %r failed: %s' % (listener, e))
+
+
+class RetryState(object):
+    '''The attempts made so far at one request'''
+    def __init__(self, policy, method, url=None, max_delay=None, max_wait=None):
+        self.policy = policy
+        self.method = method.upper()
+        self.url = url
+        self.max_delay = policy.max_delay if max_delay is None else max_delay
+        self.max_wait = policy.max_wait if max_wait is None else max_wait
+        self.attempt = 1
+        self.started = time.time()
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def succeeded(self, status=200):
+        self._notify('success', status=status)
+
+    def failed(self, status=None, error=None, headers=None):
+        '''
+            Record a failed attempt. Returns the seconds to wait before
+            trying again, or None if the error should be raised
+        '''
+        delay = self._delay(status, error, headers)
+        self._notify('fail' if delay is None else 'retry', status=status, error=error, delay=delay)
+        if delay is not None:
+            self.attempt += 1
+        return delay
+
+    def _delay(self, status, error, headers):
+        policy = self.policy
+        if status is not None and (status not in policy.statuses or self.method not in policy.methods):
+            return None
+        if status is None and self.method not in policy.methods and request_sent(error):
+            # the server may have acted on it before the connection went
+            return None
+        if policy.max_attempts is not None and self.attempt >= policy.max_attempts:
+            return None
+        delay = retry_after(headers) if status is not None else None
+        if delay is None:
+            delay = policy.backoff(self.attempt, self.max_delay)
+        if self.max_wait and self.elapsed() + delay > self.max_wait:
+            return None
+        if policy.budget is not None and not policy.budget.withdraw():
+            LOGGER.warning(u'Retry budget used up, not retrying %s %s' % (self.method, self.url))
+            return None
+        return delay
+
+    def _notify(self, outcome, status=None, error=None, delay=None):
+        self.policy._notify(RetryEvent(self.method, self.url, self.attempt, outcome,
+                                       status, error, delay, self.elapsed()))
@@ -0,0 +1,173 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Decode a query response while it's still being read. Each row of the
+results array is handed over as soon as it's been parsed, so the whole
+body, its text and every row never have to be in memory at once:
+
+    response = parse(body, lambda rows: [build(row) for row in rows])
+
+The complete rows in each chunk are decoded together by the codec. A row
+cut off by the end of a chunk is decoded on its own once the rest of it
+has arrived, by the standard library's scanner, which can pick up where
+it left off.
+'''
+
+from builtins import object
+
+import codecs
+import json
+import re
+
+from . import codec, profiling
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# what a number can be made of, to tell if one runs into the next chunk
+_NUMBER = re.compile(r'[-+0-9.eE]*')
+
+
+class _Reader(object):
+    '''JSON text fed a chunk of bytes at a time'''
+    def __init__(self, chunks, json_codec=None):
+        self.chunks = iter(chunks)
+        self.codec = codec.get_codec(json_codec)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.text = u''
+        self.pos = 0
+        self.eof = False
+        # whether complete_objects() has had a go at this buffer yet
+        self.batched = False
+
+    def more(self):
+        '''Read another chunk, dropping what's been parsed. False at the end'''
+        if self.eof:
+            return False
+        try:
+            chunk = next(self.chunks)
+            text = self.utf8.decode(chunk)
+        except StopIteration:
+            self.eof = True
+            text = self.utf8.decode(b'', True)
+        self.text = self.text[self.pos:] + text
+        self.pos = 0
+        self.batched = False
+        return True
+
+    def peek(self):
+        '''The next character that isn't whitespace, or None at the end'''
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return None
+
+    def expect(self, chars):
+        c = self.peek()
+        if c is None or c not in chars:
+            raise ValueError('Expected %s at %r' % (' or '.join(chars), self.text[self.pos:self.pos + 20]))
+        self.pos += 1
+        return c
+
+    def value(self):
+        '''Decode the next complete value'''
+        if self.peek() is None:
+            raise ValueError('Unexpected end of JSON')
+        while True:
+            try:
+                with profiling.phase('json_decode'):
+                    value, end = _decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                # most likely cut off by the end of the chunk
+                if self.more():
+                    continue
+                raise
+            if (isinstance(value, (int, float)) and not isinstance(value, bool) and not self.eof and
+                    _NUMBER.match(self.text, self.pos).end() == len(self.text) and self.more()):
+                # the number may carry on in the next chunk
+                continue
+            self.pos = end
+            return value
+
+    def complete_objects(self):
+        '''
+            Decode every complete object of the array from here to the
+            last one in the buffer, or return None if that can't be done
+        '''
+        if self.batched or self.peek() != '{':
+            return None
+        self.batched = True
+        # "},{" (or "}, {") is most likely between two rows. If it's
+        # actually inside one, what's before it won't decode
+        end = max(self.text.rfind('},{', self.pos), self.text.rfind('}, {', self.pos))
+        if end < 0:
+            return None
+        try:
+            with profiling.phase('json_decode'):
+                values = self.codec.loads(u'[%s]' % self.text[self.pos:end + 1])
+        except ValueError:
+            return None
+        self.pos = end + 2
+        return values
+
+    def array(self):
+        '''Generate the values of the array starting here'''
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            values = self.complete_objects()
+            if values is not None:
+                for value in values:
+                    yield value
+                continue
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def parse(chunks, consume, key='results', json_codec=None):
+    '''
+        Decode the JSON object in chunks (an iterable of bytes). The
+        elements of its key array are passed to consume() as an iterator
+        while they're parsed, and whatever it returns becomes key's value.
+        Anything else is decoded in full
+    '''
+    reader = _Reader(chunks, json_codec)
+    if reader.peek() != '{':
+        value = reader.value()
+    else:
+        reader.pos += 1
+        value = {}
+        if reader.peek() == '}':
+            reader.pos += 1
+        else:
+            while True:
+                name = reader.value()
+                reader.expect(':')
+                if name == key and reader.peek() == '[':
+                    items = reader.array()
+                    value[name] = consume(items)
+                    # in case consume() stopped early
+                    for _ in items:
+                        pass
+                else:
+                    value[name] = reader.value()
+                if reader.expect(',}') == '}':
+                    break
+    if reader.peek() is not None:
+        raise ValueError('Extra data after JSON: %r' % reader.text[reader.pos:reader.pos + 20])
+    return value
@@ -7,20 +7,35 @@ Contains unit tests for the Python Parse REST API wrapper
 from __future__ import print_function, absolute_import
 
 from builtins import range, object
+import asyncio
+import io
+import json
 import os
+import pickle
+import socket
 import sys
 import subprocess
+import threading
 import unittest
+import copy
 import datetime
+import dateutil.parser
 import uuid
 import time
+import zlib
+from urllib.error import URLError
+from http.client import HTTPConnection
 
 
-from .core import ResourceRequestNotFound
-from .connection import register, get_keys,ParseBatcher,TimeBasedThrottle
-from .datatypes import GeoPoint, Object, Function
+from .core import ResourceRequestNotFound, ResourceRequestBadRequest, ResourceRequestLoginRequired, ParseBatchError
+from .connection import register, get_keys, get_pool,ParseBase,ParseBatcher,NullThrottle,TimeBasedThrottle,TokenBucketThrottle,AdaptiveThrottle
+from .datatypes import GeoPoint, Object, Function, ParseType, Date, ForeignKey
+from .retry import RetryPolicy
 from .user import User, Role
-from . import query
+from .cache import QUERY_CACHE, LRUCache
+from .pool import HTTPConnectionPool, network_error
+from .benchmarks.server import StandInServer
+from . import codec, columns, compression, metrics, profiling, query, streaming, unitofwork
 
 try:
     from . import settings_local
@@ -260,6 +275,93 @@ class TestTypes(unittest.TestCase):
         self.assert_(iso_date == self.now.isoformat(),
                      'Expected %s. Got %s' % (self.now.isoformat(), iso_date))
 
+    def testCanParseDate(self):
+        for iso in ['2012-03-04T05:06:07.089Z', '2012-03-04T05:06:07Z', '2012-03-04T05:06:07.089+02:00']:
+            parsed = Date._from_str(iso)
+            self.assert_(parsed == dateutil.parser.parse(iso),
+                         'Expected %s. Got %s' % (dateutil.parser.parse(iso), parsed))
+
+    def testPointerUsesDefinedClass(self):
+        pointer = ParseType.convert_from_parse({'__type': 'Pointer', 'className': 'Game', 'objectId': 'abc'})
+        self.assert_(isinstance(pointer, Game), 'Expected a Game. Got %s' % type(pointer))
+        self.assert_(Object.factory('Unknown') is Object.factory('Unknown'),
+                     'Object.factory should make one class per className')
+
+    def testFactoryWithParseTable(self):
+        class Thing(Object):
+            parse_table = 'Thing'
+        other = Thing.factory('Other')
+        self.assertTrue(issubclass(other, Thing))
+        self.assertTrue(Thing.factory('Other') is other, 'Thing.factory should make one class per className')
+        self.assertTrue(Thing.factory('Thing') is Thing)
+        self.assertTrue(Object.factory('Game') is Game)
+
+    def testMetricsHistogram(self):
+        histogram = metrics.Histogram(buckets=(1, 2, 5))
+        for value in (0.5, 1.5, 1.5, 4, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.percentile(50), 2)
+        self.assertEqual(histogram.percentile(99), 10)
+        self.assertEqual(metrics.endpoint_of('https://api.parse.com/1/classes/Game/abc?x=1'), 'Game')
+
+    def testJSONCodecs(self):
+        data = {'name': u'caf\xe9', 'score': 10, 'tags': ['a', None], 'done': True}
+        for name in codec.CODECS:
+            json_codec = codec.get_codec(name)
+            self.assertEqual(json_codec.loads(json_codec.dumps(data)), data)
+            self.assertEqual(json_codec.loads(json_codec.dumps_str(data)), data)
+        self.assertRaises(ValueError, codec.get_codec, 'unknown')
+
+    def testCompression(self):
+        data = b'{"results": [' + b','.join([b'{"score": 1}'] * 2000) + b']}'
+        headers = {}
+        compressed = compression.compress(data, headers, min_size=100)
+        self.assertEqual(headers, {'Content-Encoding': 'gzip'})
+        body = compression.Body(io.BytesIO(compressed), 'gzip', chunk_size=64)
+        self.assertEqual(body.read(), data)
+        self.assertEqual((body.wire_bytes, body.size), (len(compressed), len(data)))
+        self.assertEqual(compression.decompress(zlib.compress(data), 'deflate'), data)
+        self.assertEqual(compression.compress(b'{}', {}, min_size=100), b'{}')
+
+    def testStreamingParse(self):
+        response = {'results': [{'score': i, 'name': u'player },{ %d' % i} for i in range(50)], 'count': 50}
+        data = json.dumps(response, separators=(',', ':')).encode('utf8')
+        for size in (1, 7, 64, len(data)):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual(streaming.parse(chunks, list), response)
+        first = streaming.parse([data], lambda rows: next(rows))
+        self.assertEqual(first, {'results': response['results'][0], 'count': 50})
+        self.assertRaises(ValueError, streaming.parse, [data[:-2]], list)
+
+    def testProfilePhases(self):
+        with profiling.profile() as p:
+            with profiling.fetch('Game') as record:
+                with profiling.phase('construction'):
+                    Date('2020-01-02T03:04:05.678Z')
+        self.assertFalse(profiling.ACTIVE, 'Profiling should stop with the profile')
+        self.assertEqual(sorted(p.totals), ['construction', 'conversion'])
+        self.assertEqual(p.fetches, [record])
+        self.assertAlmostEqual(sum(record.phases.values()), record.total, places=3)
+
+    def testRetryPolicy(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=4, jitter=False)
+        self.assertEqual([policy.backoff(n) for n in range(1, 5)], [1, 2, 4, 4])
+        state = policy.start('GET')
+        self.assertEqual(state.failed(status=503, headers={'Retry-After': '7'}), 7)
+        self.assertEqual(state.failed(status=429), 2)
+        self.assertEqual(state.failed(status=503), None, 'Should give up after max_attempts')
+        self.assertEqual(policy.start('POST').failed(status=503), None, 'POST should not be retried')
+        self.assertEqual(policy.start('GET').failed(status=400), None, '400 should not be retried')
+        self.assertEqual(RetryPolicy(max_delay=4, max_wait=0, jitter=False).backoff(2000), 4)
+
+    def testNetworkErrorRetries(self):
+        policy = RetryPolicy(base_delay=1, jitter=False)
+        self.assertEqual(policy.start('POST').failed(error=network_error(socket.timeout('timed out'))), None)
+        self.assertEqual(policy.start('POST').failed(error=network_error(socket.error('reset'), sent=False)), 1)
+        self.assertEqual(policy.start('POST').failed(error=URLError(socket.gaierror('no such host'))), 1)
+        self.assertEqual(policy.start('GET').failed(error=network_error(socket.timeout('timed out'))), 1)
+
 
 class TestQuery(object):
     """Tests of an object's Queryset"""
@@ -445,6 +547,15 @@ class TestFunction(unittest.TestCase):
         self.assertAlmostEqual(ret["result"], 4.5)
 
 
+class ThrottleCopyTest(unittest.TestCase):
+
+    def testThrottledQuerysetCopies(self):
+        throttle = TimeBasedThrottle(10, 1)
+        queryset = GameScore.Query.all().throttle(throttle).limit(5).skip(1)
+        self.assertTrue(queryset._throttle is throttle, 'Copies of a queryset should share its throttle')
+        self.assertTrue(copy.deepcopy(throttle.calls_per(2))._lock is throttle._lock)
+
+
 class ConfigureRandomUser(object):
     def setUp(self):
         self.username = "dhelmet%s@spaceballs.com" % uuid.uuid4().hex
@@ -702,6 +813,875 @@ class TimeBasedThrottleTest(unittest.TestCase):
         self.assertTrue( (end-start) >= 3)
     
     
+class TokenBucketThrottleTest(unittest.TestCase):
+
+    def testLimits(self):
+        t = TokenBucketThrottle(limit=4,period=1)
+        start = time.time()
+        for i in range(0, 12):
+            with t:
+                pass
+        end = time.time()
+        self.assertGreater(end-start, 2.9)
+        self.assertLess(end-start, 4)
+
+    def testLimitsAndMultiIterations(self):
+        t = TokenBucketThrottle(limit=4,period=1).calls_per(2)
+        start = time.time()
+        for i in range(0, 8):
+            with t:
+                pass
+        end = time.time()
+        self.assertGreater(end-start, 3.9)
+        self.assertLess(end-start, 5)
+
+    def testAdaptiveRate(self):
+        t = AdaptiveThrottle(rate=10, max_rate=12, increase=1)
+        for i in range(0, 50):
+            t.feedback(0.1)
+        self.assertEqual(t.rate, 12)
+        t.feedback(0.1, status=429)
+        self.assertEqual(t.rate, 6)
+        t.feedback(0.1, status=429)
+        self.assertEqual(t.rate, 6, 'A second cut within the cooldown should be ignored')
+        self.assertEqual(t.calls_per(3).batch_limit, 6)
+
+    def testAdaptiveThrottleAttributes(self):
+        t = AdaptiveThrottle(rate=10, calls_per_iteration=2)
+        self.assertEqual((t.limit, t.period, t.path, t.calls_per_iteration), (10, 1, None, 2))
+        t.feedback(0.1, status=429)
+        self.assertEqual((t.limit, t.batch_limit), (5, 5))
+        self.assertEqual(str(t), '<AdaptiveThrottle: rate=5.00/s, min_rate=1, max_rate=1000>')
+        clone = copy.deepcopy(t)
+        self.assertEqual((clone.limit, clone.period), (5, 1))
+
+
+class StandInTestCase(unittest.TestCase):
+    """Tests run offline, against a local benchmarks.server.StandInServer"""
+    USING = 'standin'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandInServer().start()
+        register(cls.USING, 'key', master_key='master', api_root=cls.server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.backend.classes.clear()
+        self.server.reset_counts()
+
+    def requests(self, method, path):
+        return self.server.requests['%s %s' % (method, path)]
+
+    def add_rows(self, class_name, rows):
+        """store rows straight in the server, returning their objectIds"""
+        ids = [self.server.backend.create(class_name, row)['objectId'] for row in rows]
+        self.server.reset_counts()
+        return ids
+
+
+class StandInServerTest(StandInTestCase):
+
+    def call(self, method, path, body=None, headers=None, server=None):
+        """(status, headers, body) for a raw request"""
+        server = server or self.server
+        headers = dict({'X-Parse-Application-Id': 'key'}, **(headers or {}))
+        conn = HTTPConnection(*server._httpd.server_address[:2])
+        try:
+            conn.request(method, path, body and json.dumps(body), headers)
+            response = conn.getresponse()
+            return response.status, response.msg, response.read()
+        finally:
+            conn.close()
+
+    def testQueries(self):
+        backend = self.server.backend
+        for score in range(0, 10):
+            backend.create('GameScore', dict({'score': score}, **({'even': True} if score % 2 == 0 else {})))
+
+        def scores(**params):
+            params.setdefault('order', 'score')
+            return [r['score'] for r in backend.query(backend.classes['GameScore'], params)['results']]
+        self.assertEqual(scores(where={'score': {'$gt': 3, '$lte': 5}}), [4, 5])
+        self.assertEqual(scores(where={'score': {'$in': [1, 7]}}), [1, 7])
+        self.assertEqual(scores(where={'score': {'$nin': list(range(1, 10))}}), [0])
+        self.assertEqual(scores(where={'score': {'$ne': 0}, 'even': True}), [2, 4, 6, 8])
+        self.assertEqual(scores(where={'even': {'$exists': False}}), [1, 3, 5, 7, 9])
+        self.assertEqual(scores(order='-score', skip=2, limit=3), [7, 6, 5])
+        response = backend.query(backend.classes['GameScore'], {'count': 1, 'limit': 0, 'where': '{"score": 3}'})
+        self.assertEqual(response, {'results': [], 'count': 1})
+        row = backend.query(backend.classes['GameScore'], {'keys': 'score', 'limit': 1})['results'][0]
+        self.assertEqual(sorted(row), ['createdAt', 'objectId', 'score', 'updatedAt'])
+
+    def testBatch(self):
+        object_id = self.add_rows('GameScore', [{'score': 1}])[0]
+        status, _, body = self.call('POST', '/1/batch', {'requests': [
+            {'method': 'PUT', 'path': '/1/classes/GameScore/' + object_id,
+             'body': {'score': {'__op': 'Increment', 'amount': 2}}},
+            {'method': 'DELETE', 'path': '/1/classes/GameScore/missing'},
+            {'method': 'POST', 'path': '/1/classes/GameScore', 'body': {'score': 5}}]})
+        results = json.loads(body.decode('utf8'))
+        self.assertEqual(status, 200)
+        self.assertEqual([sorted(r) for r in results], [['success'], ['error'], ['success']])
+        self.assertEqual(results[1]['error']['code'], 101)
+        self.assertEqual(sorted(r['score'] for r in self.server.backend.classes['GameScore'].values()), [3, 5])
+        self.assertEqual((self.requests('POST', '/1/batch'), self.server.operations), (1, 3))
+
+    def testErrors(self):
+        self.assertEqual(self.call('GET', '/1/classes/GameScore', headers={'X-Parse-Application-Id': ''})[0], 401)
+        self.server.fail_next(503, count=2)
+        self.assertEqual([self.call('GET', '/1/classes/GameScore')[0] for _ in range(0, 3)], [503, 503, 200])
+        self.assertEqual(self.call('GET', '/1/nowhere')[0], 404)
+
+    def testRateLimit(self):
+        with StandInServer(rate_limit=2) as server:
+            statuses = [self.call('GET', '/1/classes/GameScore', server=server) for _ in range(0, 3)]
+        self.assertEqual([status for status, _, _ in statuses], [200, 200, 429])
+        self.assertEqual(statuses[2][1].get('Retry-After'), '1')
+        self.assertEqual(json.loads(statuses[2][2].decode('utf8'))['code'], 155)
+
+    def testCompression(self):
+        self.add_rows('GameScore', [{'player_name': 'p%s' % s} for s in range(0, 50)])
+        status, headers, body = self.call('GET', '/1/classes/GameScore', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(len(json.loads(compression.decompress(body, 'gzip').decode('utf8'))['results']), 50)
+        status, headers, body = self.call('GET', '/1/classes/GameScore')
+        self.assertEqual(headers.get('Content-Encoding'), None)
+        self.assertEqual(len(json.loads(body.decode('utf8'))['results']), 50)
+
+    def testUsersAndFunctions(self):
+        self.server.register_function('double', lambda params: params['n'] * 2)
+        self.assertEqual(json.loads(self.call('POST', '/1/functions/double', {'n': 4})[2].decode('utf8')),
+                         {'result': 8})
+        self.call('POST', '/1/users', {'username': 'u', 'password': 'p'})
+        status, _, body = self.call('GET', '/1/login?username=u&password=p')
+        user = json.loads(body.decode('utf8'))
+        self.assertEqual((status, user['username']), (200, 'u'))
+        self.assertFalse('password' in user)
+        status, _, body = self.call('GET', '/1/users/me', headers={'X-Parse-Session-Token': user['sessionToken']})
+        self.assertEqual(json.loads(body.decode('utf8'))['objectId'], user['objectId'])
+        self.assertEqual(self.call('GET', '/1/login?username=u&password=x')[0], 404)
+
+
+class _FakeConnection(object):
+    """an http.client connection whose request or response fails"""
+    def __init__(self, fail_in='getresponse'):
+        self.fail_in = fail_in
+        self.requests = []
+
+    def request(self, method, path, body, headers):
+        self.requests.append(method)
+        if self.fail_in == 'request':
+            raise socket.error('broken pipe')
+
+    def getresponse(self):
+        raise socket.error('connection reset')
+
+    def close(self):
+        pass
+
+
+class ConnectionPoolTest(StandInTestCase):
+
+    def testReusesConnections(self):
+        pool = get_pool(self.server.url)
+        connections, reused = pool.num_connections, pool.num_reused
+        for i in range(0, 3):
+            GameScore(score=i).save(_using=self.USING)
+        self.assertEqual(len(GameScore.Query.using(self.USING).all()), 3)
+        self.assertLessEqual(pool.num_connections - connections, 1, 'Should reuse the open connection')
+        self.assertGreaterEqual(pool.num_reused - reused, 3)
+
+    def _stale(self, method, fail_in='getresponse'):
+        pool = HTTPConnectionPool(self.server.url)
+        stale, fresh = _FakeConnection(fail_in), _FakeConnection()
+        pool._get_conn = lambda: (stale, True)
+        pool._new_conn = lambda: fresh
+        self.assertRaises(URLError, pool.urlopen, method, self.server.url + '/batch', b'{}')
+        return stale.requests + fresh.requests
+
+    def testStaleConnectionReplay(self):
+        self.assertEqual(self._stale('POST'), ['POST'], 'A POST that went out should not be sent again')
+        self.assertEqual(self._stale('POST', fail_in='request'), ['POST', 'POST'])
+        self.assertEqual(self._stale('GET'), ['GET', 'GET'])
+        self.assertEqual(self._stale('PUT'), ['PUT', 'PUT'])
+
+    def testTimedOutPostIsNotRetried(self):
+        pool = get_pool(self.server.url)
+        conn = _FakeConnection()
+        pool._get_conn = lambda: (conn, False)
+        self.addCleanup(delattr, pool, '_get_conn')
+        self.assertRaises(URLError, GameScore.POST, '', _app_id=self.USING, score=1)
+        self.assertEqual(conn.requests, ['POST'])
+
+
+class _FakeUser(object):
+    """a user that isn't logged in yet, noting the thread it logs in on"""
+    sessionToken = None
+
+    def is_master(self):
+        return False
+
+    def is_authenticated(self):
+        return self.sessionToken is not None
+
+    def authenticate(self):
+        self.thread = threading.current_thread()
+        self.sessionToken = 'r:token'
+
+
+class AsyncClientTest(StandInTestCase):
+
+    def run_async(self, coroutine):
+        from . import aio
+
+        async def run():
+            try:
+                return await coroutine
+            finally:
+                await aio.close_pools()
+        return asyncio.run(run())
+
+    def testQueriesAndSaves(self):
+        scores = [GameScore(score=s, player_name='async') for s in range(0, 5)]
+        self.run_async(ParseBatcher().abatch_save(scores, _using=self.USING))
+        self.assertTrue(all(s.objectId for s in scores))
+        self.assertEqual(self.requests('POST', '/batch'), 1)
+
+        scores[0].score = 10
+        self.run_async(scores[0].asave(_using=self.USING))
+        found = self.run_async(GameScore.Query.using(self.USING).filter(score__gte=2).order_by('score').afetch())
+        self.assertEqual([s.score for s in found], [2, 3, 4, 10])
+        self.assertEqual(self.run_async(GameScore.Query.using(self.USING).all().acount()), 5)
+        got = self.run_async(GameScore.aretrieve(scores[1].objectId, _using=self.USING))
+        self.assertEqual(got.score, 1)
+
+        object_id = scores[1].objectId
+        self.run_async(scores[1].adelete(_using=self.USING))
+        self.assertRaises(ResourceRequestNotFound, self.run_async, GameScore.aretrieve(object_id, _using=self.USING))
+        self.assertEqual(self.run_async(Function('echo').acall(_using=self.USING, value=1)), {'result': {'value': 1}})
+
+    def testCompressedPages(self):
+        ParseBatcher().batch_save([GameScore(score=s, player_name='x' * 50) for s in range(0, 40)], _using=self.USING)
+        found = self.run_async(GameScore.Query.using(self.USING).all().afetch())
+        self.assertEqual(sorted(s.score for s in found), list(range(0, 40)))
+
+    def testLogsInOffTheEventLoop(self):
+        user = _FakeUser()
+        self.run_async(Function('echo').acall(_using=self.USING, _as_user=user))
+        self.assertNotEqual(user.thread, threading.current_thread(), 'Logging in should not block the event loop')
+
+    def testBatchRequestError(self):
+        self.server.fail_next(401)
+        scores = [GameScore(score=s) for s in range(0, 120)]
+        self.assertRaises(ResourceRequestLoginRequired, self.run_async,
+                          ParseBatcher().abatch_save(scores, _using=self.USING))
+        self.assertEqual(self.requests('POST', '/batch'), 1)
+
+    def testCorruptBody(self):
+        from . import aio
+
+        async def execute():
+            pool = aio.get_pool(self.server.url)
+
+            async def urlopen(method, url, body=b'', headers=None):
+                return aio.AsyncResponse(200, 'OK', {'Content-Encoding': 'gzip'}, b'not gzip at all')
+            pool.urlopen = urlopen
+            return await aio.execute(GameScore, '', 'POST', _app_id=self.USING, score=1)
+        self.assertRaises(URLError, self.run_async, execute())
+
+    def testReadsChunkedResponses(self):
+        from . import aio
+
+        async def read(data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await aio._read_response(reader, 'GET')
+
+        response, will_close = asyncio.run(read(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                                b'4\r\n{"a"\r\n3\r\n: 1\r\n1\r\n}\r\n0\r\n\r\n'))
+        self.assertEqual((response.status, response.read(), will_close), (200, b'{"a": 1}', False))
+        response, will_close = asyncio.run(read(b'HTTP/1.0 404 Not Found\r\nContent-Length: 2\r\n\r\n{}'))
+        self.assertEqual((response.status, response.reason, response.read(), will_close), (404, 'Not Found', b'{}', True))
+
+    def testStaleConnectionReplay(self):
+        from . import aio
+
+        class Stale(object):
+            def __init__(self):
+                self.reader = asyncio.StreamReader()
+                self.reader.feed_eof()
+                self.writer = self
+                self.requests = 0
+
+            def write(self, data):
+                self.requests += 1
+
+            async def drain(self):
+                pass
+
+            def close(self):
+                pass
+
+        async def urlopen(method):
+            pool = aio.AsyncConnectionPool(self.server.url)
+            stale = Stale()
+
+            async def get_conn():
+                return stale, True
+            pool._get_conn = get_conn
+            try:
+                await pool.urlopen(method, self.server.url + '/classes/GameScore', b'{}',
+                                   {'X-Parse-Application-Id': self.USING})
+                return stale.requests, True
+            except URLError:
+                return stale.requests, False
+            finally:
+                pool.clear()
+
+        self.assertEqual(asyncio.run(urlopen('POST')), (1, False), 'A POST that went out should not be sent again')
+        self.assertEqual(asyncio.run(urlopen('GET')), (1, True))
+
+
+class BatchTest(StandInTestCase):
+
+    def testConcurrentChunks(self):
+        scores = [GameScore(score=s) for s in range(0, 120)]
+        ParseBatcher().batch_save(scores, _using=self.USING, max_in_flight=3)
+        self.assertEqual(self.requests('POST', '/batch'), 3)
+        self.assertTrue(all(s.objectId for s in scores))
+        self.assertEqual(GameScore.Query.using(self.USING).all().count(), 120)
+
+    def testOperationErrors(self):
+        scores = [GameScore(score=s) for s in range(0, 3)]
+        ParseBatcher().batch_save(scores, _using=self.USING)
+        del self.server.backend.classes['GameScore'][scores[1].objectId]
+        try:
+            ParseBatcher().batch_delete(scores, _using=self.USING)
+            self.fail('Expected a ParseBatchError')
+        except ParseBatchError as e:
+            self.assertEqual([index for index, error in e.errors], [1])
+        self.assertEqual(GameScore.Query.using(self.USING).all().count(), 0)
+
+    def testRequestErrorStopsTheBatch(self):
+        self.server.fail_next(401)
+        scores = [GameScore(score=s) for s in range(0, 120)]
+        self.assertRaises(ResourceRequestLoginRequired, ParseBatcher().batch_save, scores, _using=self.USING)
+        self.assertEqual(self.requests('POST', '/batch'), 1, 'No more chunks should be sent after a 401')
+
+
+class DirtyTrackingTest(StandInTestCase):
+
+    def setUp(self):
+        super(DirtyTrackingTest, self).setUp()
+        # the fields each update sends
+        self.sent = []
+        update = self.server.backend.update
+
+        def record(row, params, touch=True):
+            self.sent.append(sorted(params))
+            return update(row, params, touch)
+        self.server.backend.update = record
+        self.addCleanup(delattr, self.server.backend, 'update')
+
+    def add_rows(self, class_name, rows):
+        ids = super(DirtyTrackingTest, self).add_rows(class_name, rows)
+        del self.sent[:]
+        return ids
+
+    def load(self, **row):
+        object_id = self.add_rows('GameScore', [row])[0]
+        return GameScore.Query.using(self.USING).get(objectId=object_id)
+
+    def testOnlyChangedFields(self):
+        score = self.load(score=1, player_name='a')
+        score.save(_using=self.USING)
+        self.assertEqual(self.requests('PUT', '/classes/GameScore/' + score.objectId), 0)
+        self.assertTrue(score.save(batch=True, _using=self.USING) is None)
+        score.score = 2
+        score.save(_using=self.USING)
+        self.assertEqual(self.sent, [['score']])
+
+    def testChangesInPlace(self):
+        score = self.load(tags=['a'], stats={'hits': 1})
+        score.tags.append('b')
+        score.stats['hits'] += 1
+        score.save(_using=self.USING)
+        self.assertEqual(self.sent, [['stats', 'tags']])
+        row = self.server.backend.classes['GameScore'][score.objectId]
+        self.assertEqual((row['tags'], row['stats']), (['a', 'b'], {'hits': 2}))
+
+    def testBlindUpdate(self):
+        object_id = self.add_rows('GameScore', [{'score': 1, 'player_name': 'a'}])[0]
+        score = GameScore(objectId=object_id, score=5)
+        score.save(_using=self.USING)
+        # with no snapshot, everything it has is sent, and nothing else touched
+        self.assertEqual(self.sent, [['score']])
+        row = self.server.backend.classes['GameScore'][object_id]
+        self.assertEqual((row['score'], row['player_name']), (5, 'a'))
+        score.save(_using=self.USING)
+        self.assertEqual(len(self.sent), 1)
+
+    def testFailedSaveStaysChanged(self):
+        score = self.load(score=1)
+        score.score = 2
+        call = score.save(batch=True, _using=self.USING)
+        self.assertTrue(call is not None)
+        self.assertTrue(score._changed_fields(score._to_native()), 'Nothing should be snapshotted before the callback')
+
+        self.server.fail_next(400)
+        self.assertRaises(ResourceRequestBadRequest, score.save, _using=self.USING)
+        score.save(_using=self.USING)
+        self.assertEqual(self.sent, [['score']])
+        self.assertEqual(self.server.backend.classes['GameScore'][score.objectId]['score'], 2)
+
+
+class SessionTest(StandInTestCase):
+
+    def load(self, **row):
+        object_id = self.add_rows('GameScore', [row])[0]
+        return GameScore.Query.using(self.USING).get(objectId=object_id)
+
+    def row(self, obj):
+        return self.server.backend.classes['GameScore'][obj.objectId]
+
+    def testMergedWrites(self):
+        score = self.load(score=1)
+        other = GameScore(score=5)
+        with unitofwork.session(_using=self.USING):
+            score.increment('score')
+            score.increment('score', 10)
+            other.save()
+            self.assertEqual(score.score, 1, 'Nothing should change before the flush')
+        self.assertEqual(self.requests('POST', '/batch'), 1)
+        self.assertEqual((self.row(score)['score'], score.score), (12, 12))
+        self.assertTrue(other.objectId)
+        score.save(_using=self.USING)
+        self.assertEqual(self.requests('PUT', '/classes/GameScore/' + score.objectId), 0)
+
+    def testIncrementChangedField(self):
+        score = self.load(score=1)
+        sent = []
+        update = self.server.backend.update
+        self.server.backend.update = lambda row, params, touch=True: (sent.append(params), update(row, params, touch))
+        self.addCleanup(delattr, self.server.backend, 'update')
+        score.score = 10
+        with unitofwork.session(_using=self.USING):
+            score.save()
+            score.increment('score')
+        self.assertEqual(sent, [{'score': 10}, {'score': {'__op': 'Increment', 'amount': 1}}])
+        self.assertEqual((self.row(score)['score'], score.score), (11, 11))
+        self.assertFalse(score._changed_fields(score._to_native()))
+
+    def testCallOrder(self):
+        score = self.load(score=1)
+        sent = []
+        update = self.server.backend.update
+        self.server.backend.update = lambda row, params, touch=True: (sent.append(params), update(row, params, touch))
+        self.addCleanup(delattr, self.server.backend, 'update')
+        with unitofwork.session(_using=self.USING):
+            score.increment('score')
+            score.score = 10
+            score.save()
+        self.assertEqual(sent, [{'score': {'__op': 'Increment', 'amount': 1}}, {'score': 10}])
+        self.assertEqual(self.requests('POST', '/batch'), 2, 'The save should wait for the increment')
+        self.assertEqual((self.row(score)['score'], score.score), (10, 10))
+        self.assertFalse(score._changed_fields(score._to_native()))
+
+        del sent[:]
+        with unitofwork.session(_using=self.USING):
+            score.increment('score')
+            score.player_name = 'p1'
+            score.save()
+        self.assertEqual(sent, [{'player_name': 'p1', 'score': {'__op': 'Increment', 'amount': 1}}])
+        self.assertEqual((self.row(score)['score'], score.score), (11, 11))
+
+    def testFailedRequestIsQueuedAgain(self):
+        score = self.load(score=1)
+        self.server.fail_next(400)
+        session = unitofwork.session(_using=self.USING)
+        try:
+            with session:
+                score.increment('score')
+            self.fail('Expected the request error')
+        except ResourceRequestBadRequest:
+            pass
+        self.assertEqual((self.row(score)['score'], score.score, len(session)), (1, 1, 1))
+        session.flush()
+        self.assertEqual((self.row(score)['score'], score.score, len(session)), (2, 2, 0))
+
+    def testFailedOperationIsQueuedAgain(self):
+        score, gone = self.load(score=1), self.load(score=1)
+        session = unitofwork.session(_using=self.USING)
+        del self.server.backend.classes['GameScore'][gone.objectId]
+        try:
+            with session:
+                score.increment('score')
+                gone.increment('score')
+            self.fail('Expected a ParseBatchError')
+        except ParseBatchError as e:
+            self.assertEqual([obj for obj, error in e.errors], [gone])
+        self.assertEqual((score.score, gone.score), (2, 1))
+        self.assertEqual(len(session), 1)
+        session.discard()
+        self.assertEqual(len(session), 0)
+
+
+class _FakeResponse(object):
+    """a response whose body comes from data, or whose reads fail with error"""
+    def __init__(self, data=b'', encoding=None, error=None):
+        self.body = io.BytesIO(data)
+        self.size = len(data)
+        self.headers = {'Content-Encoding': encoding} if encoding else {}
+        self.error = error
+        self.status = 200
+
+    def read(self, amt=None):
+        if self.error is not None:
+            raise self.error
+        return self.body.read(amt)
+
+    def isclosed(self):
+        return self.body.tell() == self.size
+
+    def close(self):
+        pass
+
+
+class _FakePool(object):
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def urlopen(self, method, url, body=None, headers=None):
+        return self.responses.pop(0)
+
+
+class ResponseReadingTest(unittest.TestCase):
+    URL = 'http://127.0.0.1:9/1/classes/GameScore'
+
+    def execute(self, pool, throttle=None, retry=None, stream=None):
+        return ParseBase._serial_execute('GET', self.URL, None, {}, retry, throttle or NullThrottle(), 1,
+                                         pool=pool, stream=stream)
+
+    def testReadErrorsAreRetried(self):
+        retry = RetryPolicy(max_attempts=2, base_delay=0, jitter=False).start('GET', self.URL)
+        pool = _FakePool(_FakeResponse(error=socket.error('connection reset')),
+                         _FakeResponse(b'{"results": []}'))
+        self.assertEqual(self.execute(pool, retry=retry), {'results': []})
+
+        pool = _FakePool(_FakeResponse(b'not gzip at all', encoding='gzip'))
+        self.assertRaises(URLError, self.execute, pool)
+
+    def testThrottleLetGoBeforeDecoding(self):
+        throttle = TimeBasedThrottle(limit=100, period=1)
+        data = json.dumps({'results': [{'n': n} for n in range(0, 5)]}).encode('utf8')
+        pool = _FakePool(_FakeResponse(data))
+        response = self.execute(pool, throttle=throttle,
+                                stream=lambda rows: [(row['n'], throttle._in_flight[0]) for row in rows])
+        self.assertEqual(response['results'], [(n, 0) for n in range(0, 5)])
+
+    def testDecodingTimeIsLeftOut(self):
+        throttle = AdaptiveThrottle(rate=10, slow_response=0.05)
+        data = json.dumps({'results': [{'n': n} for n in range(0, 3)]}).encode('utf8')
+
+        def slow(rows):
+            for row in rows:
+                time.sleep(0.03)
+            return []
+        self.execute(_FakePool(_FakeResponse(data)), throttle=throttle, stream=slow)
+        self.assertGreater(throttle.rate, 10, 'Decoding should not count as a slow response')
+
+
+class ParallelFetchTest(StandInTestCase):
+
+    def testParallelPages(self):
+        self.add_rows('GameScore', [{'score': s} for s in range(0, 2500)])
+        found = GameScore.Query.using(self.USING).all().order_by('score').parallel(4)._fetch()
+        self.assertEqual([s.score for s in found], list(range(0, 2500)))
+        # a single wave of four pages, the last of them empty
+        self.assertEqual(self.requests('GET', '/classes/GameScore'), 4)
+
+    def testParallelWithLimit(self):
+        self.add_rows('GameScore', [{'score': s} for s in range(0, 20)])
+        found = GameScore.Query.using(self.USING).all().order_by('score').skip(5).limit(10).parallel(4)._fetch()
+        self.assertEqual([s.score for s in found], list(range(5, 15)))
+
+
+class IteratorTest(StandInTestCase):
+
+    def setUp(self):
+        super(IteratorTest, self).setUp()
+        self.add_rows('GameScore', [{'score': s} for s in range(0, 250)])
+
+    def testPages(self):
+        scores = GameScore.Query.using(self.USING).all().order_by('score').iterator(chunk_size=100)
+        self.assertEqual([s.score for s in scores], list(range(0, 250)))
+        self.assertEqual(self.requests('GET', '/classes/GameScore'), 3)
+
+    def testHighVolume(self):
+        scores = GameScore.Query.using(self.USING).high_volume(True).filter(score__gte=50).iterator(chunk_size=60)
+        self.assertEqual(sorted(s.score for s in scores), list(range(50, 250)))
+        self.assertEqual(self.requests('GET', '/classes/GameScore'), 4)
+
+    def testStopEarly(self):
+        scores = GameScore.Query.using(self.USING).all().order_by('score').iterator(chunk_size=100)
+        self.assertEqual([next(scores).score for _ in range(0, 3)], [0, 1, 2])
+        scores.close()
+        self.assertLessEqual(self.requests('GET', '/classes/GameScore'), 2, 'At most one page should be fetched ahead')
+
+
+class PartitionedScanTest(StandInTestCase):
+
+    def testObjectIdRanges(self):
+        ranges = query.object_id_ranges(4)
+        self.assertEqual(ranges, [(None, 'FV'), ('FV', 'V0'), ('V0', 'kV'), ('kV', None)])
+        self.assertEqual(query.object_id_ranges(1), [(None, None)])
+        self.assertEqual(len(query.object_id_ranges(10 ** 6)), 62 * 62)
+
+    def testPartitionedFetch(self):
+        ids = self.add_rows('GameScore', [{'score': s} for s in range(0, 1500)])
+        found = GameScore.Query.using(self.USING).high_volume(True).partitions(4)._fetch()
+        self.assertEqual([s.objectId for s in found], sorted(ids))
+        self.assertGreaterEqual(self.requests('GET', '/classes/GameScore'), 4)
+
+    def testPartitionedIterator(self):
+        ids = self.add_rows('GameScore', [{'score': s} for s in range(0, 500)])
+        scores = GameScore.Query.using(self.USING).high_volume(True).partitions(3).filter(score__lt=400)
+        self.assertEqual(sorted(s.objectId for s in scores.iterator(chunk_size=50)), sorted(ids[:400]))
+
+
+class QueryCacheTest(StandInTestCase):
+
+    def setUp(self):
+        super(QueryCacheTest, self).setUp()
+        QUERY_CACHE.clear()
+        self.add_rows('GameScore', [{'score': s, 'player_name': 'p%s' % (s % 2)} for s in range(0, 10)])
+
+    def gets(self):
+        return self.requests('GET', '/classes/GameScore')
+
+    def testCachedQueries(self):
+        scores = GameScore.Query.using(self.USING).cached(60)
+        self.assertEqual(len(scores.filter(score__gte=5, player_name='p1')._fetch()), 3)
+        found = scores.filter(player_name='p1').filter(score__gte=5)._fetch()
+        self.assertEqual(sorted(s.score for s in found), [5, 7, 9])
+        self.assertEqual(self.gets(), 1, 'The same filters built in another order should hit the cache')
+        found[0].score = 100
+        again = scores.filter(player_name='p1').filter(score__gte=5)._fetch()
+        self.assertEqual(sorted(s.score for s in again), [5, 7, 9], 'Every hit should get a fresh copy')
+
+        GameScore.Query.using(self.USING).cached(0)._fetch()
+        GameScore.Query.using(self.USING).all()._fetch()
+        self.assertEqual(self.gets(), 3, 'Uncached queries should go to the server')
+
+    def testWritesInvalidate(self):
+        scores = GameScore.Query.using(self.USING).cached(60).filter(score__gte=8)
+        self.assertEqual(len(scores._fetch()), 2)
+        GameScore(score=20).save(_using=self.USING)
+        self.assertEqual(len(scores._fetch()), 3)
+        self.assertEqual(self.gets(), 2)
+        ParseBatcher().batch_delete(scores._fetch(), _using=self.USING)
+        self.assertEqual(len(scores._fetch()), 0)
+
+    def testExpiry(self):
+        scores = GameScore.Query.using(self.USING).cached(0.05)
+        scores._fetch()
+        scores._fetch()
+        time.sleep(0.1)
+        scores._fetch()
+        self.assertEqual(self.gets(), 2)
+
+    def testAppTTL(self):
+        register('standin-cached', 'key', api_root=self.server.url, query_cache_ttl=60)
+        GameScore.Query.using('standin-cached').all()._fetch()
+        GameScore.Query.using('standin-cached').all()._fetch()
+        self.assertEqual(self.gets(), 1)
+
+    def testUserWithoutSessionKey(self):
+        kw = {'where': {}}
+        anonymous = QUERY_CACHE.make_key('/classes/GameScore', 'app', None, kw)
+        self.assertNotEqual(QUERY_CACHE.make_key('/classes/GameScore', 'app', User(), kw), anonymous)
+        self.assertNotEqual(QUERY_CACHE.make_key('/classes/GameScore', 'app', User(objectId='u1'), kw), anonymous)
+        self.assertNotEqual(QUERY_CACHE.make_key('/classes/GameScore', 'app', User(objectId='u1'), kw),
+                            QUERY_CACHE.make_key('/classes/GameScore', 'app', User(sessionToken='u1'), kw))
+
+    def testLRU(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        self.assertEqual(cache.evictions, 1)
+
+
+class IdentityMapTest(StandInTestCase):
+    CACHED = 'standin-identity'
+
+    def setUp(self):
+        super(IdentityMapTest, self).setUp()
+        register(self.CACHED, 'key', api_root=self.server.url, object_cache_size=100)
+
+    def testSameInstance(self):
+        game_id, = self.add_rows('Game', [{'title': 'Candyland'}])
+        score_id, = self.add_rows('GameScore', [{'score': 1, 'game': {'__type': 'Pointer', 'className': 'Game', 'objectId': game_id}}])
+        game = Game.retrieve(game_id, _using=self.CACHED)
+        self.assertTrue(Game.retrieve(game_id, _using=self.CACHED) is game)
+        self.assertTrue(Game.Query.using(self.CACHED).get(objectId=game_id) is game)
+        self.assertTrue(GameScore.retrieve(score_id, _using=self.CACHED).game is game)
+        self.assertEqual(self.requests('GET', '/classes/Game/' + game_id), 1)
+
+    def testKeepsLocalChanges(self):
+        game_id, = self.add_rows('Game', [{'title': 'Candyland', 'players': 2}])
+        game = Game.retrieve(game_id, _using=self.CACHED)
+        game.title = 'local edit'
+        time.sleep(0.002)
+        self.server.backend.update(self.server.backend.classes['Game'][game_id], {'title': 'x', 'players': 4})
+
+        self.assertTrue(Game.Query.using(self.CACHED).get(objectId=game_id) is game)
+        self.assertEqual((game.title, game.players), ('local edit', 4))
+        game.save(_using=self.CACHED)
+        self.assertEqual(self.server.backend.classes['Game'][game_id]['title'], 'local edit')
+
+
+class ScoreCard(Object):
+    game = ForeignKey(Game, 'game')
+
+
+class PrefetchTest(StandInTestCase):
+
+    def setUp(self):
+        super(PrefetchTest, self).setUp()
+        self.game_ids = self.add_rows('Game', [{'title': 'game %s' % i} for i in range(0, 3)])
+        pointers = [{'__type': 'Pointer', 'className': 'Game', 'objectId': oid} for oid in self.game_ids]
+        for class_name in ('GameScore', 'ScoreCard'):
+            self.add_rows(class_name, [{'score': s, 'game': pointers[s % 3]} for s in range(0, 12)])
+
+    def check(self, klass):
+        scores = klass.Query.using(self.USING).all().prefetch_related('game')._fetch()
+        self.assertEqual(sorted(set(s.game.title for s in scores)), ['game 0', 'game 1', 'game 2'])
+        self.assertEqual(self.requests('GET', '/classes/Game'), 1, 'One query should load every game')
+        self.assertEqual(sum(n for r, n in self.server.requests.items() if r.startswith('GET /classes/Game/')), 0)
+
+    def testPointers(self):
+        self.check(GameScore)
+
+    def testForeignKeys(self):
+        self.check(ScoreCard)
+
+    def testIterator(self):
+        scores = GameScore.Query.using(self.USING).all().prefetch_related('game').iterator(chunk_size=5)
+        self.assertEqual(len([s.game.title for s in scores]), 12)
+        self.assertEqual(self.requests('GET', '/classes/Game'), 3, 'One query per page')
+
+
+class LazyFieldsTest(StandInTestCase):
+    ROW = {'objectId': 'abc', 'score': 3, 'createdAt': '2020-01-02T03:04:05.678Z',
+           'updatedAt': '2020-01-02T03:04:05.678Z',
+           'last_played': {'__type': 'Date', 'iso': '2020-02-03T04:05:06.789Z'},
+           'game': {'__type': 'Pointer', 'className': 'Game', 'objectId': 'xyz'}}
+
+    def testDecodedOnRead(self):
+        score = GameScore._from_parse(dict(self.ROW), _lazy=True)
+        self.assertEqual(sorted(score.__dict__['_lazy_fields']), ['createdAt', 'game', 'last_played', 'updatedAt'])
+        self.assertEqual(score.score, 3)
+        self.assertEqual(score.last_played, Date._from_str('2020-02-03T04:05:06.789Z'))
+        self.assertEqual(score.createdAt.year, 2020)
+        self.assertTrue(isinstance(score.game, Game))
+        self.assertEqual(sorted(score.__dict__['_lazy_fields']), ['updatedAt'])
+
+    def testSetBeforeRead(self):
+        score = GameScore._from_parse(dict(self.ROW), _lazy=True)
+        now = datetime.datetime(2021, 1, 1)
+        score.last_played = now
+        self.assertEqual(score.last_played, now)
+        self.assertEqual(score._to_native()['last_played'], {'__type': 'Date', 'iso': now.isoformat()})
+        self.assertEqual(sorted(score._changed_fields(score._to_native())), ['last_played'])
+
+    def testLazyQuery(self):
+        game_id, = self.add_rows('Game', [{'title': 'Candyland'}])
+        self.add_rows('GameScore', [{'score': s, 'game': {'__type': 'Pointer', 'className': 'Game', 'objectId': game_id}}
+                                    for s in range(0, 3)])
+        scores = GameScore.Query.using(self.USING).all().lazy()._fetch()
+        self.assertTrue(all('game' in s.__dict__['_lazy_fields'] for s in scores))
+        self.assertEqual(set(s.game.objectId for s in scores), set([game_id]))
+        scores[0].save(_using=self.USING)
+        self.assertEqual(self.requests('PUT', '/classes/GameScore/' + scores[0].objectId), 0,
+                         'Decoding a lazy field should not make it look changed')
+
+
+class RowsTest(StandInTestCase):
+
+    def testRows(self):
+        fields = query.RowFields(GameScore)
+        rows = fields.build([{'objectId': 'a', 'score': 1},
+                             {'objectId': 'b', 'createdAt': '2020-01-02T03:04:05.678Z',
+                              'game': {'__type': 'Pointer', 'className': 'Game', 'objectId': 'g'}}])
+        self.assertEqual(fields.names, ['objectId', 'score', 'createdAt', 'game'])
+        self.assertEqual(rows[0].score, 1)
+        self.assertRaises(AttributeError, getattr, rows[0], 'game')
+        self.assertRaises(AttributeError, getattr, rows[1], 'score')
+        self.assertEqual(rows[1].createdAt, Date._from_str('2020-01-02T03:04:05.678Z'))
+        self.assertTrue(isinstance(rows[1].game, Game))
+        self.assertFalse(hasattr(rows[0], '__dict__'))
+
+        score = rows[1].to_object()
+        self.assertTrue(isinstance(score, GameScore))
+        self.assertEqual((score.objectId, score.game.objectId), ('b', 'g'))
+
+    def testCopyAndPickle(self):
+        fields = query.RowFields(GameScore)
+        rows = fields.build([{'objectId': 'a', 'score': 1}, {'objectId': 'b', 'player_name': 'p'}])
+        for row in (copy.copy(rows[0]), copy.deepcopy(rows[0]), pickle.loads(pickle.dumps(rows[0]))):
+            self.assertEqual((row.objectId, row.score), ('a', 1))
+            self.assertRaises(AttributeError, getattr, row, 'player_name')
+        copied = pickle.loads(pickle.dumps(rows[1]))
+        self.assertEqual(copied.player_name, 'p')
+        self.assertRaises(AttributeError, getattr, copied, 'score')
+
+    def testQuery(self):
+        self.add_rows('GameScore', [{'score': s, 'player_name': 'p%s' % s} for s in range(0, 5)])
+        rows = GameScore.Query.using(self.USING).all().order_by('score').as_rows()._fetch()
+        self.assertEqual([(r.score, r.player_name) for r in rows], [(s, 'p%s' % s) for s in range(0, 5)])
+        self.assertEqual(rows[2].to_object().player_name, 'p2')
+
+
+class ColumnsTest(StandInTestCase):
+
+    def date(self, iso):
+        return {'__type': 'Date', 'iso': iso}
+
+    def testWidening(self):
+        builder = columns.ColumnBuilder(['n', 'when', 'flag'])
+        builder.add([{'n': 1, 'when': self.date('2020-01-02T03:04:05.678Z'), 'flag': True}])
+        builder.add([{'n': 2.5, 'when': 'soon', 'flag': None}])
+        result = builder.result()
+        self.assertEqual(list(result['n']), [1.0, 2.5])
+        when = list(result['when'])
+        self.assertEqual(when, [Date._from_str('2020-01-02T03:04:05.678Z'), 'soon'])
+        self.assertEqual(when[0].tzinfo, Date.UTC)
+        self.assertEqual(list(result['flag']), [True, None])
+
+    def testWidenedDates(self):
+        builder = columns.ColumnBuilder(['when'])
+        builder.add([{'when': self.date('2020-01-02T03:04:05.000Z')}, {}])
+        builder.add([{'when': self.date('2021-01-02T03:04:05.000Z')}, {'when': 7}])
+        when = list(builder.result()['when'])
+        self.assertEqual(when, [Date._from_str('2020-01-02T03:04:05.000Z'), None,
+                                Date._from_str('2021-01-02T03:04:05.000Z'), 7])
+        self.assertFalse(any(isinstance(v, (float, dict)) for v in when))
+
+    def testQuery(self):
+        self.add_rows('GameScore', [{'score': s, 'player_name': 'p%s' % s} for s in range(0, 3)])
+        result = GameScore.Query.using(self.USING).all().order_by('score').values_columns('score', 'createdAt')
+        self.assertEqual(list(result['score']), [0, 1, 2])
+        if columns.numpy is None:
+            self.assertEqual(result['createdAt'].typecode, 'd')
+            self.assertTrue(all(v > 0 for v in result['createdAt']))
 
 
 if __name__ == "__main__":
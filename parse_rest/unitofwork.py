@@ -0,0 +1,381 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Write-behind sessions. Inside a session, saves, deletes, increments and
+relation changes are queued instead of sent, merged per object and flushed
+through ParseBatcher as a few /batch requests:
+
+    with parse_rest.session():
+        score.increment('points')
+        score.increment('points', 2)
+        score.addRelation('players', [p1])
+        other.save()
+    # one batch request: score gets a single Increment of 3 and the
+    # AddRelation, other gets its changed fields
+'''
+
+from builtins import object
+
+import collections
+import threading
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+from . import core
+from .connection import ParseBatcher
+
+# queued objects that trigger a flush before the session ends
+DEFAULT_FLUSH_AT = 500
+
+_local = threading.local()
+
+
+def current_session():
+    '''The innermost session active on this thread, or None'''
+    stack = getattr(_local, 'sessions', None)
+    return stack[-1] if stack else None
+
+
+def session(_using=None, _as_user=None, _throttle=None, flush_at=DEFAULT_FLUSH_AT, max_in_flight=1):
+    '''Start a write-behind session, to be used in a with statement'''
+    return Session(_using=_using, _as_user=_as_user, _throttle=_throttle,
+                   flush_at=flush_at, max_in_flight=max_in_flight)
+
+
+def merge_operation(current, op):
+    '''
+        Combine two operations on the same field into one, or return None
+        when they have to be sent separately
+    '''
+    if current['__op'] != op['__op']:
+        return None
+    if op['__op'] == 'Increment':
+        return {'__op': 'Increment', 'amount': current['amount'] + op['amount']}
+    if op['__op'] in ('AddRelation', 'RemoveRelation'):
+        objects = list(current['objects'])
+        objects.extend(o for o in op['objects'] if o not in objects)
+        return {'__op': op['__op'], 'objects': objects}
+    return None
+
+
+class Round(object):
+    '''
+        Field operations sent together, at most one (merged) operation per
+        field. queued keeps the value each incremented field had locally
+        when it was queued, to tell whether it has been changed since
+    '''
+    def __init__(self):
+        self.payload = {}
+        self.queued = {}
+
+    def add(self, key, op, value):
+        current = self.payload.get(key)
+        if current is None:
+            self.payload[key] = op
+            if op['__op'] == 'Increment':
+                self.queued[key] = value
+            return True
+        if op['__op'] == 'Increment' and self.queued.get(key) != value:
+            # the field changed in between: the two can't be summed
+            return False
+        merged = merge_operation(current, op)
+        if merged is None:
+            return False
+        self.payload[key] = merged
+        return True
+
+
+class Pending(object):
+    '''Everything queued for one object'''
+    def __init__(self, obj, _using=None, _as_user=None):
+        self.obj = obj
+        self.using = _using
+        self.as_user = _as_user
+        self.delete = False
+        # ('save', None) and ('operations', Round) steps, in the order they
+        # were queued
+        self.steps = []
+
+    def add_save(self):
+        if not self.steps or self.steps[-1][0] != 'save':
+            self.steps.append(('save', None))
+
+    def add_operation(self, payload):
+        last = self.steps[-1][1] if self.steps and self.steps[-1][0] == 'operations' else None
+        for key, op in list(payload.items()):
+            value = self.obj.__dict__.get(key)
+            if last is None or not last.add(key, op, value):
+                last = Round()
+                last.add(key, op, value)
+                self.steps.append(('operations', last))
+
+    def has_save(self):
+        return any(kind == 'save' for kind, step in self.steps)
+
+    def methods(self, _throttle=None):
+        '''
+            ParseBatcher methods for what can be sent now, as (method, work)
+            pairs, work being the steps requeue() needs to queue it again.
+            Parse runs the requests of a batch side by side, so only the
+            first step goes, with the operations that can share the body of
+            its save. The rest waits for the next batch
+        '''
+        obj = self.obj
+        if self.delete:
+            self.delete = False
+            return [(lambda batch: obj.delete(batch=batch, _using=self.using, _as_user=self.as_user, _throttle=_throttle),
+                     [('delete', None)])]
+        steps = list(self.steps)
+        if not steps:
+            return []
+        if not obj.objectId:
+            # nothing else can go before the object is created
+            steps.insert(0, steps.pop([kind for kind, step in steps].index('save')))
+        if steps[0][0] == 'operations':
+            first = steps[0][1]
+            if len(steps) < 2 or steps[1][0] != 'save' or not self._fits(first, Round()):
+                self.steps = steps[1:]
+                return [(self._operations_method(first.payload, first.queued, _throttle), steps[:1])]
+            work, steps = steps[:2], steps[2:]
+        else:
+            work, steps = steps[:1], steps[1:]
+
+        body = Round()
+        for kind, step in work:
+            if kind == 'operations':
+                body.payload.update(step.payload)
+                body.queued.update(step.queued)
+        while steps and steps[0][0] == 'operations' and self._fits(steps[0][1], body):
+            body.payload.update(steps[0][1].payload)
+            body.queued.update(steps[0][1].queued)
+            work.append(steps.pop(0))
+        self.steps = steps
+        return [(self._save_method(body.payload, body.queued, _throttle), work)]
+
+    def _fits(self, step, body):
+        '''
+            Whether the operations of step can go in the body of the save:
+            not if they touch a field in there already, or one the save
+            sends a new value for
+        '''
+        obj = self.obj
+        keys = set(step.payload)
+        if keys & set(body.payload):
+            return False
+        return not obj.objectId or not keys & set(obj._changed_fields(obj._to_native()))
+
+    def requeue(self, work):
+        '''Queue again the work methods() handed out, ahead of anything left'''
+        steps = []
+        for step in work:
+            if step[0] == 'delete':
+                self.delete = True
+            else:
+                steps.append(step)
+        self.steps = steps + self.steps
+
+    def has_work(self):
+        return bool(self.delete or self.steps)
+
+    def _save_method(self, payload, queued, _throttle):
+        obj = self.obj
+
+        def method(batch):
+            call = obj.save(batch=batch, _using=self.using, _as_user=self.as_user, _throttle=_throttle)
+            if call is None:
+                # nothing changed but the operations
+                if not payload:
+                    return None
+                return obj._operations(payload, batch=batch, _using=self.using,
+                                       _as_user=self.as_user, _throttle=_throttle, _queued=queued)
+            request, callback = call
+            if not payload:
+                return request, callback
+            request.setdefault('body', {}).update(payload)
+
+            def call_back(response):
+                result = callback(response)
+                obj._apply_operations(payload, queued)
+                return result
+            return request, call_back
+        return method
+
+    def _operations_method(self, payload, queued, _throttle):
+        return lambda batch: self.obj._operations(payload, batch=batch, _using=self.using, _as_user=self.as_user,
+                                                  _throttle=_throttle, _queued=queued)
+
+
+def track(method, done, index):
+    '''method, adding index to done once Parse has accepted what it sent'''
+    def tracked(batch):
+        call = method(batch)
+        if call is None:
+            done.add(index)
+            return None
+        request, callback = call
+
+        def call_back(response):
+            result = callback(response)
+            done.add(index)
+            return result
+        return request, call_back
+    return tracked
+
+
+class Session(object):
+    '''
+        Queues writes made on this thread while it is active. Writes are
+        merged per object: saves in a row become one, increments to a field
+        are summed, Add/RemoveRelation calls are combined and a delete
+        replaces whatever was queued before it. Writes to an object reach
+        Parse in the order they were made, those that have to follow
+        another in a later batch request. Everything is sent through
+        ParseBatcher when the session ends, or as soon as flush_at objects
+        are queued. A session that ends with an exception sends nothing.
+
+        Increments and relation changes update the object in memory once
+        they have been sent, as saves do.
+    '''
+    def __init__(self, _using=None, _as_user=None, _throttle=None, flush_at=DEFAULT_FLUSH_AT, max_in_flight=1):
+        self._using = _using
+        self._as_user = _as_user
+        self._throttle = _throttle
+        self.flush_at = flush_at
+        self.max_in_flight = max_in_flight
+        # id(object) -> Pending, in the order objects were first touched
+        self._pending = collections.OrderedDict()
+
+    def __enter__(self):
+        if not hasattr(_local, 'sessions'):
+            _local.sessions = []
+        _local.sessions.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.sessions.remove(self)
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __repr__(self):
+        return u'<Session: %s pending>' % len(self._pending)
+
+    def _entry(self, obj, _using=None, _as_user=None):
+        entry = self._pending.get(id(obj))
+        if entry is None:
+            entry = Pending(obj, _using=_using or self._using, _as_user=_as_user or self._as_user)
+            self._pending[id(obj)] = entry
+        return entry
+
+    def save(self, obj, _using=None, _as_user=None):
+        entry = self._entry(obj, _using, _as_user)
+        if entry.delete:
+            LOGGER.warning(u'Ignoring save of %r: it is already queued for deletion' % obj)
+            return
+        entry.add_save()
+        self._maybe_flush()
+
+    def delete(self, obj, _using=None, _as_user=None):
+        if not obj.objectId:
+            # never saved: just forget whatever was queued for it
+            self._pending.pop(id(obj), None)
+            return
+        entry = self._entry(obj, _using, _as_user)
+        entry.delete = True
+        entry.steps = []
+        self._maybe_flush()
+
+    def operation(self, obj, payload, _using=None, _as_user=None):
+        '''Queue field operations ({key: {'__op': ...}}) for obj'''
+        entry = self._entry(obj, _using, _as_user)
+        if entry.delete:
+            LOGGER.warning(u'Ignoring %s on %r: it is already queued for deletion' % (list(payload), obj))
+            return
+        entry.add_operation(payload)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if self.flush_at and len(self._pending) >= self.flush_at:
+            self.flush()
+
+    def discard(self):
+        '''Drop everything queued without sending it'''
+        self._pending.clear()
+
+    def flush(self):
+        '''
+            Send everything queued, one ParseBatcher run per app and user.
+            Failures are collected and raised together as a
+            core.ParseBatchError whose errors are (object, error) pairs. A
+            request that fails as a whole raises its own error straight
+            away. Either way whatever wasn't sent, or failed, is queued
+            again, so flush() can be called again to retry it (or
+            discard() to drop it)
+        '''
+        pending, self._pending = self._pending, collections.OrderedDict()
+        groups = collections.OrderedDict()
+        for entry in list(pending.values()):
+            if not (entry.has_save() or entry.delete) and not entry.obj.objectId:
+                if entry.steps:
+                    LOGGER.warning(u'Dropping %s on %r: it was never saved' % (list(entry.steps[0][1].payload), entry.obj))
+                continue
+            groups.setdefault((entry.using, id(entry.as_user)), []).append(entry)
+
+        errors = []
+        try:
+            for entries in list(groups.values()):
+                # later passes send what has to wait for the one before
+                while entries:
+                    failed = self._send(entries, errors)
+                    entries = [entry for entry in entries
+                               if entry.steps and entry.obj.objectId and entry not in failed]
+        finally:
+            for entry in list(pending.values()):
+                if entry.has_work():
+                    self._pending.setdefault(id(entry.obj), entry)
+        if errors:
+            raise core.ParseBatchError(errors)
+
+    def _send(self, entries, errors):
+        '''
+            Send what can be sent for entries, queueing back on each entry
+            whatever doesn't get through. Returns the entries that failed
+        '''
+        methods, owners = [], []
+        for entry in entries:
+            for method, work in entry.methods(self._throttle):
+                methods.append(method)
+                owners.append((entry, work))
+        if not methods:
+            return []
+        done = set()
+        try:
+            ParseBatcher().batch([track(method, done, index) for index, method in enumerate(methods)],
+                                 _using=entries[0].using, _as_user=entries[0].as_user,
+                                 _throttle=self._throttle, max_in_flight=self.max_in_flight)
+        except core.ParseBatchError as e:
+            errors.extend((owners[index][0].obj, error) for index, error in e.errors)
+        finally:
+            unsent = collections.OrderedDict()
+            for index, (entry, work) in enumerate(owners):
+                if index not in done:
+                    unsent.setdefault(entry, []).append(work)
+            for entry, work in list(unsent.items()):
+                entry.requeue([step for steps in work for step in steps])
+        return list(unsent)
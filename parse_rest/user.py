@@ -14,6 +14,7 @@ import logging
 logging.basicConfig()
 LOGGER = logging.getLogger(__name__)
 
+from .cache import invalidate_queries
 from .core import ResourceRequestLoginRequired
 from .connection import API_ROOT
 from .datatypes import ParseResource, ParseType, Function, Object
@@ -80,13 +81,22 @@ class User(ParseResource):
         if not _as_user:
             extra = {'X-Parse-Session-Token': self.sessionToken}
         url = self._absolute_url
-        data = self._to_native()
-        return self.__class__.PUT(url, _app_id=_using, _user=_as_user, batch=batch, _throttle=_throttle, extra_headers=extra, **data)
+        data = self._changed_fields(self._to_native())
+        if not data:
+            return None
+        response = self.__class__.PUT(url, _app_id=_using, _user=_as_user, batch=batch, _throttle=_throttle, extra_headers=extra, **data)
+        if not batch:
+            self._take_snapshot(data)
+            invalidate_queries(self.__class__.ENDPOINT_ROOT)
+        return response
 
     @login_required
     def delete(self):
         session_header = {'X-Parse-Session-Token': self.sessionToken}
-        return self.DELETE('/users/'+self.objectId, extra_headers=session_header)
+        response = self.DELETE('/users/'+self.objectId, extra_headers=session_header)
+        self._forget()
+        invalidate_queries(self.__class__.ENDPOINT_ROOT)
+        return response
 
     @staticmethod
     def signup(username, password, **kw):
@@ -28,7 +28,7 @@ setup(
     ],
     description='A client library for Parse.com\'.s REST API',
     url='https://github.com/dgrtwo/ParsePy',
-    packages=['parse_rest'],
+    packages=['parse_rest', 'parse_rest.benchmarks'],
     maintainer='David Robinson',
     maintainer_email='dgrtwo@princeton.edu',
     cmdclass={'test': TestCommand},